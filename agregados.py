@@ -0,0 +1,153 @@
+from collections import namedtuple
+from datetime import datetime, time, timedelta
+
+from sqlalchemy import case, func
+
+from consumo import delta_energia
+from dialetos import insert_do_dialeto
+
+
+# ==========================================================
+# AGREGADOS HIERÁRQUICOS (minuto / hora / dia)
+# ==========================================================
+# Cada tabela de agregados guarda, por (pzem_id, bucket_inicio), o número
+# de amostras e min/max/soma/último de cada grandeza, mais o consumo do
+# bucket (energy_delta, em kWh). A média é soma / amostras, o que permite
+# fundir lotes parciais com um simples upsert incremental.
+
+Resolucao = namedtuple("Resolucao", ["nome", "passo"])
+
+RESOLUCOES = (
+    Resolucao("minuto", timedelta(minutes=1)),
+    Resolucao("hora", timedelta(hours=1)),
+    Resolucao("dia", timedelta(days=1)),
+)
+
+GRANDEZAS = ("voltage", "current", "power", "pf", "energy")
+
+
+def inicio_bucket(instante, resolucao):
+    """Início do bucket (minuto, hora ou dia) que contém 'instante'"""
+    if resolucao == "minuto":
+        return instante.replace(second=0, microsecond=0)
+    if resolucao == "hora":
+        return instante.replace(minute=0, second=0, microsecond=0)
+    if resolucao == "dia":
+        return datetime.combine(instante.date(), time.min)
+    raise ValueError(f"Resolução desconhecida: {resolucao}")
+
+
+def alinhado(instante, passo):
+    """True se 'instante' cai numa fronteira de bucket de tamanho 'passo'"""
+    meia_noite = datetime.combine(instante.date(), time.min)
+    return (instante - meia_noite) % passo == timedelta(0)
+
+
+def escolher_resolucao(inicio, fim, passo_max=None):
+    """
+    A resolução mais grossa cujos buckets cobrem [inicio, fim) exatamente
+    e não são maiores que passo_max. None → usar os dados brutos.
+    """
+    for resolucao in reversed(RESOLUCOES):
+        if passo_max is not None and resolucao.passo > passo_max:
+            continue
+        if alinhado(inicio, resolucao.passo) and alinhado(fim, resolucao.passo):
+            return resolucao.nome
+    return None
+
+
+def _novo_bucket(pzem_id, bucket, linha):
+    valores = {"pzem_id": pzem_id, "bucket_inicio": bucket, "amostras": 0,
+               "energy_delta": 0.0, "ultimo_em": linha["timestamp"],
+               "power_max_em": linha["timestamp"]}
+    for g in GRANDEZAS:
+        v = float(linha[g])
+        valores[f"{g}_min"] = v
+        valores[f"{g}_max"] = v
+        valores[f"{g}_soma"] = 0.0
+        valores[f"{g}_ultimo"] = v
+    return valores
+
+
+def agregar_amostras(linhas, ancoras, maximo=None):
+    """
+    Agrega as linhas de energy_data em buckets parciais por resolução.
+
+    ancoras: {pzem_id: (instante, energy)} — última leitura já agregada de
+    cada PZEM, usada para o delta da primeira amostra do lote. Amostras
+    iguais ou anteriores à âncora (chegadas fora de ordem) contam para
+    min/max/médias mas não para o consumo. maximo: fim de escala do
+    contador, para detetar rollover (ver consumo.delta_energia).
+
+    Devolve ({resolucao: [valores, ...]}, novas_ancoras).
+    """
+    buckets = {r.nome: {} for r in RESOLUCOES}
+    ancoras = dict(ancoras)
+
+    for linha in sorted(linhas, key=lambda l: (l["pzem_id"], l["timestamp"])):
+        pzem_id = linha["pzem_id"]
+        instante = linha["timestamp"]
+        energia = float(linha["energy"])
+
+        delta = 0.0
+        ancora = ancoras.get(pzem_id)
+        if ancora is None or instante > ancora[0]:
+            if ancora is not None:
+                delta = delta_energia(ancora[1], energia, maximo)
+            ancoras[pzem_id] = (instante, energia)
+
+        for resolucao in RESOLUCOES:
+            bucket = inicio_bucket(instante, resolucao.nome)
+            chave = (pzem_id, bucket)
+            valores = buckets[resolucao.nome].get(chave)
+            if valores is None:
+                valores = buckets[resolucao.nome][chave] = _novo_bucket(pzem_id, bucket, linha)
+
+            valores["amostras"] += 1
+            valores["energy_delta"] += delta
+            for g in GRANDEZAS:
+                v = float(linha[g])
+                valores[f"{g}_soma"] += v
+                if v < valores[f"{g}_min"]:
+                    valores[f"{g}_min"] = v
+                if v > valores[f"{g}_max"]:
+                    valores[f"{g}_max"] = v
+                    if g == "power":
+                        valores["power_max_em"] = instante
+            if instante >= valores["ultimo_em"]:
+                valores["ultimo_em"] = instante
+                for g in GRANDEZAS:
+                    valores[f"{g}_ultimo"] = float(linha[g])
+
+    return {nome: list(b.values()) for nome, b in buckets.items()}, ancoras
+
+
+def instrucao_upsert(tabela, dialeto, valores):
+    """
+    INSERT ... ON CONFLICT (pzem_id, bucket_inicio) DO UPDATE que funde os
+    buckets parciais com os já gravados (Postgres e SQLite).
+    """
+    stmt = insert_do_dialeto(dialeto)(tabela).values(valores)
+    if dialeto == "postgresql":
+        menor, maior = func.least, func.greatest
+    else:
+        menor, maior = func.min, func.max   # min()/max() escalares no SQLite
+
+    t, novo = tabela.c, stmt.excluded
+    mais_recente = novo.ultimo_em >= t.ultimo_em
+
+    campos = {
+        "amostras": t.amostras + novo.amostras,
+        "energy_delta": t.energy_delta + novo.energy_delta,
+        "ultimo_em": maior(t.ultimo_em, novo.ultimo_em),
+        "power_max_em": case((novo.power_max > t.power_max, novo.power_max_em),
+                             else_=t.power_max_em),
+    }
+    for g in GRANDEZAS:
+        campos[f"{g}_min"] = menor(t[f"{g}_min"], novo[f"{g}_min"])
+        campos[f"{g}_max"] = maior(t[f"{g}_max"], novo[f"{g}_max"])
+        campos[f"{g}_soma"] = t[f"{g}_soma"] + novo[f"{g}_soma"]
+        campos[f"{g}_ultimo"] = case((mais_recente, novo[f"{g}_ultimo"]),
+                                     else_=t[f"{g}_ultimo"])
+
+    return stmt.on_conflict_do_update(index_elements=["pzem_id", "bucket_inicio"], set_=campos)
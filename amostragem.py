@@ -0,0 +1,94 @@
+import numpy as np
+
+
+# ==========================================================
+# REDUÇÃO DE PONTOS PARA GRÁFICOS (downsampling)
+# ==========================================================
+# As funções devolvem índices dos pontos a manter, para que todas as
+# séries do mesmo gráfico (tensão, corrente, potência...) sejam reduzidas
+# de forma alinhada a partir de uma série de referência.
+
+METODOS = ("lttb", "minmax")
+
+
+def lttb(xs, ys, limite):
+    """
+    Largest-Triangle-Three-Buckets: mantém o primeiro e o último ponto e,
+    em cada um dos limite-2 baldes, o ponto que forma o maior triângulo
+    com o ponto escolhido antes e a média do balde seguinte.
+    """
+    n = len(xs)
+    if limite >= n:
+        return list(range(n))
+    if limite < 3:
+        return [0, n - 1][:max(limite, 1)]
+
+    xs = np.asarray(xs, dtype=float)
+    ys = np.asarray(ys, dtype=float)
+
+    # Bordas dos baldes: o balde i é [bordas[i], bordas[i + 1]); o último
+    # "balde seguinte" pode ficar vazio e aí conta o último ponto
+    passo = (n - 2) / (limite - 2)
+    bordas = np.minimum((np.arange(limite) * passo).astype(np.int64) + 1, n)
+
+    # Médias de todos os baldes de uma vez, por somas acumuladas
+    acum_x = np.concatenate(([0.0], np.cumsum(xs)))
+    acum_y = np.concatenate(([0.0], np.cumsum(ys)))
+    inicio, fim = bordas[1:-1], bordas[2:]
+    tamanho = fim - inicio
+    vazio = tamanho == 0
+    tamanho = np.where(vazio, 1, tamanho)
+    medias_x = np.where(vazio, xs[-1], (acum_x[fim] - acum_x[inicio]) / tamanho)
+    medias_y = np.where(vazio, ys[-1], (acum_y[fim] - acum_y[inicio]) / tamanho)
+
+    # Só a escolha do ponto anterior é sequencial; a área de cada balde é
+    # calculada de uma vez
+    indices = np.empty(limite, dtype=np.int64)
+    indices[0], indices[-1] = 0, n - 1
+    a = 0
+    for i in range(limite - 2):
+        inicio, fim = bordas[i], bordas[i + 1]
+        ax, ay = xs[a], ys[a]
+        areas = np.abs((ax - medias_x[i]) * (ys[inicio:fim] - ay)
+                       - (ax - xs[inicio:fim]) * (medias_y[i] - ay))
+        a = inicio + int(np.argmax(areas))
+        indices[i + 1] = a
+
+    return indices.tolist()
+
+
+def minmax(ys, limite):
+    """Mínimo e máximo de cada balde (preserva picos e vales), por ordem"""
+    n = len(ys)
+    if limite >= n:
+        return list(range(n))
+
+    ys = np.asarray(ys, dtype=float)
+    baldes = max(1, limite // 2)
+    bordas = np.minimum((np.arange(baldes + 1) * (n / baldes)).astype(np.int64), n)
+    inicio, fim = bordas[:-1], bordas[1:]
+    fatia = ys[:bordas[-1]]
+
+    # Mínimo/máximo de cada balde com reduceat; o índice é a primeira
+    # posição do balde com esse valor, como min()/max() em caso de empate
+    tamanhos = fim - inicio
+    i_min = _primeiro_igual(fatia, np.minimum.reduceat(fatia, inicio), inicio, tamanhos)
+    i_max = _primeiro_igual(fatia, np.maximum.reduceat(fatia, inicio), inicio, tamanhos)
+
+    pares = np.column_stack((np.minimum(i_min, i_max), np.maximum(i_min, i_max))).ravel()
+    manter = np.ones(len(pares), dtype=bool)
+    manter[1::2] = i_min != i_max
+    return pares[manter].tolist()
+
+
+def _primeiro_igual(valores, alvos, inicio, tamanhos):
+    """Primeiro índice de cada balde cujo valor é o alvo desse balde"""
+    posicoes = np.flatnonzero(valores == np.repeat(alvos, tamanhos))
+    return posicoes[np.searchsorted(posicoes, inicio)]
+
+
+def reduzir(xs, ys, limite, metodo="lttb"):
+    """Índices a manter para desenhar no máximo 'limite' pontos"""
+    if metodo == "minmax":
+        return minmax(ys, limite)
+    return lttb(xs, ys, limite)
@@ -0,0 +1,254 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import numpy as np
+
+
+# ==========================================================
+# ANALÍTICA VETORIZADA (métricas de custo e eficiência)
+# ==========================================================
+# As séries por bucket (minuto ou hora dos agregados) são lidas uma vez
+# para arrays NumPy de forma (buckets, pzems) e todas as métricas saem
+# de operações vetorizadas sobre esses arrays, ponderadas pelo tempo:
+# "horas em pico" são horas, não número de registos.
+#
+# As funções não tocam na base de dados nem no Flask: recebem arrays e
+# devolvem números, para poderem ser testadas e medidas isoladamente
+# (python analitica.py corre um benchmark com um ano de dados sintéticos).
+
+Serie = namedtuple("Serie", ["instantes", "pzems", "potencia", "pico", "energia", "passo"])
+Serie.__doc__ = """
+instantes: datetime64[s] do início de cada bucket (n,).
+pzems: ids dos PZEMs, pela ordem das colunas (p,).
+potencia / pico: potência média / máxima de cada bucket em W (n, p).
+energia: kWh consumidos em cada bucket (n, p).
+passo: duração de cada bucket, em segundos (int).
+"""
+
+PERCENTIS = (50, 90, 95, 99)
+
+_EPOCA = datetime(1970, 1, 1)
+
+
+def montar_serie(linhas, passo):
+    """
+    Serie a partir de (bucket_inicio, pzem_id, potência média, potência
+    máxima, kWh), em qualquer ordem. Buckets sem leitura de um PZEM ficam
+    a zero nesse PZEM.
+    """
+    linhas = list(linhas)
+    if not linhas:
+        vazio = np.zeros((0, 0))
+        return Serie(np.array([], dtype="datetime64[s]"), np.array([], dtype=int), vazio, vazio, vazio, passo)
+
+    # np.array(datetimes) converte objeto a objeto e é ~7x mais lento
+    instantes = np.fromiter(((l[0] - _EPOCA).total_seconds() for l in linhas),
+                            dtype=np.int64, count=len(linhas)).astype("datetime64[s]")
+    pzem_ids = np.fromiter((l[1] for l in linhas), dtype=np.int64, count=len(linhas))
+    valores = [np.fromiter((l[c] or 0.0 for l in linhas), dtype=float, count=len(linhas)) for c in (2, 3, 4)]
+
+    unicos, linha_idx = np.unique(instantes, return_inverse=True)
+    pzems, coluna_idx = np.unique(pzem_ids, return_inverse=True)
+
+    def _matriz(coluna):
+        m = np.zeros((len(unicos), len(pzems)))
+        m[linha_idx, coluna_idx] = valores[coluna]
+        return m
+
+    return Serie(unicos, pzems, _matriz(0), _matriz(1), _matriz(2), passo)
+
+
+def horas_acima(serie, limiares):
+    """
+    Horas em que pelo menos um PZEM esteve acima do seu limiar (W),
+    pela potência média do bucket. limiares: {pzem_id: W}.
+    """
+    if not len(serie.instantes):
+        return 0.0
+    limites = np.array([limiares.get(int(p), np.inf) for p in serie.pzems])
+    acima = (serie.potencia > limites).any(axis=1)
+    return float(acima.sum()) * serie.passo / 3600
+
+
+def fator_carga(potencia_total):
+    """Potência média / potência máxima (1 = carga constante)"""
+    if not len(potencia_total) or potencia_total.max() <= 0:
+        return 0.0
+    return float(potencia_total.mean() / potencia_total.max())
+
+
+def percentis_potencia(potencia_total, percentis=PERCENTIS):
+    """{p: W} — cada bucket pesa o mesmo, logo são percentis no tempo"""
+    if not len(potencia_total):
+        return {p: 0.0 for p in percentis}
+    valores = np.percentile(potencia_total, percentis)
+    return {p: float(v) for p, v in zip(percentis, valores)}
+
+
+def energia_por_dia(serie):
+    """(dias datetime64[D], kWh de cada dia) somando todos os PZEMs"""
+    if not len(serie.instantes):
+        return np.array([], dtype="datetime64[D]"), np.array([])
+    dias = serie.instantes.astype("datetime64[D]")
+    unicos, idx = np.unique(dias, return_inverse=True)
+    return unicos, np.bincount(idx, weights=serie.energia.sum(axis=1))
+
+
+def variacao_diaria(kwh_dia):
+    """Variação percentual de cada dia face ao anterior (dias a 0 → NaN)"""
+    if len(kwh_dia) < 2:
+        return np.array([])
+    anterior = kwh_dia[:-1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(anterior > 0, (kwh_dia[1:] - anterior) / anterior * 100, np.nan)
+
+
+def projecao_mensal(kwh_dia, preco_kwh, dias_no_mes=30):
+    """(kWh, custo) do mês ao ritmo médio dos dias com consumo"""
+    com_consumo = kwh_dia[kwh_dia > 0]
+    if not len(com_consumo):
+        return 0.0, 0.0
+    kwh = float(com_consumo.mean()) * dias_no_mes
+    return kwh, kwh * preco_kwh
+
+
+def potencia_recente(serie, horas=24):
+    """Potência média total (W) nas últimas 'horas' da série"""
+    if not len(serie.instantes):
+        return 0.0
+    desde = serie.instantes[-1] - np.timedelta64(int(horas * 3600) - serie.passo, "s")
+    return float(serie.potencia[serie.instantes >= desde].sum(axis=1).mean())
+
+
+def metricas(serie, limiares, preco_kwh, saldo_kwh, dias_no_mes=30, agora=None):
+    """Todas as métricas do relatório de custos, a partir de uma Serie"""
+    total = serie.potencia.sum(axis=1) if len(serie.instantes) else np.array([])
+    dias, kwh_dia = energia_por_dia(serie)
+    variacoes = variacao_diaria(kwh_dia)
+    variacoes = variacoes[~np.isnan(variacoes)]
+    kwh_mes, custo_mes = projecao_mensal(kwh_dia, preco_kwh, dias_no_mes)
+
+    horas_pico = horas_acima(serie, limiares)
+    horas_total = len(serie.instantes) * serie.passo / 3600
+
+    # Previsão do saldo ao ritmo das últimas 24 h (não de uma leitura instantânea)
+    kw_recente = potencia_recente(serie) / 1000
+    horas_restantes = saldo_kwh / kw_recente if kw_recente > 0 else None
+    termino = None
+    if horas_restantes is not None:
+        termino = (agora or datetime.utcnow()) + timedelta(hours=horas_restantes)
+
+    return {
+        "horas_pico": horas_pico,
+        "percentual_tempo_pico": horas_pico / horas_total * 100 if horas_total else 0.0,
+        "fator_carga": fator_carga(total),
+        "percentis_potencia": percentis_potencia(total),
+        "potencia_media": float(total.mean()) if len(total) else 0.0,
+        "potencia_maxima": float(serie.pico.sum(axis=1).max()) if len(total) else 0.0,
+        "dias": len(dias),
+        "variacao_diaria_media": float(variacoes.mean()) if len(variacoes) else 0.0,
+        "variacao_ultimo_dia": float(variacoes[-1]) if len(variacoes) else 0.0,
+        "projecao_mensal_kwh": kwh_mes,
+        "projecao_mensal_custo": custo_mes,
+        "potencia_recente_kw": kw_recente,
+        "dias_restantes": horas_restantes / 24 if horas_restantes is not None else 0.0,
+        "previsao_termino": termino,
+    }
+
+
+# ----------------------------------------------------------
+# Benchmark: python analitica.py
+# ----------------------------------------------------------
+# A referência é o cálculo que estas métricas substituíram no relatório de
+# custos: contar, por dia e em SQL, as leituras brutas de energy_data com
+# potência acima do limiar (count + sum(case ...)). Corre num SQLite em
+# memória com as mesmas tabelas e índices, e do lado NumPy mede-se também
+# a leitura dos agregados por minuto, não só as contas.
+
+def _criar_tabelas(conexao):
+    conexao.executescript("""
+        CREATE TABLE energy_data (
+            id INTEGER PRIMARY KEY, pzem_id INTEGER, timestamp DATETIME, power FLOAT
+        );
+        CREATE INDEX ix_energy_data_timestamp ON energy_data (timestamp);
+        CREATE TABLE energy_agregado_minuto (
+            bucket_inicio DATETIME, pzem_id INTEGER, amostras INTEGER,
+            power_soma FLOAT, power_max FLOAT, energia_kwh FLOAT,
+            PRIMARY KEY (bucket_inicio, pzem_id)
+        );
+    """)
+
+
+def _contagens_sql(conexao, inicio, fim, limiar):
+    """Como o antigo amostras_acima_por_dia: {dia: [amostras, acima do limiar]}"""
+    linhas = conexao.execute("""
+        SELECT date(timestamp), count(id), sum(CASE WHEN power > ? THEN 1 ELSE 0 END)
+        FROM energy_data WHERE timestamp >= ? AND timestamp < ?
+        GROUP BY date(timestamp)
+    """, (limiar, inicio, fim))
+    return {dia: [total, int(acima or 0)] for dia, total, acima in linhas}
+
+
+def _serie_sql(conexao, inicio, fim, passo):
+    """Como serie_analitica: agregados por minuto → Serie"""
+    linhas = conexao.execute("""
+        SELECT bucket_inicio, pzem_id, power_soma / amostras, power_max, energia_kwh
+        FROM energy_agregado_minuto WHERE bucket_inicio >= ? AND bucket_inicio < ?
+    """, (inicio, fim))
+    return montar_serie(
+        ((datetime.fromisoformat(b), p, media, pico, kwh) for b, p, media, pico, kwh in linhas), passo
+    )
+
+
+def _benchmark(dias=365, passo=60, pzems=(1, 2)):
+    import sqlite3
+    import time
+
+    rng = np.random.default_rng(42)
+    n = dias * 86400 // passo
+    inicio = datetime(2025, 1, 1)
+    fim = inicio + timedelta(days=dias)
+    instantes = [(inicio + timedelta(seconds=i * passo)).isoformat(" ") for i in range(n)]
+    base = 400 + 300 * np.sin(np.arange(n) * 2 * np.pi * passo / 86400)
+    limiar = 700.0
+
+    # Uma leitura bruta por PZEM e por minuto, e o agregado desse minuto
+    conexao = sqlite3.connect(":memory:")
+    _criar_tabelas(conexao)
+    for pzem in pzems:
+        potencia = np.clip(base + rng.normal(0, 150, n), 0, None).tolist()
+        conexao.executemany(
+            "INSERT INTO energy_data (pzem_id, timestamp, power) VALUES (?, ?, ?)",
+            zip([pzem] * n, instantes, potencia)
+        )
+        conexao.executemany(
+            "INSERT INTO energy_agregado_minuto VALUES (?, ?, 1, ?, ?, ?)",
+            ((t, pzem, p, p * 1.2, p * passo / 3600 / 1000) for t, p in zip(instantes, potencia))
+        )
+    conexao.commit()
+    intervalo = (inicio.isoformat(" "), fim.isoformat(" "))
+
+    t0 = time.perf_counter()
+    contagens = _contagens_sql(conexao, *intervalo, limiar)
+    t1 = time.perf_counter()
+    serie = _serie_sql(conexao, *intervalo, passo)
+    t2 = time.perf_counter()
+    resultado = metricas(serie, {pzem: limiar for pzem in pzems}, preco_kwh=10.0, saldo_kwh=100.0)
+    t3 = time.perf_counter()
+
+    amostras = sum(total for total, _ in contagens.values())
+    acima = sum(a for _, a in contagens.values())
+    print(f"📊 {amostras} leituras ({dias} dias, passo {passo}s, {len(pzems)} PZEMs)")
+    print(f"   SQL count/case (antigo): {t1 - t0:8.3f} s")
+    print(f"   NumPy (leitura+série):   {t2 - t1:8.3f} s")
+    print(f"   NumPy (métricas):        {t3 - t2:8.3f} s")
+    # O antigo contava leituras de qualquer PZEM; as horas contam o tempo
+    # em que pelo menos um esteve acima, por isso não são o mesmo número
+    print(f"   acima do limiar: {acima} leituras ({acima / amostras * 100:.1f}%)"
+          f" vs {resultado['horas_pico']:.1f} h ({resultado['percentual_tempo_pico']:.1f}% do tempo)")
+    print(f"   fator de carga: {resultado['fator_carga']:.4f}"
+          f", p95: {resultado['percentis_potencia'][95]:.0f} W")
+
+
+if __name__ == "__main__":
+    _benchmark()
@@ -1,32 +1,46 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, Response, stream_with_context
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime, timezone, timedelta
-from threading import Lock
-import os, time
+import os, time, math, json, atexit, threading
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
 from config import Config
+from fila_ingestao import FilaIngestao
+from estado_vivo import criar_estado_vivo
+from intervalos import (Intervalo, IntervaloInvalido, intervalo_periodo, intervalo_dia, intervalo_datas,
+                        intervalo_mes_atual, intervalo_ultimos_dias,
+                        filtro_intervalo)
+from agregados import RESOLUCOES, agregar_amostras, instrucao_upsert, escolher_resolucao
+from consumo import consumo_das_leituras
+from relatorio_cache import (TODOS_PZEMS, dias_do_intervalo, dia_fechado, serializar,
+                             desserializar, instrucao_guardar)
+from amostragem import METODOS, reduzir
+from streaming import formato_pedido, resposta_stream
+from tarefas import GestorTarefas, FilaTarefasCheia
+from consultas_paralelas import ExecutorConsultas
+from respostas import JSONRapido, ativar_compressao
+from serie_binaria import pedido_binario, resposta_serie_binaria
+from eventos import HubEventos
+from sinais import Sinal
+from controlo_reles import IndiceLimiares
+from fila_comandos import analisar_comando, instrucao_enfileirar, identificador, ler_identificadores
+import analitica
+import numpy as np
+from exportacao import (FORMATOS as FORMATOS_EXPORTACAO, ALIASES as ALIASES_EXPORTACAO,
+                        gerar_exportacao, comprimir_gzip)
+import click
 import traceback
-from sqlalchemy import func
-
-# =========================================================
-# VARIÁVEIS GLOBAIS
-# =========================================================
-dados_pzem = {
-    "pzem1": {"voltage": 0, "current": 0, "power": 0, "energy": 0, "ultima_atualizacao": None},
-    "pzem2": {"voltage": 0, "current": 0, "power": 0, "energy": 0, "ultima_atualizacao": None}
-}
-
-ULTIMO_LDR = {"valorLuz": 0, "R1": 0}
-
-dados_lock = Lock()
+from sqlalchemy import func, event, or_, text, update
+from sqlalchemy.orm import declared_attr, Session
 
 # =========================================================
 # 1️⃣ CRIAÇÃO DO APP E CARREGAMENTO DAS CONFIGURAÇÕES
 # =========================================================
 app = Flask(__name__)
 app.config.from_object(Config)
+app.json = JSONRapido(app)  # orjson quando instalado (ver respostas.py)
+ativar_compressao(app)
 
 # =========================================================
 # 2️⃣ AJUSTE SEGURO DO DATABASE_URL
@@ -66,6 +80,7 @@ login_manager.login_view = "autenticacao"
 # =========================================================
 # 5️⃣ IMPORTS DOS PICOS (AGORA QUE O DB EXISTE)
 # =========================================================
+from picos import candidatos_pico, instrucao_upsert_pico, inicio_semana
 
 # ==========================================================
 # CRIAÇÃO AUTOMÁTICA DAS TABELAS NO RAILWAY (Flask 3.0+)
@@ -97,41 +112,260 @@ def base():
 # -----------------------------
 API_KEYS = {"SUA_CHAVE_API_SECRETA": "ESP8266"}
 
-dados_pzem = {
-    "pzem1": {"voltage":0, "current": 0, "power": 0, "energy": 0, "frequency": 0, "pf": 0, "limite": 1000, "conectado": False, "ultima_atualizacao": None},
-    "pzem2": {"voltage":0, "current": 0, "power": 0, "energy": 0, "frequency": 0, "pf": 0, "limite": 1000, "conectado": False, "ultima_atualizacao": None}
-}
-ultimo_consumo_conhecido = {"pzem1": 0.0, "pzem2": 0.0}
-comandos_pendentes = []
-dados_lock = Lock()
+# -----------------------------
+# Estado vivo (partilhado por todos os workers — ver estado_vivo.py)
+# -----------------------------
+# Chaves: "pzem:pzem1", "pzem:pzem2", "ldr", "ultimo_consumo:pzemN".
+# Os comandos para o ESP ficam na base de dados (comandos_esp), não aqui.
+PZEM_PADRAO = {"voltage": 0, "current": 0, "power": 0, "energy": 0, "frequency": 0, "pf": 0, "limite": 1000, "conectado": False, "ultima_atualizacao": None}
+LDR_PADRAO = {"valorLuz": 0, "R1": 0}
+
+estado_vivo = criar_estado_vivo(app.config["ESTADO_VIVO_BACKEND"], app.config["ESTADO_VIVO_CAMINHO"])
+
+def ler_dados_pzem():
+    """Snapshot atual dos dois PZEMs: {"pzem1": {...}, "pzem2": {...}}"""
+    estado = estado_vivo.obter_varios(["pzem:pzem1", "pzem:pzem2"])
+    return {
+        pzem_key: {**PZEM_PADRAO, **(estado[f"pzem:{pzem_key}"] or {})}
+        for pzem_key in ("pzem1", "pzem2")
+    }
+
+def atualizar_dados_pzem(pzem_key, campos):
+    """Funde novas leituras no estado do PZEM (atómico entre workers)"""
+    dados = estado_vivo.atualizar(f"pzem:{pzem_key}", campos, padrao=PZEM_PADRAO)
+    invalidar("pzem")
+    return dados
+
+def ler_ldr():
+    return estado_vivo.obter("ldr", LDR_PADRAO)
+
+# Acorda o long-poll de /api/comandos, esteja ele em que worker estiver
+sinal_comandos = Sinal(estado_vivo, "comandos", app.config["COMANDOS_INTERVALO_SINAL"])
+
+def enfileirar_comando(comando):
+    """
+    Coloca um comando na fila que o ESP consome em /api/comandos (ver
+    fila_comandos.py). Fica na sessão atual: é gravado no commit de quem
+    chamou, junto com o novo estado do relé, e só aí acorda o long-poll.
+    """
+    chave, prioridade = analisar_comando(comando)
+    db.session.execute(instrucao_enfileirar(ComandoESP.__table__, db.engine.dialect.name, {
+        "chave": chave,
+        "comando": comando,
+        "prioridade": prioridade,
+        "versao": 1,
+        "tentativas": 0,
+        "criado_em": datetime.utcnow(),
+    }))
+    db.session.info["comandos_enfileirados"] = True
+
+def retirar_comandos(limite, confirmar=False):
+    """
+    Próximos comandos a entregar ao ESP — DESLIGAR primeiro, depois por
+    antiguidade: os ainda não entregues e os entregues há mais de
+    COMANDOS_REENTREGA segundos sem ack. confirmar=True dá-os logo por
+    executados (firmwares que não mandam ack).
+    """
+    agora = datetime.utcnow()
+    prazo_ack = agora - timedelta(seconds=app.config["COMANDOS_REENTREGA"])
+    linhas = (ComandoESP.query
+              .filter(ComandoESP.confirmado_em.is_(None),
+                      or_(ComandoESP.entregue_em.is_(None), ComandoESP.entregue_em < prazo_ack))
+              .order_by(ComandoESP.prioridade, ComandoESP.criado_em, ComandoESP.id)
+              .limit(limite)
+              .all())
+
+    entregues = []
+    for linha in linhas:
+        # Só se a versão não mudou entretanto (o comando pode ter sido substituído)
+        resultado = db.session.execute(
+            update(ComandoESP)
+            .where(ComandoESP.id == linha.id, ComandoESP.versao == linha.versao)
+            .values(entregue_em=agora, tentativas=ComandoESP.tentativas + 1,
+                    confirmado_em=agora if confirmar else None)
+            .execution_options(synchronize_session=False)
+        )
+        if resultado.rowcount:
+            entregues.append({"id": identificador(linha.id, linha.versao), "comando": linha.comando})
+
+    db.session.commit()  # também devolve a ligação ao pool enquanto o long-poll espera
+    return entregues
+
+def confirmar_comandos(ids):
+    """Regista os acks do ESP: ids [(linha, versão)] já executados"""
+    if not ids:
+        return 0
+
+    agora = datetime.utcnow()
+    versoes_confirmadas = dict(ids)
+    linhas = ComandoESP.query.filter(ComandoESP.id.in_(versoes_confirmadas)).all()
+
+    confirmados = 0
+    for linha in linhas:
+        if linha.confirmado_em or linha.versao != versoes_confirmadas[linha.id]:
+            continue  # ack repetido ou de um comando já substituído
+        resultado = db.session.execute(
+            update(ComandoESP)
+            .where(ComandoESP.id == linha.id, ComandoESP.versao == linha.versao,
+                   ComandoESP.confirmado_em.is_(None))
+            .values(confirmado_em=agora)
+            .execution_options(synchronize_session=False)
+        )
+        if resultado.rowcount:
+            confirmados += 1
+            total_ms = (agora - linha.criado_em).total_seconds() * 1000
+            print(f"✅ ESP executou {linha.comando} em {total_ms:.0f} ms "
+                  f"({linha.tentativas} entrega(s))")
+
+    # Os avulsos não ocupam lugar depois de executados; os dos relés ficam
+    # como último estado confirmado
+    ComandoESP.query.filter(ComandoESP.chave.is_(None),
+                            ComandoESP.confirmado_em.isnot(None)).delete(synchronize_session=False)
+    db.session.commit()
+    return confirmados
+
+# Máximo de comandos entregues de uma vez no long-poll (cabe no JSON do ESP)
+COMANDOS_POR_ENTREGA = 20
+
+# -----------------------------
+# Versões do estado e snapshots em cache
+# -----------------------------
+# Cada escopo tem um contador no estado vivo que sobe a cada alteração:
+#   pzem   → leituras ao vivo (ingestão)
+#   picos  → daily/weekly/monthly_peaks e agregados (flush da ingestão)
+#   reles  → tabela reles / reles_logs (qualquer commit que lhes toque)
+#   config → tabela configuracoes (saldo, preço, limites...)
+#   ldr    → última leitura do LDR
+# Os snapshots guardam as versões com que foram calculados; basta uma
+# versão diferente (ou o TTL) para serem recalculados.
+_snapshot_lock = threading.Lock()
+
+def invalidar(*escopos):
+    agora = time.time()
+    for escopo in escopos:
+        estado_vivo.incrementar(f"versao:{escopo}")
+        estado_vivo.definir(f"modificado:{escopo}", agora)
+
+def versoes(*escopos):
+    valores = estado_vivo.obter_varios([f"versao:{e}" for e in escopos], 0)
+    return {e: valores[f"versao:{e}"] for e in escopos}
+
+def snapshot_em_cache(nome, escopos, ttl, calcular):
+    """
+    Devolve o snapshot 'nome' partilhado por todos os clientes e workers,
+    recalculando-o só quando uma das versões mudou ou o TTL expirou.
+    """
+    chave = f"snapshot:{nome}"
+
+    def valido(cache, atuais):
+        return (cache and cache["versoes"] == atuais
+                and time.time() - cache["criado_em"] < ttl)
+
+    atuais = versoes(*escopos)
+    cache = estado_vivo.obter(chave)
+    if valido(cache, atuais):
+        return cache["dados"]
+
+    # Só uma thread por worker recalcula; as outras reaproveitam o resultado
+    with _snapshot_lock:
+        atuais = versoes(*escopos)
+        cache = estado_vivo.obter(chave)
+        if valido(cache, atuais):
+            return cache["dados"]
+
+        dados = calcular()
+        estado_vivo.definir(chave, {"versoes": atuais, "criado_em": time.time(), "dados": dados})
+        return dados
+
+# -----------------------------
+# Respostas condicionais (ETag / Last-Modified → 304)
+# -----------------------------
+# O ETag de um endpoint de leitura é o seu nome mais as versões dos
+# escopos de que depende: se o cliente (browser ou ESP) mandar o mesmo em
+# If-None-Match, responde-se 304 sem tocar na base de dados. A época
+# distingue reinícios do backend "memoria", onde as versões voltam a 0.
+if estado_vivo.obter("versao:epoca") is None:
+    estado_vivo.definir("versao:epoca", os.urandom(4).hex())
+
+def resposta_condicional(nome, escopos, gerar, ttl=None):
+    """
+    jsonify(gerar()) com ETag e Last-Modified, ou 304 se o cliente já tem
+    esta versão. ttl: o conteúdo também muda com o tempo (ex.: snapshot
+    recalculado a cada TTL), por isso entra na versão.
+    """
+    chaves = ["versao:epoca"] + [f"versao:{e}" for e in escopos] + [f"modificado:{e}" for e in escopos]
+    valores = estado_vivo.obter_varios(chaves, 0)
+
+    partes = [str(valores["versao:epoca"])] + [str(valores[f"versao:{e}"]) for e in escopos]
+    modificado = max(valores[f"modificado:{e}"] for e in escopos)
+    if ttl:
+        janela = int(time.time() // ttl)
+        partes.append(str(janela))
+        modificado = max(modificado, janela * ttl)
+    etag = f"{nome}-{'.'.join(partes)}"
+
+    # Last-Modified tem resolução de 1 s: só é enviado (e só se confia em
+    # If-Modified-Since) quando a última alteração já tem mais de 1 s,
+    # senão outra alteração no mesmo segundo passaria despercebida.
+    ultimo = None
+    if modificado and time.time() - modificado >= 1:
+        ultimo = datetime.fromtimestamp(int(modificado), timezone.utc)
+
+    if request.if_none_match:
+        inalterado = request.if_none_match.contains_weak(etag)
+    else:
+        desde = request.if_modified_since
+        inalterado = ultimo is not None and desde is not None and ultimo <= desde
+
+    resposta = Response(status=304) if inalterado else jsonify(gerar())
+    resposta.set_etag(etag, weak=True)
+    if ultimo is not None:
+        resposta.last_modified = ultimo
+    # Guardar, mas revalidar sempre (o fetch do browser trata do 304 sozinho)
+    resposta.cache_control.private = True
+    resposta.cache_control.no_cache = True
+    return resposta
 
 # -----------------------------
 # Modelos de Banco de Dados
 # -----------------------------
+# Picos mantidos na ingestão (ver picos.py): uma linha por período e PZEM
 class DailyPeak(db.Model):
     __tablename__ = "daily_peaks"
+    __table_args__ = (db.UniqueConstraint('date', 'pzem_id', name='uq_daily_peaks_date_pzem'),)
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.Date, default=datetime.utcnow().date, index=True)
     pzem_id = db.Column(db.Integer, nullable=False)
     value = db.Column(db.Float, nullable=False)
     time = db.Column(db.Time, nullable=False)
+    ocorrido_em = db.Column(db.DateTime)  # data e hora completas do pico
 
 class WeeklyPeak(db.Model):
     __tablename__ = "weekly_peaks"
+    __table_args__ = (db.UniqueConstraint('week_start', 'pzem_id', name='uq_weekly_peaks_week_pzem'),)
     id = db.Column(db.Integer, primary_key=True)
     week_start = db.Column(db.Date, index=True)  # primeiro dia da semana
     pzem_id = db.Column(db.Integer, nullable=False)
     value = db.Column(db.Float, nullable=False)
     time = db.Column(db.Time, nullable=False)
+    ocorrido_em = db.Column(db.DateTime)
 
 class MonthlyPeak(db.Model):
     __tablename__ = "monthly_peaks"
+    __table_args__ = (db.UniqueConstraint('year', 'month', 'pzem_id', name='uq_monthly_peaks_year_month_pzem'),)
     id = db.Column(db.Integer, primary_key=True)
     month = db.Column(db.Integer, index=True)  # 1 a 12
     year = db.Column(db.Integer, index=True)
     pzem_id = db.Column(db.Integer, nullable=False)
     value = db.Column(db.Float, nullable=False)
     time = db.Column(db.Time, nullable=False)
+    ocorrido_em = db.Column(db.DateTime)
+
+MODELOS_PICO = {
+    "dia": DailyPeak,
+    "semana": WeeklyPeak,
+    "mes": MonthlyPeak,
+}
 
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
@@ -153,6 +387,12 @@ class User(UserMixin, db.Model):
 
 class EnergyData(db.Model):
     __tablename__ = 'energy_data'
+    __table_args__ = (
+        # Consultas por PZEM + intervalo de tempo (picos, relatórios)
+        db.Index('ix_energy_data_pzem_id_timestamp', 'pzem_id', 'timestamp'),
+        # Consultas só por intervalo; BRIN no Postgres (tabela append-only)
+        db.Index('ix_energy_data_timestamp', 'timestamp', postgresql_using='brin'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     pzem_id = db.Column(db.Integer, nullable=False)
     voltage = db.Column(db.Float, nullable=False)
@@ -162,6 +402,108 @@ class EnergyData(db.Model):
     frequency = db.Column(db.Float, nullable=False)
     pf = db.Column(db.Float, nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
+
+# -----------------------------
+# Agregados de energy_data (ver agregados.py)
+# -----------------------------
+class AgregadoEnergiaMixin:
+    """Um bucket por (pzem_id, bucket_inicio); média = soma / amostras"""
+    id = db.Column(db.Integer, primary_key=True)
+    pzem_id = db.Column(db.Integer, nullable=False)
+    bucket_inicio = db.Column(db.DateTime, nullable=False)
+    amostras = db.Column(db.Integer, nullable=False, default=0)
+
+    voltage_min = db.Column(db.Float, nullable=False)
+    voltage_max = db.Column(db.Float, nullable=False)
+    voltage_soma = db.Column(db.Float, nullable=False)
+    voltage_ultimo = db.Column(db.Float, nullable=False)
+
+    current_min = db.Column(db.Float, nullable=False)
+    current_max = db.Column(db.Float, nullable=False)
+    current_soma = db.Column(db.Float, nullable=False)
+    current_ultimo = db.Column(db.Float, nullable=False)
+
+    power_min = db.Column(db.Float, nullable=False)
+    power_max = db.Column(db.Float, nullable=False)
+    power_soma = db.Column(db.Float, nullable=False)
+    power_ultimo = db.Column(db.Float, nullable=False)
+    power_max_em = db.Column(db.DateTime, nullable=False)
+
+    pf_min = db.Column(db.Float, nullable=False)
+    pf_max = db.Column(db.Float, nullable=False)
+    pf_soma = db.Column(db.Float, nullable=False)
+    pf_ultimo = db.Column(db.Float, nullable=False)
+
+    energy_min = db.Column(db.Float, nullable=False)
+    energy_max = db.Column(db.Float, nullable=False)
+    energy_soma = db.Column(db.Float, nullable=False)
+    energy_ultimo = db.Column(db.Float, nullable=False)
+    energy_delta = db.Column(db.Float, nullable=False, default=0.0)  # kWh consumidos no bucket
+
+    ultimo_em = db.Column(db.DateTime, nullable=False)
+
+    @declared_attr
+    def __table_args__(cls):
+        return (db.UniqueConstraint('pzem_id', 'bucket_inicio', name=f'uq_{cls.__tablename__}_pzem_bucket'),)
+
+    def media(self, grandeza):
+        return getattr(self, f"{grandeza}_soma") / self.amostras if self.amostras else 0.0
+
+class EnergiaPorMinuto(AgregadoEnergiaMixin, db.Model):
+    __tablename__ = 'energy_agregado_minuto'
+
+class EnergiaPorHora(AgregadoEnergiaMixin, db.Model):
+    __tablename__ = 'energy_agregado_hora'
+
+class EnergiaPorDia(AgregadoEnergiaMixin, db.Model):
+    __tablename__ = 'energy_agregado_dia'
+
+MODELOS_AGREGADO = {
+    "minuto": EnergiaPorMinuto,
+    "hora": EnergiaPorHora,
+    "dia": EnergiaPorDia,
+}
+
+# Resultado de relatório por dia já fechado (ver relatorio_cache.py)
+class RelatorioDia(db.Model):
+    __tablename__ = 'relatorio_cache_dia'
+    __table_args__ = (db.UniqueConstraint('tipo', 'pzem_id', 'dia', name='uq_relatorio_cache_dia_tipo_pzem_dia'),)
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(20), nullable=False)
+    pzem_id = db.Column(db.Integer, nullable=False)  # 0 = todos os PZEMs
+    dia = db.Column(db.Date, nullable=False, index=True)
+    dados = db.Column(db.Text)  # JSON; NULL = dia sem leituras
+    criado_em = db.Column(db.DateTime, default=datetime.utcnow)
+
+# Fila de comandos para o ESP (ver fila_comandos.py)
+class ComandoESP(db.Model):
+    __tablename__ = 'comandos_esp'
+    id = db.Column(db.Integer, primary_key=True)
+    chave = db.Column(db.String(20), unique=True)  # "rele:N"; NULL = comando avulso
+    comando = db.Column(db.String(100), nullable=False)
+    prioridade = db.Column(db.Integer, nullable=False, default=1)  # 0 = desligar
+    versao = db.Column(db.Integer, nullable=False, default=1)
+    tentativas = db.Column(db.Integer, nullable=False, default=0)
+    criado_em = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    entregue_em = db.Column(db.DateTime)
+    confirmado_em = db.Column(db.DateTime)
+
+    def to_dict(self):
+        def ms_desde_pedido(instante):
+            return round((instante - self.criado_em).total_seconds() * 1000) if instante else None
+
+        return {
+            "id": identificador(self.id, self.versao),
+            "chave": self.chave,
+            "comando": self.comando,
+            "prioridade": self.prioridade,
+            "tentativas": self.tentativas,
+            "criado_em": self.criado_em.strftime("%Y-%m-%d %H:%M:%S"),
+            "estado": "confirmado" if self.confirmado_em else "entregue" if self.entregue_em else "pendente",
+            "ms_ate_entrega": ms_desde_pedido(self.entregue_em),
+            "ms_ate_confirmacao": ms_desde_pedido(self.confirmado_em),
+        }
+
 class Rele(db.Model):
     __tablename__ = 'reles'
     id = db.Column(db.Integer, primary_key=True)
@@ -236,6 +578,47 @@ class Configuracao(db.Model):
     taxa_radio = db.Column(db.Float, default=3.0)  # MZN fixos
     iva_percent = db.Column(db.Float, default=16.0)  # Percentual
 
+# -----------------------------
+# Invalidação dos snapshots a partir dos commits
+# -----------------------------
+ESCOPO_POR_MODELO = {
+    Rele: "reles",
+    ReleLog: "reles",
+    Configuracao: "config",
+}
+
+@event.listens_for(Session, "after_flush")
+def registrar_escopos_alterados(session, flush_context):
+    # Ainda em estado pré-flush: new/dirty/deleted são o que foi gravado
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        escopo = ESCOPO_POR_MODELO.get(type(obj))
+        if escopo:
+            session.info.setdefault("escopos_alterados", set()).add(escopo)
+
+@event.listens_for(Session, "after_commit")
+def invalidar_escopos_alterados(session):
+    # A transação já está gravada: uma falha aqui não pode parecer uma
+    # falha do commit (quem chamou tentaria gravar tudo outra vez)
+    escopos = session.info.pop("escopos_alterados", None)
+    if escopos:
+        try:
+            invalidar(*escopos)
+        except Exception as e:
+            print(f"⚠️ Falha ao invalidar {sorted(escopos)}: {e}")
+
+@event.listens_for(Session, "after_rollback")
+def descartar_escopos_alterados(session):
+    session.info.pop("escopos_alterados", None)
+    session.info.pop("comandos_enfileirados", None)
+
+@event.listens_for(Session, "after_commit")
+def avisar_comandos_enfileirados(session):
+    if session.info.pop("comandos_enfileirados", False):
+        try:
+            sinal_comandos.avisar()
+        except Exception as e:
+            print(f"⚠️ Falha ao acordar o long-poll de comandos: {e}")
+
 # ==========================================================
 #PICOS
 #=======================================================
@@ -246,39 +629,25 @@ from datetime import datetime, timedelta
 #   PICOS DE CONSUMO – NO APP.PY
 # ===============================
 
+def maior_pico(modelo, **periodo):
+    """Maior pico guardado do período entre os PZEMs (lookup pela chave única)"""
+    return (modelo.query
+            .filter_by(**periodo)
+            .order_by(modelo.value.desc(), modelo.pzem_id.asc())
+            .first())
+
 def obter_pico_do_dia():
     try:
-        hoje = datetime.utcnow().date()
-
-        pico1 = EnergyData.query.filter(
-            EnergyData.pzem_id == 1,
-            db.func.date(EnergyData.timestamp) == hoje
-        ).order_by(EnergyData.power.desc()).first()
-
-        pico2 = EnergyData.query.filter(
-            EnergyData.pzem_id == 2,
-            db.func.date(EnergyData.timestamp) == hoje
-        ).order_by(EnergyData.power.desc()).first()
-
-        picos = []
+        pico = maior_pico(DailyPeak, date=datetime.utcnow().date())
 
-        if pico1:
-            picos.append({
-                "value": pico1.power,
-                "time": pico1.timestamp.strftime("%H:%M"),
-                "pzem": 1
-            })
-
-        if pico2:
-            picos.append({
-                "value": pico2.power,
-                "time": pico2.timestamp.strftime("%H:%M"),
-                "pzem": 2
-            })
-
-        if picos:
-            return max(picos, key=lambda x: x["value"])
+        if pico:
+            return {
+                "value": pico.value,
+                "time": pico.time.strftime("%H:%M"),
+                "pzem": pico.pzem_id
+            }
 
+        dados_pzem = ler_dados_pzem()
         pico_atual = max(dados_pzem["pzem1"]["power"], dados_pzem["pzem2"]["power"])
         return {
             "value": pico_atual,
@@ -291,81 +660,73 @@ def obter_pico_do_dia():
         return {"error": str(e)}
 
 
-def obter_picos_semana_atual():
-    try:
-        hoje = datetime.utcnow().date()
-        inicio_semana = hoje - timedelta(days=hoje.weekday())
+NOMES_DIAS = ['Seg', 'Ter', 'Qua', 'Qui', 'Sex', 'Sáb', 'Dom']
 
-        labels = []
-        valores = []
-        nomes_dias = ['Seg', 'Ter', 'Qua', 'Qui', 'Sex', 'Sáb', 'Dom']
+def obter_serie_picos(data_inicio, data_fim, rotulo=None):
+    """
+    Pico diário (o maior entre os PZEMs) de cada dia de data_inicio a
+    data_fim, com a hora em que ocorreu. Uma única consulta a daily_peaks,
+    qualquer que seja o número de dias.
+    """
+    rotulo = rotulo or (lambda dia: dia.strftime("%d/%m"))
 
-        for i in range(7):
-            data = inicio_semana + timedelta(days=i)
-            labels.append(f"{nomes_dias[i]} ({data.day})")
+    registros = (
+        DailyPeak.query
+        .filter(DailyPeak.date >= data_inicio, DailyPeak.date <= data_fim)
+        .order_by(DailyPeak.date, DailyPeak.value.desc(), DailyPeak.pzem_id)
+        .all()
+    )
 
-            if data > hoje:
-                valores.append(0)
-                continue
+    maior_do_dia = {}
+    for pico in registros:
+        maior_do_dia.setdefault(pico.date, pico)
 
-            pico1 = EnergyData.query.filter(
-                EnergyData.pzem_id == 1,
-                db.func.date(EnergyData.timestamp) == data
-            ).order_by(EnergyData.power.desc()).first()
+    serie = {"labels": [], "values": [], "times": [], "pzems": [], "dates": []}
+    for i in range((data_fim - data_inicio).days + 1):
+        dia = data_inicio + timedelta(days=i)
+        pico = maior_do_dia.get(dia)
 
-            pico2 = EnergyData.query.filter(
-                EnergyData.pzem_id == 2,
-                db.func.date(EnergyData.timestamp) == data
-            ).order_by(EnergyData.power.desc()).first()
+        serie["labels"].append(rotulo(dia))
+        serie["dates"].append(dia.isoformat())
+        serie["values"].append(pico.value if pico else 0)
+        serie["times"].append(pico.time.strftime("%H:%M") if pico else None)
+        serie["pzems"].append(pico.pzem_id if pico else None)
 
-            valor = max(
-                [p.power for p in [pico1, pico2] if p],
-                default=0
-            )
+    return serie
 
-            valores.append(valor)
+def obter_picos_semana_atual():
+    try:
+        hoje = datetime.utcnow().date()
+        segunda = inicio_semana(hoje)
 
-        return {"labels": labels, "values": valores}
+        # Os dias ainda por vir ficam a 0
+        return obter_serie_picos(
+            segunda, segunda + timedelta(days=6),
+            rotulo=lambda dia: f"{NOMES_DIAS[dia.weekday()]} ({dia.day})"
+        )
 
     except Exception as e:
         print("❌ Erro pico semana:", e)
         return {"labels": [], "values": []}
 
+def obter_picos_ultimos_dias(dias):
+    """Série de picos dos últimos N dias (incluindo hoje)"""
+    hoje = datetime.utcnow().date()
+    return obter_serie_picos(hoje - timedelta(days=dias - 1), hoje)
+
 
 def obter_pico_semanal():
     try:
-        hoje = datetime.utcnow().date()
-        inicio_semana = hoje - timedelta(days=hoje.weekday())
-
-        pico1 = EnergyData.query.filter(
-            EnergyData.pzem_id == 1,
-            EnergyData.timestamp >= inicio_semana
-        ).order_by(EnergyData.power.desc()).first()
-
-        pico2 = EnergyData.query.filter(
-            EnergyData.pzem_id == 2,
-            EnergyData.timestamp >= inicio_semana
-        ).order_by(EnergyData.power.desc()).first()
-
-        picos = []
-
-        if pico1:
-            picos.append({
-                "value": pico1.power,
-                "time": pico1.timestamp.strftime("%d/%m %H:%M"),
-                "pzem": 1
-            })
-
-        if pico2:
-            picos.append({
-                "value": pico2.power,
-                "time": pico2.timestamp.strftime("%d/%m %H:%M"),
-                "pzem": 2
-            })
+        pico = maior_pico(WeeklyPeak, week_start=inicio_semana(datetime.utcnow().date()))
 
-        if picos:
-            return max(picos, key=lambda x: x["value"])
+        if pico:
+            return {
+                "value": pico.value,
+                "time": pico.ocorrido_em.strftime("%d/%m %H:%M"),
+                "pzem": pico.pzem_id
+            }
 
+        dados_pzem = ler_dados_pzem()
         pico_atual = max(dados_pzem["pzem1"]["power"], dados_pzem["pzem2"]["power"])
         return {
             "value": pico_atual,
@@ -381,37 +742,16 @@ def obter_pico_semanal():
 def obter_pico_mensal():
     try:
         hoje = datetime.utcnow().date()
-        inicio_mes = hoje.replace(day=1)
-
-        pico1 = EnergyData.query.filter(
-            EnergyData.pzem_id == 1,
-            EnergyData.timestamp >= inicio_mes
-        ).order_by(EnergyData.power.desc()).first()
-
-        pico2 = EnergyData.query.filter(
-            EnergyData.pzem_id == 2,
-            EnergyData.timestamp >= inicio_mes
-        ).order_by(EnergyData.power.desc()).first()
-
-        picos = []
+        pico = maior_pico(MonthlyPeak, year=hoje.year, month=hoje.month)
 
-        if pico1:
-            picos.append({
-                "value": pico1.power,
-                "time": pico1.timestamp.strftime("%d/%m %H:%M"),
-                "pzem": 1
-            })
-
-        if pico2:
-            picos.append({
-                "value": pico2.power,
-                "time": pico2.timestamp.strftime("%d/%m %H:%M"),
-                "pzem": 2
-            })
-
-        if picos:
-            return max(picos, key=lambda x: x["value"])
+        if pico:
+            return {
+                "value": pico.value,
+                "time": pico.ocorrido_em.strftime("%d/%m %H:%M"),
+                "pzem": pico.pzem_id
+            }
 
+        dados_pzem = ler_dados_pzem()
         pico_atual = max(dados_pzem["pzem1"]["power"], dados_pzem["pzem2"]["power"])
         return {
             "value": pico_atual,
@@ -432,6 +772,34 @@ def api_pico_dia():
 def api_pico_semana():
     return jsonify(obter_picos_semana_atual())
 
+@app.route("/api/pico/serie")
+@login_required
+def api_pico_serie():
+    """
+    Série de picos diários.
+
+    ?periodo=semana|mes   → semana ou mês corrente
+    ?dias=N               → últimos N dias (1 a 366, padrão 7)
+    """
+    periodo = request.args.get("periodo")
+    hoje = datetime.utcnow().date()
+
+    try:
+        if periodo == "semana":
+            serie = obter_picos_semana_atual()
+        elif periodo == "mes":
+            serie = obter_serie_picos(hoje.replace(day=1), hoje)
+        else:
+            dias = request.args.get("dias", 7, type=int)
+            if not 1 <= dias <= 366:
+                return jsonify({"success": False, "message": "dias deve estar entre 1 e 366"}), 400
+            serie = obter_picos_ultimos_dias(dias)
+    except Exception as e:
+        print("❌ Erro série de picos:", e)
+        return jsonify({"success": False, "message": str(e)}), 500
+
+    return jsonify({"success": True, **serie})
+
 @app.route("/api/pico/semanal")
 def api_pico_semanal():
     return jsonify(obter_pico_semanal())
@@ -445,6 +813,106 @@ def api_pico_mensal():
                         #Grafico
 #==========================================================
 
+def parametros_amostragem():
+    """?max_points=N&method=lttb|minmax (N limitado a GRAFICO_MAX_PONTOS_LIMITE)"""
+    max_pontos = request.args.get("max_points", app.config["GRAFICO_MAX_PONTOS"], type=int)
+    max_pontos = max(10, min(max_pontos, app.config["GRAFICO_MAX_PONTOS_LIMITE"]))
+    metodo = request.args.get("method", "lttb")
+    if metodo not in METODOS:
+        metodo = "lttb"
+    return max_pontos, metodo
+
+def pontos_grafico(intervalo, max_pontos, pzem_id=None):
+    """
+    Pontos (instante, tensão, corrente, potência, energia) do intervalo.
+
+    Lê o agregado mais grosso que ainda dá pelo menos max_pontos buckets
+    (médias do bucket, energia = último valor do contador); se nenhum
+    servir, lê as leituras brutas. Devolve (pontos, resolucao).
+
+    Sem pzem_id os medidores são combinados da mesma forma em qualquer
+    resolução: um ponto por instante (bucket ou timestamp da leitura) com
+    a média dos dois e o maior contador de energia.
+    """
+    modelo = modelo_agregado(intervalo, (intervalo.fim - intervalo.inicio) / max_pontos)
+
+    if modelo is not None:
+        amostras = func.sum(modelo.amostras)
+        consulta = db.session.query(
+            modelo.bucket_inicio,
+            func.sum(modelo.voltage_soma) / amostras,
+            func.sum(modelo.current_soma) / amostras,
+            func.sum(modelo.power_soma) / amostras,
+            func.max(modelo.energy_ultimo)
+        ).filter(filtro_intervalo(modelo.bucket_inicio, intervalo))
+        if pzem_id is not None:
+            consulta = consulta.filter(modelo.pzem_id == pzem_id)
+        consulta = consulta.group_by(modelo.bucket_inicio).order_by(modelo.bucket_inicio)
+        resolucao = modelo.__tablename__.rsplit("_", 1)[-1]
+    elif pzem_id is not None:
+        consulta = db.session.query(
+            EnergyData.timestamp,
+            EnergyData.voltage,
+            EnergyData.current,
+            EnergyData.power,
+            EnergyData.energy
+        ).filter(
+            filtro_intervalo(EnergyData.timestamp, intervalo),
+            EnergyData.pzem_id == pzem_id
+        ).order_by(EnergyData.timestamp.asc())
+        resolucao = "bruto"
+    else:
+        consulta = db.session.query(
+            EnergyData.timestamp,
+            func.avg(EnergyData.voltage),
+            func.avg(EnergyData.current),
+            func.avg(EnergyData.power),
+            func.max(EnergyData.energy)
+        ).filter(
+            filtro_intervalo(EnergyData.timestamp, intervalo)
+        ).group_by(EnergyData.timestamp).order_by(EnergyData.timestamp.asc())
+        resolucao = "bruto"
+
+    return [tuple(linha) for linha in consulta], resolucao
+
+def leituras_em_stream(intervalo, pzem_id=None, lote=1000):
+    """
+    Itera as leituras brutas do intervalo por ordem de tempo com um cursor
+    do lado do servidor (yield_per): só 'lote' linhas em memória de cada vez.
+    """
+    consulta = db.select(
+        EnergyData.timestamp,
+        EnergyData.pzem_id,
+        EnergyData.voltage,
+        EnergyData.current,
+        EnergyData.power,
+        EnergyData.energy
+    ).where(filtro_intervalo(EnergyData.timestamp, intervalo))
+    if pzem_id is not None:
+        consulta = consulta.where(EnergyData.pzem_id == pzem_id)
+    consulta = consulta.order_by(EnergyData.timestamp.asc())
+
+    for instante, pzem, voltage, current, power, energy in db.session.execute(
+        consulta.execution_options(yield_per=lote)
+    ):
+        yield {
+            "timestamp": instante.strftime("%Y-%m-%d %H:%M:%S"),
+            "pzem": pzem,
+            "tensao": voltage,
+            "corrente": current,
+            "potencia": power,
+            "energia": energy
+        }
+
+def reduzir_pontos(pontos, max_pontos, metodo="lttb"):
+    """Reduz os pontos a no máximo max_pontos, guiado pela potência"""
+    if len(pontos) <= max_pontos:
+        return pontos
+    origem = pontos[0][0]
+    xs = [(p[0] - origem).total_seconds() for p in pontos]
+    ys = [float(p[3] or 0) for p in pontos]
+    return [pontos[i] for i in reduzir(xs, ys, max_pontos, metodo)]
+
 @app.route("/api/grafico", methods=["GET"])
 @login_required
 def api_grafico():
@@ -455,59 +923,59 @@ def api_grafico():
     ?period=month|week|day|custom
     ?start=YYYY-MM-DD
     ?end=YYYY-MM-DD
+    ?max_points=N        (padrão GRAFICO_MAX_PONTOS)
+    ?method=lttb|minmax
+    ?stream=ndjson|json  → todas as leituras brutas, em streaming
+    ?format=f32          → mesmas séries em binário colunar (serie_binaria.py)
     """
     try:
         period = request.args.get("period", "month")
         start_raw = request.args.get("start")
         end_raw = request.args.get("end")
-
-        today = datetime.utcnow().date()
+        max_pontos, metodo = parametros_amostragem()
 
         # ============================
-        # 1) DEFINIR INTERVALO
+        # 1) DEFINIR INTERVALO [inicio, fim)
         # ============================
-        if period == "day":
-            dt_start = today
-            dt_end = today
-
-        elif period == "yesterday":
-            dt_start = today - timedelta(days=1)
-            dt_end = dt_start
-
-        elif period == "week":
-            dt_start = today - timedelta(days=today.weekday())   # segunda-feira
-            dt_end = today
-
-        elif period == "month":
-            dt_start = today.replace(day=1)
-            dt_end = today
-
-        elif period == "custom" and start_raw and end_raw:
-            dt_start = datetime.strptime(start_raw, "%Y-%m-%d").date()
-            dt_end = datetime.strptime(end_raw, "%Y-%m-%d").date()
-
-            # Limite de segurança
-            if (dt_end - dt_start).days > 366:
-                return jsonify({"success": False, "message": "Intervalo máximo: 1 ano"}), 400
-        else:
-            return jsonify({"success": False, "message": "Parâmetros inválidos"}), 400
+        try:
+            intervalo = intervalo_periodo(period, start_raw, end_raw, max_dias=366)
+        except IntervaloInvalido as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+
+        dt_start, dt_end = intervalo.data_inicio, intervalo.data_fim
+
+        formato = formato_pedido()
+        if formato:
+            # Resolução total, sem redução: memória constante por pedido
+            return resposta_stream(
+                formato,
+                leituras_em_stream(intervalo),
+                cabecalho={"success": True, "periodo": {"inicio": str(dt_start), "fim": str(dt_end)}},
+                rodape=lambda total: {"total_registros": total}
+            )
 
         print(f"📊 Buscando dados de gráfico de {dt_start} a {dt_end}")
 
         # ============================
-        # 2) CONSULTA REAL AO BANCO
+        # 2) CONSULTA (agregados ou leituras brutas) + REDUÇÃO
         # ============================
-        dados = (
-            EnergyData.query
-            .filter(
-                func.date(EnergyData.timestamp) >= dt_start,
-                func.date(EnergyData.timestamp) <= dt_end
+        pontos, resolucao = pontos_grafico(intervalo, max_pontos)
+        pontos_originais = len(pontos)
+        dados = reduzir_pontos(pontos, max_pontos, metodo)
+
+        print(f"✅ Encontrados {pontos_originais} pontos ({resolucao}) → {len(dados)}")
+
+        if pedido_binario():
+            return resposta_serie_binaria(
+                [p[0] for p in dados],
+                {"tensao": [p[1] for p in dados], "corrente": [p[2] for p in dados],
+                 "potencia": [p[3] for p in dados], "energia": [p[4] for p in dados]},
+                meta={
+                    "success": True,
+                    "amostragem": {"metodo": metodo, "resolucao": resolucao,
+                                   "max_points": max_pontos, "pontos_originais": pontos_originais}
+                }
             )
-            .order_by(EnergyData.timestamp.asc())
-            .all()
-        )
-
-        print(f"✅ Encontrados {len(dados)} registros")
 
         # ============================
         # 3) PREPARAR JSON PARA O JS
@@ -518,15 +986,15 @@ def api_grafico():
         potencia = []
         energia = []
 
-        for d in dados:
+        for instante, voltage, current, power, energy in dados:
             # Formatar timestamp
-            timestamps.append(d.timestamp.strftime("%Y-%m-%d %H:%M:%S"))
+            timestamps.append(instante.strftime("%Y-%m-%d %H:%M:%S"))
             
             # Converter valores, tratando None
-            tensao.append(float(d.voltage) if d.voltage is not None else 0)
-            corrente.append(float(d.current) if d.current is not None else 0)
-            potencia.append(float(d.power) if d.power is not None else 0)
-            energia.append(float(d.energy) if d.energy is not None else 0)
+            tensao.append(float(voltage) if voltage is not None else 0)
+            corrente.append(float(current) if current is not None else 0)
+            potencia.append(float(power) if power is not None else 0)
+            energia.append(float(energy) if energy is not None else 0)
 
         response_data = {
             "success": True,
@@ -535,7 +1003,13 @@ def api_grafico():
             "corrente": corrente,
             "potencia": potencia,
             "energia": energia,
-            "total_registros": len(potencia)
+            "total_registros": len(potencia),
+            "amostragem": {
+                "metodo": metodo,
+                "resolucao": resolucao,
+                "max_points": max_pontos,
+                "pontos_originais": pontos_originais
+            }
         }
 
         print(f"📈 Retornando {len(timestamps)} pontos de dados")
@@ -560,81 +1034,42 @@ def api_grafico_diario():
     """
     try:
         period = request.args.get("period", "week")
-        
+        start_raw = request.args.get("start")
+        end_raw = request.args.get("end")
+
+        # Compatibilidade: period=custom?start=YYYY-MM-DD (o '&end=' chega como parâmetro próprio)
+        if period.startswith("custom?"):
+            period, _, resto = period.partition("?")
+            start_raw = start_raw or resto.partition("start=")[2] or None
+
         # Calcular datas
-        today = datetime.utcnow().date()
-        
-        if period == "week":
-            start_date = today - timedelta(days=6)  # 7 dias
-            end_date = today
-        elif period == "month":
-            start_date = today - timedelta(days=29)  # 30 dias
-            end_date = today
-        elif "custom" in period:
-            # Extrair datas de custom?start=...&end=...
-            import re
-            start_match = re.search(r'start=([\d-]+)', period)
-            end_match = re.search(r'end=([\d-]+)', period)
-            
-            if start_match and end_match:
-                start_date = datetime.strptime(start_match.group(1), "%Y-%m-%d").date()
-                end_date = datetime.strptime(end_match.group(1), "%Y-%m-%d").date()
+        try:
+            if period == "week":
+                intervalo = intervalo_ultimos_dias(7)
+            elif period == "month":
+                intervalo = intervalo_ultimos_dias(30)
+            elif period == "custom":
+                intervalo = intervalo_periodo(period, start_raw, end_raw, max_dias=366)
             else:
-                return jsonify({"success": False, "message": "Datas inválidas"}), 400
-        else:
-            return jsonify({"success": False, "message": "Período inválido"}), 400
-        
-        # Buscar dados do banco
-        registros = EnergyData.query.filter(
-            EnergyData.timestamp >= datetime.combine(start_date, datetime.min.time()),
-            EnergyData.timestamp <= datetime.combine(end_date, datetime.max.time())
-        ).order_by(EnergyData.timestamp.asc()).all()
-        
-        # Processar dados
-        dados_por_dia = {}
-        
-        for reg in registros:
-            data = reg.timestamp.date()
-            chave = data.isoformat()
-            
-            if chave not in dados_por_dia:
-                dados_por_dia[chave] = {
-                    'data': data,
-                    'potencias': [],
-                    'tensoes': [],
-                    'correntes': [],
-                    'energias': []
-                }
-            
-            # Adicionar valores
-            if reg.power:
-                dados_por_dia[chave]['potencias'].append(float(reg.power))
-            if reg.voltage:
-                dados_por_dia[chave]['tensoes'].append(float(reg.voltage))
-            if reg.current:
-                dados_por_dia[chave]['correntes'].append(float(reg.current))
-            if reg.energy:
-                dados_por_dia[chave]['energias'].append(float(reg.energy))
-        
-        # Preparar arrays para resposta
+                return jsonify({"success": False, "message": "Período inválido"}), 400
+        except IntervaloInvalido as e:
+            return jsonify({"success": False, "message": str(e)}), 400
+
+        start_date, end_date = intervalo.data_inicio, intervalo.data_fim
+
+        # Uma linha por dia, agregada no SQL sobre o agregado diário
         datas = []
         potencia = []
         tensao = []
         corrente = []
         energia = []
-        
-        # Ordenar datas
-        for chave in sorted(dados_por_dia.keys()):
-            dia = dados_por_dia[chave]
-            
-            # Formatar data
-            datas.append(dia['data'].strftime("%d %b"))
-            
-            # Calcular totais/médias
-            potencia.append(sum(dia['potencias']) if dia['potencias'] else 0)
-            tensao.append(sum(dia['tensoes'])/len(dia['tensoes']) if dia['tensoes'] else 0)
-            corrente.append(sum(dia['correntes']) if dia['correntes'] else 0)
-            energia.append(dia['energias'][-1] if dia['energias'] else 0)
+
+        for dia, pot, tens, corr, ener in resumo_por_dia(intervalo):
+            datas.append(dia.strftime("%d %b"))
+            potencia.append(pot)
+            tensao.append(tens)
+            corrente.append(corr)
+            energia.append(ener)
         
         # Se não houver dados, criar array vazio
         if not datas:
@@ -670,53 +1105,47 @@ def historico_consumo_mensal():
     """
     Retorna histórico de consumo mensal APENAS do PZEM 1
     Garante que não caia para zero artificialmente
+
+    ?max_points=N&method=lttb|minmax limitam o número de pontos devolvidos
+    ?stream=ndjson|json devolve todas as leituras brutas, em streaming
+    ?format=f32 devolve as séries em binário colunar (serie_binaria.py)
     """
     try:
-        # Obter início do mês atual
+        max_pontos, metodo = parametros_amostragem()
+
+        # Início do mês atual até agora
         hoje = datetime.utcnow()
-        inicio_mes = hoje.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        intervalo = intervalo_mes_atual(hoje.date())
+        inicio_mes = intervalo.inicio
+
+        formato = formato_pedido()
+        if formato:
+            return resposta_stream(
+                formato,
+                leituras_em_stream(intervalo, pzem_id=1),
+                cabecalho={
+                    "sucesso": True,
+                    "device": "PZEM 1",
+                    "periodo": {"inicio": inicio_mes.strftime("%Y-%m-%d"), "fim": hoje.strftime("%Y-%m-%d")}
+                },
+                rodape=lambda total: {"total": total}
+            )
         
         print(f"🔍 Buscando dados PZEM 1 de {inicio_mes} até {hoje}")
         
-        # PRIMEIRO: Tentar buscar pelo device_id = 1
-        registros = []
         try:
-            # Verificar se a tabela tem coluna device_id
-            registros = (
-                EnergyData.query
-                .filter(
-                    EnergyData.timestamp >= inicio_mes,
-                    EnergyData.device_id == 1
-                )
-                .order_by(EnergyData.timestamp.asc())
-                .all()
-            )
-            print(f"✅ Encontrados {len(registros)} registros pelo device_id=1")
+            pontos, resolucao = pontos_grafico(intervalo, max_pontos, pzem_id=1)
         except Exception as e:
-            print(f"⚠️  Não foi possível filtrar por device_id: {e}")
-        
-        # SEGUNDO: Se não encontrou, buscar todos e filtrar depois
-        if not registros:
-            try:
-                todos_registros = (
-                    EnergyData.query
-                    .filter(EnergyData.timestamp >= inicio_mes)
-                    .order_by(EnergyData.timestamp.asc())
-                    .all()
-                )
-                print(f"📊 Total de registros no período: {len(todos_registros)}")
-                
-                # Filtrar registros que têm dados válidos (potência > 0)
-                registros = [r for r in todos_registros if r.power and float(r.power) > 0]
-                print(f"✅ Filtrados {len(registros)} registros com potência > 0")
-                
-            except Exception as e:
-                print(f"❌ Erro ao buscar todos os registros: {e}")
-                return jsonify({
-                    "sucesso": False,
-                    "mensagem": f"Erro no banco de dados: {str(e)}",
-                    "registos": []
-                }), 500
+            print(f"❌ Erro ao buscar registros do PZEM 1: {e}")
+            return jsonify({
+                "sucesso": False,
+                "mensagem": f"Erro no banco de dados: {str(e)}",
+                "registos": []
+            }), 500
+
+        # Pontos com dados válidos (potência > 0)
+        registros = reduzir_pontos([p for p in pontos if p[3] and float(p[3]) > 0], max_pontos, metodo)
+        print(f"✅ {len(registros)} pontos ({resolucao}) de {len(pontos)}")
         
         if not registros:
             return jsonify({
@@ -728,26 +1157,37 @@ def historico_consumo_mensal():
         
         # Converter para formato do gráfico
         resultado = []
-        for registro in registros:
+        for instante, voltage, current, power, energy in registros:
             # Garantir que os valores sejam números válidos
-            potencia = float(registro.power or 0)
+            potencia = float(power or 0)
             
             # Se potência for 0, usar último valor não-zero (se disponível)
             if potencia == 0 and resultado:
                 potencia = float(resultado[-1]["potencia"] or 0)
             
             resultado.append({
-                "data_hora": registro.timestamp.strftime("%Y-%m-%d %H:%M:%S"),
-                "timestamp": registro.timestamp.isoformat(),
+                "data_hora": instante.strftime("%Y-%m-%d %H:%M:%S"),
+                "timestamp": instante.isoformat(),
                 "potencia": potencia,
-                "tensao": float(registro.voltage or 220),
-                "corrente": float(registro.current or 0),
-                "energia": float(registro.energy or 0),
-                "device_id": getattr(registro, 'device_id', 1)
+                "tensao": float(voltage or 220),
+                "corrente": float(current or 0),
+                "energia": float(energy or 0),
+                "device_id": 1
             })
         
         print(f"📈 Retornando {len(resultado)} pontos para o gráfico")
         print(f"📊 Faixa de potência: {min([r['potencia'] for r in resultado])}W a {max([r['potencia'] for r in resultado])}W")
+
+        if pedido_binario():
+            return resposta_serie_binaria(
+                [r[0] for r in registros],
+                {c: [r[c] for r in resultado] for c in ("potencia", "tensao", "corrente", "energia")},
+                meta={
+                    "sucesso": True,
+                    "device": "PZEM 1",
+                    "periodo": {"inicio": inicio_mes.strftime("%Y-%m-%d"), "fim": hoje.strftime("%Y-%m-%d")}
+                }
+            )
         
         return jsonify({
             "sucesso": True,
@@ -804,27 +1244,37 @@ class Recarga(db.Model):
 # ==========================================================
 @app.route("/api/ldr", methods=["POST"])
 def receber_ldr():
-    global ULTIMO_LDR
-
     data = request.get_json()
 
     if not data or "api_key" not in data or data["api_key"] not in API_KEYS:
         return {"error": "Unauthorized"}, 401
 
-    ULTIMO_LDR["valorLuz"] = data.get("valorLuz", 0)
-    ULTIMO_LDR["R1"] = data.get("R1", 0)
+    registar_ldr(data)
+    return {"success": True}
+
+def registar_ldr(data):
+    ldr = {
+        "valorLuz": data.get("valorLuz", 0),
+        "R1": data.get("R1", 0)
+    }
+    if ldr == ler_ldr():
+        return  # mesma leitura: não acorda snapshots nem /api/stream
 
-    print(f"[LDR] valorLuz={ULTIMO_LDR['valorLuz']} | R1={ULTIMO_LDR['R1']}")
+    estado_vivo.definir("ldr", ldr)
+    invalidar("ldr")
 
-    return {"success": True}
+    print(f"[LDR] valorLuz={ldr['valorLuz']} | R1={ldr['R1']}")
 
 @app.route("/api/get_ldr", methods=["GET"])
 def get_ldr():
-    return {
-        "success": True,
-        "valorLuz": ULTIMO_LDR["valorLuz"],
-        "R1": ULTIMO_LDR["R1"]
-    }
+    def gerar():
+        ldr = ler_ldr()
+        return {
+            "success": True,
+            "valorLuz": ldr["valorLuz"],
+            "R1": ldr["R1"]
+        }
+    return resposta_condicional("ldr", ("ldr",), gerar)
 
 # ==========================================================
                    # RELATORIOS
@@ -833,11 +1283,19 @@ def get_ldr():
 @login_required
 def gerar_relatorio():
     """Gera relatórios consolidados do sistema"""
-    data = request.get_json()
-    
+    return montar_relatorio(request.get_json())
+
+def montar_relatorio(data, progresso=None):
+    """
+    Corpo de /api/relatorio, partilhado com as tarefas em segundo plano.
+    Devolve o dicionário da resposta, (dicionário, status HTTP) em caso de
+    erro, ou uma Response em streaming. progresso(0-100) é opcional.
+    """
+    avancar = progresso or (lambda percentagem: None)
+
     # Validação básica
     if not data:
-        return jsonify({"success": False, "message": "Nenhum dado recebido"}), 400
+        return {"success": False, "message": "Nenhum dado recebido"}, 400
     
     tipo = data.get("type")
     periodo = data.get("period")
@@ -848,76 +1306,69 @@ def gerar_relatorio():
     # ============================
     # 1) Determinar intervalo de datas
     # ============================
-    today = datetime.utcnow().date()
-
     try:
-        if periodo == "today":
-            dt_start = today
-            dt_end = today
-        elif periodo == "yesterday":
-            dt_start = today - timedelta(days=1)
-            dt_end = dt_start
-        elif periodo == "week":
-            dt_start = today - timedelta(days=today.weekday())  # Segunda-feira
-            dt_end = today
-        elif periodo == "month":
-            dt_start = today.replace(day=1)
-            dt_end = today
-        elif periodo == "custom":
-            if not start_date or not end_date:
-                return jsonify({"success": False, "message": "Datas customizadas requerem startDate e endDate"}), 400
-            dt_start = datetime.strptime(start_date, "%Y-%m-%d").date()
-            dt_end = datetime.strptime(end_date, "%Y-%m-%d").date()
-            
-            # Validar intervalo (máximo 1 ano)
-            if (dt_end - dt_start).days > 365:
-                return jsonify({"success": False, "message": "Intervalo máximo é de 365 dias"}), 400
-        else:
-            return jsonify({"success": False, "message": "Período inválido"}), 400
-    except ValueError as e:
-        return jsonify({"success": False, "message": f"Formato de data inválido: {str(e)}"}), 400
+        intervalo = intervalo_periodo(periodo, start_date, end_date, max_dias=365)
+    except IntervaloInvalido as e:
+        return {"success": False, "message": str(e)}, 400
+
+    dt_start, dt_end = intervalo.data_inicio, intervalo.data_fim
 
     # ============================
-    # 2) Consulta base com filtros
+    # 2) Filtro de PZEM
     # ============================
-    base_query = EnergyData.query.filter(
-        func.date(EnergyData.timestamp) >= dt_start,
-        func.date(EnergyData.timestamp) <= dt_end
-    )
-
+    # Os relatórios de energia leem os agregados (ver agregados.py):
+    # um período de 365 dias são ~730 linhas em vez de milhões de leituras.
+    pzem_id = None
     if pzem != "all":
         try:
-            base_query = base_query.filter(EnergyData.pzem_id == int(pzem))
+            pzem_id = int(pzem)
         except ValueError:
-            return jsonify({"success": False, "message": "PZEM ID inválido"}), 400
+            return {"success": False, "message": "PZEM ID inválido"}, 400
 
     dados = []
     cfg = Configuracao.query.first()
     if not cfg:
-        return jsonify({"success": False, "message": "Configuração do sistema não encontrada"}), 500
+        return {"success": False, "message": "Configuração do sistema não encontrada"}, 500
     
     if tipo == "recargas":
         try:
             # Para recargas, ignoramos o filtro de PZEM
-            recargas = Recarga.query.filter(
-                func.date(Recarga.criado_em) >= dt_start,
-                func.date(Recarga.criado_em) <= dt_end
-            ).order_by(Recarga.criado_em.desc()).all()
+            consulta = db.select(Recarga).where(
+                filtro_intervalo(Recarga.criado_em, intervalo)
+            ).order_by(Recarga.criado_em.desc()).execution_options(yield_per=500)
+
+            def linhas_recargas():
+                for recarga in db.session.scalars(consulta):
+                    yield {
+                        "criado_em": recarga.criado_em.strftime("%Y-%m-%d %H:%M:%S"),
+                        "valor_mzn": recarga.valor_mzn,
+                        "kwh_creditados": recarga.kwh_creditados,
+                        "taxa_lixo": recarga.taxa_lixo,
+                        "taxa_radio": recarga.taxa_radio,
+                        "iva_percent": recarga.iva_percent,
+                        "preco_kwh": recarga.preco_kwh,
+                        "saldo_anterior": recarga.saldo_anterior,
+                        "saldo_atual": recarga.saldo_atual
+                    }
 
-            for recarga in recargas:
-                dados.append({
-                    "criado_em": recarga.criado_em.strftime("%Y-%m-%d %H:%M:%S"),
-                    "valor_mzn": recarga.valor_mzn,
-                    "kwh_creditados": recarga.kwh_creditados,
-                    "taxa_lixo": recarga.taxa_lixo,
-                    "taxa_radio": recarga.taxa_radio,
-                    "iva_percent": recarga.iva_percent,
-                    "preco_kwh": recarga.preco_kwh,
-                    "saldo_anterior": recarga.saldo_anterior,
-                    "saldo_atual": recarga.saldo_atual
-                })
+            formato = formato_pedido(data.get("stream"))
+            if formato:
+                return resposta_stream(
+                    formato,
+                    linhas_recargas(),
+                    chave="dados",
+                    cabecalho={"success": True},
+                    rodape=lambda total: {"metadata": {
+                        "periodo": f"{dt_start} a {dt_end}",
+                        "total_registros": total,
+                        "tipo": "historico_recargas",
+                        "pzem": "N/A"
+                    }}
+                )
 
-            return jsonify({
+            dados = list(linhas_recargas())
+
+            return {
                 "success": True, 
                 "dados": dados,
                 "metadata": {
@@ -926,34 +1377,17 @@ def gerar_relatorio():
                     "tipo": "historico_recargas",
                     "pzem": "N/A"  # Recargas não dependem de PZEM
                 }
-            })
+            }
         except Exception as e:
-            return jsonify({"success": False, "message": f"Erro ao gerar relatório de recargas: {str(e)}"}), 500
+            return {"success": False, "message": f"Erro ao gerar relatório de recargas: {str(e)}"}, 500
 
     # =============================
     # 3) Relatório de Consumo de Energia
     # =============================
     if tipo == "consumo":
         try:
-            rows = db.session.query(
-                func.date(EnergyData.timestamp).label("data"),
-                func.max(EnergyData.energy).label("max_energy"),
-                func.min(EnergyData.energy).label("min_energy")
-            ).filter(
-                func.date(EnergyData.timestamp) >= dt_start,
-                func.date(EnergyData.timestamp) <= dt_end
-            )
-
-            if pzem != "all":
-                rows = rows.filter(EnergyData.pzem_id == int(pzem))
-
-            rows = rows.group_by(func.date(EnergyData.timestamp)).all()
-
-            for data, max_energy, min_energy in rows:
-                if max_energy is None or min_energy is None:
-                    continue
-
-                consumo_real = float(max_energy) - float(min_energy)
+            # Agregado diário; dias fechados vêm da cache
+            for data, consumo_real in consumo_diario(intervalo, pzem_id).items():
                 custo = consumo_real * cfg.preco_kwh
 
                 dados.append({
@@ -962,7 +1396,7 @@ def gerar_relatorio():
                     "custo": round(custo, 2)
                 })
 
-            return jsonify({
+            return {
                 "success": True,
                 "dados": dados,
                 "metadata": {
@@ -971,37 +1405,23 @@ def gerar_relatorio():
                     "pzem": pzem,
                     "tipo": "consumo"
                 }
-            })
+            }
         except Exception as e:
-            return jsonify({"success": False, "message": f"Erro ao gerar relatório de consumo: {str(e)}"}), 500
+            return {"success": False, "message": f"Erro ao gerar relatório de consumo: {str(e)}"}, 500
 
     # ============================
     # 4) Relatório de Picos de Consumo
     # ============================
     elif tipo == "picos":
         try:
-            rows = db.session.query(
-                func.date(EnergyData.timestamp).label("data"),
-                func.max(EnergyData.power).label("pico_potencia"),
-                func.min(EnergyData.timestamp).label("primeira_ocorrencia")
-            ).filter(
-                func.date(EnergyData.timestamp) >= dt_start,
-                func.date(EnergyData.timestamp) <= dt_end
-            )
-            
-            if pzem != "all":
-                rows = rows.filter(EnergyData.pzem_id == int(pzem))
-                
-            rows = rows.group_by(func.date(EnergyData.timestamp)).all()
-
-            for data, pico, timestamp in rows:
+            for data, (pico, timestamp) in picos_diarios(intervalo, pzem_id).items():
                 dados.append({
                     "data": data.strftime("%Y-%m-%d"),
                     "pico": round(float(pico), 1),
                     "hora": timestamp.time().strftime("%H:%M") if timestamp else "--:--"
                 })
 
-            return jsonify({
+            return {
                 "success": True, 
                 "dados": dados,
                 "metadata": {
@@ -1010,9 +1430,9 @@ def gerar_relatorio():
                     "pzem": pzem,
                     "tipo": "picos"
                 }
-            })
+            }
         except Exception as e:
-            return jsonify({"success": False, "message": f"Erro ao gerar relatório de picos: {str(e)}"}), 500
+            return {"success": False, "message": f"Erro ao gerar relatório de picos: {str(e)}"}, 500
 
 #=============================================================
 # 5) Relatório de Análise de Custos
@@ -1021,47 +1441,44 @@ def gerar_relatorio():
         try:
             cfg = Configuracao.query.first()
             if not cfg:
-                return jsonify({"success": False, "message": "Configuração do sistema não encontrada"}), 500
+                return {"success": False, "message": "Configuração do sistema não encontrada"}, 500
             
-            # 1️⃣ DADOS DE CONSUMO
-            rows = db.session.query(
-                func.date(EnergyData.timestamp).label("data"),
-                func.sum(EnergyData.energy).label("energia_total")
-            ).filter(
-                func.date(EnergyData.timestamp) >= dt_start,
-                func.date(EnergyData.timestamp) <= dt_end
-            )
-            
-            if pzem != "all":
-                rows = rows.filter(EnergyData.pzem_id == int(pzem))
-                
-            rows = rows.group_by(func.date(EnergyData.timestamp)).all()
-
-            # 2️⃣ DADOS DE RECARGAS
-            recargas_periodo = db.session.query(
-                func.sum(Recarga.valor_mzn).label("total_recargas")
-            ).filter(
-                func.date(Recarga.criado_em) >= dt_start,
-                func.date(Recarga.criado_em) <= dt_end
-            ).scalar() or 0
+            # Dados para análise comparativa
+            periodo_anterior_start = dt_start - (dt_end - dt_start) - timedelta(days=1)
+            periodo_anterior_end = dt_start - timedelta(days=1)
+            periodo_anterior = intervalo_datas(periodo_anterior_start, periodo_anterior_end)
+            # 70% do limite de cada PZEM como pico
+            limiares_pico = {1: cfg.limite_pzem1 * 0.7, 2: cfg.limite_pzem2 * 0.7}
+
+            # 1️⃣ 2️⃣ 3️⃣ CONSULTAS INDEPENDENTES, EM PARALELO
+            resultados = executor_consultas.executar({
+                # Consumo diário (agregado diário)
+                "consumo": lambda: list(consumo_diario(intervalo, pzem_id).items()),
+                # Recargas
+                "recargas": lambda: db.session.query(
+                    func.sum(Recarga.valor_mzn).label("total_recargas")
+                ).filter(
+                    filtro_intervalo(Recarga.criado_em, intervalo)
+                ).scalar() or 0,
+                # Período anterior, para a análise comparativa
+                "consumo_anterior": lambda: sum(consumo_diario(periodo_anterior, pzem_id).values()),
+                # Série por bucket para as métricas vetorizadas (analitica.py)
+                "serie": lambda: serie_analitica(intervalo, pzem_id),
+            })
+            rows = resultados["consumo"]
+            recargas_periodo = resultados["recargas"]
+            consumo_periodo_anterior = resultados["consumo_anterior"]
+            serie = resultados["serie"]
 
-            # 3️⃣ DADOS PARA MÉTRICAS AVANÇADAS
+            avancar(35)
             # Consumo atual para previsões
+            dados_pzem = ler_dados_pzem()
             consumo_atual_w = dados_pzem['pzem1']['power'] + dados_pzem['pzem2']['power']
             consumo_atual_kw = consumo_atual_w / 1000
             saldo_atual_kwh = cfg.saldo_kwh
-            
-            # Dados para análise comparativa
-            periodo_anterior_start = dt_start - (dt_end - dt_start) - timedelta(days=1)
-            periodo_anterior_end = dt_start - timedelta(days=1)
-            
-            consumo_periodo_anterior = db.session.query(
-                func.sum(EnergyData.energy)
-            ).filter(
-                func.date(EnergyData.timestamp) >= periodo_anterior_start,
-                func.date(EnergyData.timestamp) <= periodo_anterior_end
-            ).scalar() or 0
+            metricas = analitica.metricas(serie, limiares_pico, cfg.preco_kwh, saldo_atual_kwh)
 
+            avancar(60)
             # 4️⃣ PROCESSAR DADOS DIÁRIOS
             custo_total = 0
             energia_total = 0
@@ -1080,20 +1497,18 @@ def gerar_relatorio():
                     "custo_dia": round(float(custo_dia), 2)
                 })
 
+            avancar(75)
             # 5️⃣ CÁLCULO DAS MÉTRICAS PROFISSIONAIS
             # Métricas básicas
             custo_medio_diario = custo_total / max(dias_com_consumo, 1)
             saldo_liquido = recargas_periodo - custo_total
             eficiencia_financeira = custo_total / max(energia_total, 1) if energia_total > 0 else 0
             
-            # Previsão de duração do saldo
-            if consumo_atual_kw > 0:
-                horas_restantes = saldo_atual_kwh / consumo_atual_kw
-                dias_restantes = horas_restantes / 24
-                previsao_termino = datetime.now() + timedelta(hours=horas_restantes)
-                previsao_str = previsao_termino.strftime('%d/%m %H:%M')
+            # Previsão de duração do saldo, ao ritmo médio das últimas 24 h da série
+            dias_restantes = metricas["dias_restantes"]
+            if metricas["previsao_termino"] is not None:
+                previsao_str = metricas["previsao_termino"].strftime('%d/%m %H:%M')
             else:
-                dias_restantes = 0
                 previsao_str = "Indeterminado"
             
             # Análise comparativa
@@ -1101,23 +1516,11 @@ def gerar_relatorio():
             if consumo_periodo_anterior > 0:
                 variacao_consumo = ((energia_total - consumo_periodo_anterior) / consumo_periodo_anterior * 100)
             
-            # Análise de eficiência
-            horas_pico = db.session.query(
-                func.count(EnergyData.id)
-            ).filter(
-                EnergyData.power > (cfg.limite_pzem1 * 0.7),  # 70% do limite como pico
-                func.date(EnergyData.timestamp) >= dt_start,
-                func.date(EnergyData.timestamp) <= dt_end
-            ).scalar() or 0
-
-            total_registros = db.session.query(
-                func.count(EnergyData.id)
-            ).filter(
-                func.date(EnergyData.timestamp) >= dt_start,
-                func.date(EnergyData.timestamp) <= dt_end
-            ).scalar() or 1
-
-            percentual_horas_pico = (horas_pico / total_registros) * 100
+            # Análise de eficiência (tempo acima do limiar, não número de registos)
+            horas_pico = metricas["horas_pico"]
+            percentual_horas_pico = metricas["percentual_tempo_pico"]
+            fator_carga = metricas["fator_carga"]
+            potencia_p95 = metricas["percentis_potencia"][95]
             
             # Score de eficiência (0-100)
             score_eficiencia = max(0, min(100, 100 - (
@@ -1141,16 +1544,11 @@ def gerar_relatorio():
                 cor_categoria = "danger"
 
             # Projeções futuras
-            dias_no_mes = 30
-            if dias_com_consumo > 0:
-                projecao_mensal_consumo = (energia_total / dias_com_consumo) * dias_no_mes
-                projecao_mensal_custo = projecao_mensal_consumo * cfg.preco_kwh
-                economia_potencial = projecao_mensal_custo * 0.12  # 12% de economia potencial
-            else:
-                projecao_mensal_consumo = 0
-                projecao_mensal_custo = 0
-                economia_potencial = 0
+            projecao_mensal_consumo, projecao_mensal_custo = analitica.projecao_mensal(
+                np.array([energia for _, energia in rows], dtype=float), cfg.preco_kwh)
+            economia_potencial = projecao_mensal_custo * 0.12  # 12% de economia potencial
 
+            avancar(90)
             # 6️⃣ ADICIONAR LINHAS DE RESUMO E MÉTRICAS
             # Separador
             dados.append({
@@ -1216,12 +1614,19 @@ def gerar_relatorio():
             # Eficiência
             dados.append({
                 "data": "⏰ Horas em Pico",
-                "energia": f"{percentual_horas_pico:.1f}%",
+                "energia": f"{horas_pico:.1f} h ({percentual_horas_pico:.1f}%)",
                 "custo_dia": ">70% limite",
                 "tipo": "metrica"
             })
-            
-            # Score
+
+            dados.append({
+                "data": "📐 Fator de Carga",
+                "energia": f"{fator_carga * 100:.1f}%",
+                "custo_dia": f"P95 {potencia_p95:.0f} W",
+                "tipo": "metrica"
+            })
+            
+            # Score
             dados.append({
                 "data": "🎯 Score de Eficiência",
                 "energia": categoria,
@@ -1267,7 +1672,7 @@ def gerar_relatorio():
                 "tipo": "economia"
             })
 
-            return jsonify({
+            return {
                 "success": True, 
                 "dados": dados,
                 "metadata": {
@@ -1291,6 +1696,10 @@ def gerar_relatorio():
                         "consumo_atual_kw": round(consumo_atual_kw, 2),
                         "variacao_consumo": round(variacao_consumo, 1),
                         "percentual_horas_pico": round(percentual_horas_pico, 1),
+                        "horas_pico": round(horas_pico, 2),
+                        "fator_carga": round(fator_carga, 3),
+                        "percentis_potencia": {f"p{p}": round(v, 1) for p, v in metricas["percentis_potencia"].items()},
+                        "variacao_diaria_media": round(metricas["variacao_diaria_media"], 1),
                         "score_eficiencia": round(score_eficiencia, 0),
                         "categoria_eficiencia": categoria,
                         "cor_categoria": cor_categoria,
@@ -1298,10 +1707,214 @@ def gerar_relatorio():
                         "economia_potencial": round(economia_potencial, 2)
                     }
                 }
-            })
+            }
         except Exception as e:
             print(f"❌ Erro na análise de custos: {e}")
-            return jsonify({"success": False, "message": f"Erro ao gerar relatório de custos: {str(e)}"}), 500
+            return {"success": False, "message": f"Erro ao gerar relatório de custos: {str(e)}"}, 500
+
+    return {"success": False, "message": "Tipo de relatório inválido"}, 400
+
+# ==========================================================
+# RELATÓRIOS EM SEGUNDO PLANO (submeter → polling → resultado)
+# ==========================================================
+# Sub-consultas independentes dos relatórios (ver consultas_paralelas.py)
+executor_consultas = ExecutorConsultas(
+    app, db,
+    max_paralelas=app.config["RELATORIO_CONSULTAS_PARALELAS"],
+    timeout=app.config["RELATORIO_CONSULTA_TIMEOUT"],
+)
+
+tarefas_relatorio = GestorTarefas(
+    estado_vivo,
+    max_simultaneas=app.config["RELATORIO_TAREFAS_MAX"],
+    max_pendentes=app.config["RELATORIO_TAREFAS_PENDENTES"],
+    retencao=app.config["RELATORIO_TAREFAS_RETENCAO"],
+    prefixo="tarefa_relatorio",
+)
+
+def executar_relatorio(data, progresso):
+    """Corre montar_relatorio fora do pedido; devolve {status, corpo}"""
+    with app.app_context():
+        resposta = montar_relatorio(data, progresso)
+    corpo, status = resposta if isinstance(resposta, tuple) else (resposta, 200)
+    # Normalizar pelo JSON do Flask (datas, Decimal do Postgres...)
+    return {"status": status, "corpo": json.loads(app.json.dumps(corpo))}
+
+def tarefa_do_utilizador(tarefa_id):
+    info = tarefas_relatorio.obter(tarefa_id)
+    if not info or info.get("dono") != current_user.id:
+        return None
+    return info
+
+def tarefa_publica(info):
+    return {
+        chave: valor.isoformat() if isinstance(valor, datetime) else valor
+        for chave, valor in info.items() if chave != "dono"
+    }
+
+@app.route('/api/relatorio/tarefas', methods=['POST'])
+@login_required
+def submeter_relatorio():
+    """Agenda /api/relatorio em segundo plano e devolve logo o id da tarefa"""
+    data = request.get_json()
+    if not data:
+        return jsonify({"success": False, "message": "Nenhum dado recebido"}), 400
+
+    data = {**data, "stream": None}
+    try:
+        info = tarefas_relatorio.submeter(
+            lambda progresso: executar_relatorio(data, progresso),
+            dono=current_user.id,
+            descricao=f"{data.get('type')} ({data.get('period')})",
+        )
+    except FilaTarefasCheia as e:
+        return jsonify({"success": False, "message": str(e)}), 503
+
+    return jsonify({
+        "success": True,
+        "tarefa": tarefa_publica(info),
+        "estado_url": url_for("estado_relatorio", tarefa_id=info["id"]),
+        "resultado_url": url_for("resultado_relatorio", tarefa_id=info["id"]),
+    }), 202
+
+@app.route('/api/relatorio/tarefas/<tarefa_id>', methods=['GET'])
+@login_required
+def estado_relatorio(tarefa_id):
+    """Estado e progresso (0-100) de uma tarefa de relatório"""
+    info = tarefa_do_utilizador(tarefa_id)
+    if not info:
+        return jsonify({"success": False, "message": "Tarefa não encontrada"}), 404
+    return jsonify({"success": True, "tarefa": tarefa_publica(info)})
+
+@app.route('/api/relatorio/tarefas/<tarefa_id>/resultado', methods=['GET'])
+@login_required
+def resultado_relatorio(tarefa_id):
+    """A resposta que /api/relatorio teria dado, quando a tarefa termina"""
+    info = tarefa_do_utilizador(tarefa_id)
+    if not info:
+        return jsonify({"success": False, "message": "Tarefa não encontrada"}), 404
+    if info["estado"] == "erro":
+        return jsonify({"success": False, "message": f"Erro ao gerar relatório: {info['erro']}"}), 500
+    if info["estado"] != "concluida":
+        return jsonify({"success": False, "message": "Relatório ainda em processamento",
+                        "tarefa": tarefa_publica(info)}), 409
+
+    resultado = tarefas_relatorio.resultado(tarefa_id)
+    if resultado is None:
+        return jsonify({"success": False, "message": "Resultado expirado"}), 404
+    return jsonify(resultado["corpo"]), resultado["status"]
+
+# ==========================================================
+# EXPORTAÇÃO DE DADOS EM STREAMING (/api/export)
+# ==========================================================
+FONTES_EXPORTACAO = ("leituras", "agregado", "recargas", "reles")
+
+# Fonte usada quando o pedido vem do formulário de relatórios (type=...)
+FONTE_POR_TIPO = {
+    "consumo": "agregado",
+    "picos": "agregado",
+    "custo": "agregado",
+    "recargas": "recargas",
+}
+
+def consulta_exportacao(fonte, intervalo, pzem_id=None, resolucao="dia"):
+    """(colunas, select) da fonte no intervalo, por ordem de tempo"""
+    if fonte == "leituras":
+        colunas = ("timestamp", "pzem_id", "voltage", "current", "power", "energy", "frequency", "pf")
+        campos = [getattr(EnergyData, c) for c in colunas]
+        tempo, pzem = EnergyData.timestamp, EnergyData.pzem_id
+    elif fonte == "agregado":
+        modelo = MODELOS_AGREGADO[resolucao]
+        colunas = ("bucket_inicio", "pzem_id", "amostras",
+                   "voltage_media", "voltage_min", "voltage_max",
+                   "current_media", "current_max",
+                   "power_media", "power_max", "power_max_em",
+                   "pf_media", "energy_delta", "energy_ultimo")
+        campos = [
+            modelo.bucket_inicio, modelo.pzem_id, modelo.amostras,
+            modelo.voltage_soma / modelo.amostras, modelo.voltage_min, modelo.voltage_max,
+            modelo.current_soma / modelo.amostras, modelo.current_max,
+            modelo.power_soma / modelo.amostras, modelo.power_max, modelo.power_max_em,
+            modelo.pf_soma / modelo.amostras, modelo.energy_delta, modelo.energy_ultimo,
+        ]
+        tempo, pzem = modelo.bucket_inicio, modelo.pzem_id
+    elif fonte == "recargas":
+        colunas = ("criado_em", "valor_mzn", "kwh_creditados", "taxa_lixo", "taxa_radio",
+                   "iva_percent", "preco_kwh", "saldo_anterior", "saldo_atual")
+        campos = [getattr(Recarga, c) for c in colunas]
+        tempo, pzem = Recarga.criado_em, None
+    else:
+        colunas = ("timestamp", "rele_id", "estado_anterior", "estado_novo",
+                   "motivo", "modo_operacao", "saldo_kwh")
+        campos = [getattr(ReleLog, c) for c in colunas]
+        tempo, pzem = ReleLog.timestamp, None
+
+    consulta = db.select(*campos).where(filtro_intervalo(tempo, intervalo))
+    if pzem is not None and pzem_id is not None:
+        consulta = consulta.where(pzem == pzem_id)
+    return colunas, consulta.order_by(tempo.asc())
+
+@app.route('/api/export', methods=['GET', 'POST'])
+@login_required
+def exportar_dados():
+    """
+    Exporta leituras, agregados, recargas ou logs de relés de qualquer
+    intervalo, em streaming (query string ou JSON):
+      format=csv|xlsx|ndjson|json, fonte=leituras|agregado|recargas|reles
+      (ou type=... do formulário de relatórios), resolucao=minuto|hora|dia,
+      period/startDate/endDate, pzem, gzip=1 (ficheiro .gz).
+    Sem gzip=1 a resposta é comprimida em trânsito se o cliente aceitar gzip.
+    """
+    data = request.get_json(silent=True) or request.args.to_dict()
+
+    formato = str(data.get("format") or "csv").lower()
+    formato = ALIASES_EXPORTACAO.get(formato, formato)
+    if formato not in FORMATOS_EXPORTACAO:
+        return jsonify({"success": False, "message": f"Formato não suportado: {formato}"}), 400
+
+    fonte = data.get("fonte") or FONTE_POR_TIPO.get(data.get("type"), "leituras")
+    if fonte not in FONTES_EXPORTACAO:
+        return jsonify({"success": False, "message": f"Fonte inválida: {fonte}"}), 400
+
+    resolucao = data.get("resolucao") or "dia"
+    if resolucao not in MODELOS_AGREGADO:
+        return jsonify({"success": False, "message": f"Resolução inválida: {resolucao}"}), 400
+
+    try:
+        intervalo = intervalo_periodo(
+            data.get("period") or "month",
+            data.get("startDate") or data.get("start"),
+            data.get("endDate") or data.get("end"),
+        )
+    except IntervaloInvalido as e:
+        return jsonify({"success": False, "message": str(e)}), 400
+
+    pzem_id = None
+    if data.get("pzem") not in (None, "", "all"):
+        try:
+            pzem_id = int(data["pzem"])
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "message": "PZEM ID inválido"}), 400
+
+    colunas, consulta = consulta_exportacao(fonte, intervalo, pzem_id, resolucao)
+    linhas = (tuple(linha) for linha in db.session.execute(consulta.execution_options(yield_per=1000)))
+    partes = gerar_exportacao(formato, colunas, linhas, nome=fonte)
+
+    mimetype, extensao = FORMATOS_EXPORTACAO[formato]
+    nome = f"{fonte}_{intervalo.data_inicio}_{intervalo.data_fim}.{extensao}"
+    headers = {"Cache-Control": "no-store", "X-Accel-Buffering": "no", "Vary": "Accept-Encoding"}
+
+    if str(data.get("gzip", "")).lower() in ("1", "true"):
+        partes = comprimir_gzip(partes)
+        mimetype, nome = "application/gzip", nome + ".gz"
+    elif formato != "xlsx" and "gzip" in request.headers.get("Accept-Encoding", ""):
+        # O XLSX já é um zip; os restantes formatos comprimem ~10x
+        partes = comprimir_gzip(partes)
+        headers["Content-Encoding"] = "gzip"
+
+    headers["Content-Disposition"] = f'attachment; filename="{nome}"'
+    print(f"📤 Exportação {fonte} ({formato}) de {intervalo.data_inicio} a {intervalo.data_fim}")
+    return Response(stream_with_context(partes), mimetype=mimetype, headers=headers)
 
 
 @app.route('/api/reles/<int:rele_id>/logs', methods=['GET'])
@@ -1323,11 +1936,13 @@ def obter_logs_rele(rele_id):
         "current_page": page
     })
 
-def registrar_log_rele(rele_id, estado_anterior, estado_novo, motivo, modo_operacao=None):
-    """Registra uma mudança de estado do relé no log"""
+def registrar_log_rele(rele_id, estado_anterior, estado_novo, motivo, modo_operacao=None,
+                       saldo=None, commit=True):
+    """Registra uma mudança de estado do relé no log (commit=False: fica na sessão)"""
     try:
-        config = Configuracao.query.first()
-        saldo_atual = config.saldo_kwh if config else 0
+        if saldo is None:
+            config = Configuracao.query.first()
+            saldo = config.saldo_kwh if config else 0
         
         log = ReleLog(
             rele_id=rele_id,
@@ -1335,10 +1950,12 @@ def registrar_log_rele(rele_id, estado_anterior, estado_novo, motivo, modo_opera
             estado_novo=estado_novo,
             motivo=motivo,
             modo_operacao=modo_operacao,
-            saldo_kwh=saldo_atual
+            saldo_kwh=saldo
         )
         
         db.session.add(log)
+        if not commit:
+            return
         db.session.commit()
         print(f"📝 Log relé {rele_id}: {estado_anterior} → {estado_novo} | Motivo: {motivo}")
         
@@ -1378,78 +1995,92 @@ def obter_energia_atual():
 # CONTROLE DE RELES
 # ==========================================================
 
-def verificar_e_controlar_reles():
-    """Liga ou desliga relés AUTOMÁTICOS baseado no saldo kWh"""
-    
-    config = Configuracao.query.first()
-    print("🔍 INICIANDO CONTROLE AUTOMÁTICO DE RELÉS")
-    if not config:
-        print("❌ Sem configuração encontrada")
-        return
-
-    saldo = config.saldo_kwh
-    print(f"🔋 SALDO ATUAL: {saldo:.2f} kWh")
-    
-    reles = Rele.query.all()
-    
-    for rele in reles:
-        print(f"🔌 Analisando {rele.nome}: modo_auto={rele.modo_automatico}, estado={rele.estado}, limite={rele.limite_individual}")
+# Limites dos relés automáticos ordenados em memória (ver controlo_reles.py)
+indice_limiares = IndiceLimiares()
+_controlo_reles_lock = threading.Lock()
 
-        # 1️⃣ Se está MANUAL → ignorar limites
-        if not rele.modo_automatico:
-            continue
+# Segundos em que o controlo automático não mexe num relé tocado à mão
+PROTECAO_MANUAL_S = 30
 
-        # 2️⃣ Proteção contra toque manual
-        if rele.ultima_alteracao_manual:
-            delta = (datetime.utcnow() - rele.ultima_alteracao_manual).total_seconds()
-            if delta < 30:
-                print(f"🛡️ Ignorando '{rele.nome}' (alterado manualmente há {delta:.1f}s)")
-                continue
+def aplicar_limite_rele(rele, saldo, agora):
+    """
+    Põe um relé automático no estado que o saldo pede (log e comando na
+    sessão, sem commit). Devolve True se o relé mudou.
+    """
+    # 1️⃣ Se está MANUAL → ignorar limites
+    if not rele.modo_automatico:
+        return False
 
-        estado_anterior = rele.estado
+    # 2️⃣ Proteção contra toque manual: volta a ser avaliado quando acabar
+    if rele.ultima_alteracao_manual:
+        delta = (agora - rele.ultima_alteracao_manual).total_seconds()
+        if delta < PROTECAO_MANUAL_S:
+            print(f"🛡️ Ignorando '{rele.nome}' (alterado manualmente há {delta:.1f}s)")
+            indice_limiares.adiar(rele.id, rele.ultima_alteracao_manual + timedelta(seconds=PROTECAO_MANUAL_S))
+            return False
+
+    # 3️⃣ DESLIGAR se saldo baixo
+    if saldo <= rele.limite_individual and rele.estado:
+        print(f"⚠️ DESLIGANDO '{rele.nome}' — SALDO({saldo:.2f}) ≤ LIMITE({rele.limite_individual})")
+        rele.estado = False
+        registrar_log_rele(rele.id, True, False, 'saldo_baixo', 'automatico', saldo=saldo, commit=False)
+        enfileirar_comando(f"RELE{rele.id}_OFF")
+        return True
 
-        # 3️⃣ DESLIGAR se saldo baixo
-        if saldo <= rele.limite_individual and rele.estado:
-            print(f"⚠️ DESLIGANDO '{rele.nome}' — SALDO({saldo:.2f}) ≤ LIMITE({rele.limite_individual})")
-            rele.estado = False
+    # 4️⃣ LIGAR se saldo alto
+    if saldo > rele.limite_individual and not rele.estado:
+        print(f"🟢 LIGANDO '{rele.nome}' — SALDO({saldo:.2f}) > LIMITE({rele.limite_individual})")
+        rele.estado = True
+        registrar_log_rele(rele.id, False, True, 'saldo_suficiente', 'automatico', saldo=saldo, commit=False)
+        enfileirar_comando(f"RELE{rele.id}_ON")
+        return True
 
-            # 🔥 REGISTRAR LOG
-            registrar_log_rele(
-                rele.id, 
-                True, 
-                False, 
-                'saldo_baixo', 
-                'automatico'
-            )
+    return False
 
-            with dados_lock:
-                comandos_pendentes.append(f"RELE{rele.id}_OFF")
-            continue
+def verificar_e_controlar_reles(saldo=None):
+    """
+    Liga ou desliga relés AUTOMÁTICOS baseado no saldo kWh. Só lê os relés
+    cujo limite o saldo cruzou desde a última avaliação (e os adiados);
+    depois de uma alteração na tabela reles passa por todos.
+    """
+    if saldo is None:
+        saldo = db.session.query(Configuracao.saldo_kwh).limit(1).scalar()
+        if saldo is None:
+            print("❌ Sem configuração encontrada")
+            return
 
-        # 4️⃣ LIGAR se saldo alto
-        if saldo > rele.limite_individual and not rele.estado:
-            print(f"🟢 LIGANDO '{rele.nome}' — SALDO({saldo:.2f}) > LIMITE({rele.limite_individual})")
-            rele.estado = True
+    with _controlo_reles_lock:
+        versao = versoes("reles")["reles"]
+        if indice_limiares.desatualizado(versao):
+            automaticos = (db.session.query(Rele.limite_individual, Rele.id)
+                           .filter(Rele.modo_automatico.is_(True))
+                           .all())
+            indice_limiares.reconstruir(versao, [tuple(linha) for linha in automaticos])
+            print(f"🔍 Índice de limites reconstruído: {len(indice_limiares)} relé(s) automático(s)")
+
+        agora = datetime.utcnow()
+        ids = indice_limiares.afetados(saldo, agora)
+        if not ids:
+            return
 
-            # 🔥 REGISTRAR LOG
-            registrar_log_rele(
-                rele.id, 
-                False, 
-                True, 
-                'saldo_suficiente', 
-                'automatico'
-            )
+        print(f"🔋 SALDO {saldo:.2f} kWh — a reavaliar {len(ids)} relé(s)")
+        try:
+            reles = Rele.query.filter(Rele.id.in_(ids)).order_by(Rele.limite_individual).all()
+            alterados = sum(aplicar_limite_rele(rele, saldo, agora) for rele in reles)
+            if not alterados:
+                return
 
-            with dados_lock:
-                comandos_pendentes.append(f"RELE{rele.id}_ON")
-            continue
+            db.session.commit()
+            print(f"💾 BD actualizada com sucesso! ({alterados} relé(s))")
+        except Exception as e:
+            print(f"❌ Erro ao salvar controle automático: {e}")
+            db.session.rollback()
+            indice_limiares.descartar()
+            return
 
-    try:
-        db.session.commit()
-        print("💾 BD actualizada com sucesso!")
-    except Exception as e:
-        print(f"❌ Erro ao salvar controle automático: {e}")
-        db.session.rollback()
+        # O commit subiu a versão "reles"; se foi o único, os limites não mudaram
+        if versoes("reles")["reles"] == versao + 1:
+            indice_limiares.confirmar_versao(versao + 1)
 # ==========================================================
 
 def verificar_e_controlar_reles_DEBUG():
@@ -1500,8 +2131,7 @@ def verificar_e_controlar_reles_DEBUG():
             comando = f"RELE{rele.id}_OFF"
             print(f"➡️ ENVIAR PARA ESP: {comando}")
 
-            with dados_lock:
-                comandos_pendentes.append(comando)
+            enfileirar_comando(comando)
             continue
 
         # 4️⃣ LIGAR se saldo alto
@@ -1512,8 +2142,7 @@ def verificar_e_controlar_reles_DEBUG():
             comando = f"RELE{rele.id}_ON"
             print(f"➡️ ENVIAR PARA ESP: {comando}")
 
-            with dados_lock:
-                comandos_pendentes.append(comando)
+            enfileirar_comando(comando)
             continue
 
         print("✔ Sem mudanças — Estado já correcto.")
@@ -1622,8 +2251,7 @@ def toggle_rele_state(rele_id):
     acao = "ON" if novo_estado else "OFF"
     comando = f"RELE{rele.id}_{acao}"
 
-    with dados_lock:
-        comandos_pendentes.append(comando)
+    enfileirar_comando(comando)
 
     try:
         db.session.commit()
@@ -1687,8 +2315,7 @@ def alterar_estado_rele(rele_id):
     # Envia comando para o ESP
     acao = "ON" if novo_estado else "OFF"
     comando = f"RELE{rele.id}_{acao}"
-    with dados_lock:
-        comandos_pendentes.append(comando)
+    enfileirar_comando(comando)
     
     try:
         db.session.commit()
@@ -1851,6 +2478,7 @@ def info_saldo():
         return jsonify({"success": False, "message": "Configuração não encontrada"}), 400
     
     # Calcular consumo médio por hora (baseado no power atual)
+    dados_pzem = ler_dados_pzem()
     consumo_atual = dados_pzem['pzem1']['power'] + dados_pzem['pzem2']['power']
     consumo_medio_hora = consumo_atual / 1000  # Converter W para kWh
     
@@ -2086,32 +2714,43 @@ def logout():
 # ==========================================================
 # FUNÇÃO DE DECREMENTO DE ENERGIA EM TEMPO REAL
 # ==========================================================
-def atualizar_saldo_com_consumo():
+def atualizar_saldo_com_consumo(ultima):
+    """
+    Desconta do saldo o consumo das leituras gravadas desde a última vez
+    até 'ultima' (a leitura mais recente do lote acabado de gravar),
+    calculado pelo mesmo motor dos relatórios.
+
+    O cursor avança por comparar-e-trocar no estado vivo: dois workers
+    nunca descontam o mesmo intervalo, e só anda para a frente. Se o
+    desconto falhar, o cursor volta atrás para o intervalo ser descontado
+    no flush seguinte.
+    """
+    chave = "saldo:contabilizado_ate"
+    # Intervalo meio-aberto: a leitura mais recente fica incluída
+    fim = ultima + timedelta(microseconds=1)
+
+    while True:
+        inicio = estado_vivo.obter(chave)
+        # Outro worker já contabilizou até mais à frente (ou lote atrasado)
+        if inicio is not None and inicio >= fim:
+            return
+        if estado_vivo.comparar_e_trocar(chave, inicio, fim):
+            break
+
+    # Sem cursor anterior conhecido não há consumo a descontar
+    if inicio is None:
+        return
 
     try:
         config = Configuracao.query.first()
         if not config:
             return
-        
-        consumo_desta_vez = 0.0
+
         saldo_anterior = config.saldo_kwh
+        intervalo = Intervalo(inicio, fim, inicio.date(), ultima.date())
+        consumo_desta_vez = sum(consumo_por_bucket(intervalo).values())
         
-        for pzem_id in [1, 2]:
-            pzem_key = f'pzem{pzem_id}'
-            
-            if (dados_pzem[pzem_key]['conectado'] and 
-                dados_pzem[pzem_key].get('energy', 0) > 0):
-                
-                consumo_atual = dados_pzem[pzem_key]['energy']
-                consumo_anterior = ultimo_consumo_conhecido[pzem_key]
-                
-                if consumo_atual >= consumo_anterior:
-                    diferenca = consumo_atual - consumo_anterior
-                    consumo_desta_vez += diferenca
-                
-                ultimo_consumo_conhecido[pzem_key] = consumo_atual
-        
-        if consumo_desta_vez > 0.001:
+        if consumo_desta_vez > 0:
             config.saldo_kwh -= consumo_desta_vez
             config.saldo_kwh = max(0, config.saldo_kwh)
 
@@ -2121,14 +2760,22 @@ def atualizar_saldo_com_consumo():
                 f"📉 Consumo: {consumo_desta_vez:.3f} kWh "
                 f"| Saldo: {saldo_anterior:.2f} → {config.saldo_kwh:.2f} kWh"
             )
-
-            verificar_e_controlar_reles()
         else:
             db.session.rollback()
 
     except Exception as e:
         print(f"❌ Erro ao atualizar saldo: {e}")
         db.session.rollback()
+        # Devolver o intervalo, se entretanto ninguém avançou o cursor
+        estado_vivo.comparar_e_trocar(chave, fim, inicio)
+        return
+
+    if consumo_desta_vez > 0:
+        try:
+            verificar_e_controlar_reles(config.saldo_kwh)
+        except Exception as e:
+            print(f"❌ Erro no controlo automático de relés: {e}")
+            db.session.rollback()
 
 # ==========================================================
 # HELPERS
@@ -2144,55 +2791,6 @@ def validar_payload(data):
 
     return True, None
 
-def preparar_energy_entries(data):
-    energy_data_entries = []
-    for i in [1, 2]:
-        pzem_key = f'pzem{i}'
-        if pzem_key in data:
-            print(f"📦 Atualizando {pzem_key}: {data[pzem_key]}")
-            
-            # Atualiza dados em memória
-            for k, v in data[pzem_key].items():
-                if k in dados_pzem[pzem_key]:
-                    dados_pzem[pzem_key][k] = v
-
-            dados_pzem[pzem_key]['conectado'] = True
-            dados_pzem[pzem_key]['ultima_atualizacao'] = datetime.now(timezone.utc)
-
-            # SEMPRE cria entrada no banco se o PZEM estiver conectado
-            if dados_pzem[pzem_key]['conectado']:
-                try:
-                    energy_data = EnergyData(
-                        pzem_id=i,
-                        voltage=float(data[pzem_key].get('voltage', 0)),
-                        current=float(data[pzem_key].get('current', 0)),
-                        power=float(data[pzem_key].get('power', 0)),
-                        energy=float(data[pzem_key].get('energy', 0)),
-                        frequency=float(data[pzem_key].get('frequency', 0)),
-                        pf=float(data[pzem_key].get('pf', 0)),
-                        timestamp=datetime.now(timezone.utc)
-                    )
-                    energy_data_entries.append(energy_data)
-                    print(f"✅ Dados do {pzem_key} preparados para salvar no banco")
-                except Exception as e:
-                    print(f"❌ Erro ao criar EnergyData para {pzem_key}: {e}")
-    
-    return energy_data_entries
-
-def salvar_energy_entries(entries):
-    if not entries:
-        return True
-    try:
-        for e in entries:
-            db.session.add(e)
-        db.session.commit()
-        print(f"✅ {len(entries)} registros salvos no banco de dados")
-        return True
-    except Exception as e:
-        print(f"❌ Erro ao salvar EnergyData no banco: {e}")
-        db.session.rollback()
-        return False
-
 def atualizar_reles_payload(data):
     """Atualiza estados vindos do ESP — SEM sobrescrever ações manuais"""
     if "reles" not in data:
@@ -2285,49 +2883,780 @@ def debug_sincronizacao_rele(rele_id):
     })
 
 
+def sincronizar_estados_reles_esp(reles_payload):
+    """Aplica os estados reportados pelo ESP (sem commit)"""
+    for r in reles_payload:
+        rele = Rele.query.get(r['id'])
+        if rele and rele.estado != r.get('estado', rele.estado):
+            rele.estado = r.get('estado', rele.estado)
+            # ✅ Log apenas se mudou
+            print(f"🔌 Relé '{rele.nome}': {'LIGADO' if rele.estado else 'DESLIGADO'}")
+
 # ==========================================================
-# PROCESSADOR DE PAYLOAD - VERSÃO CORRIGIDA
+# FILA DE INGESTÃO (write-behind)
 # ==========================================================
-def processar_payload(data):
+# ==========================================================
+# AGREGADOS MINUTO / HORA / DIA (mantidos na ingestão)
+# ==========================================================
+AGREGADOS_LINHAS_POR_UPSERT = 500
+
+# Chave do advisory lock (Postgres) que serializa os flushes dos workers
+CHAVE_BLOQUEIO_AGREGADOS = 0x61677265  # "agre"
+# Chave do advisory lock que separa as gravações de amostras brutas de
+# uma reconstrução (partilhado pelos flushes, exclusivo na reconstrução)
+CHAVE_BLOQUEIO_INGESTAO = 0x696e6765  # "inge"
+
+# Última reconstrução dos agregados: {"n", "inicio", "fim"} no estado vivo
+CHAVE_RECONSTRUCAO_AGREGADOS = "agregados:reconstrucao"
+
+def bloquear_agregados():
+    """
+    Cada worker tem o seu flusher: sem isto, dois flushes leriam a mesma
+    âncora e o consumo entre ela e o primeiro lote entrava duas vezes em
+    energy_delta. Fica bloqueado até ao commit/rollback da transação.
+    Postgres: advisory lock da transação. SQLite: um UPDATE que não mexe
+    em nada já toma o lock de escrita da base.
+    """
+    if db.engine.dialect.name == "postgresql":
+        db.session.execute(text("SELECT pg_advisory_xact_lock(:chave)"), {"chave": CHAVE_BLOQUEIO_AGREGADOS})
+    else:
+        db.session.execute(text(f"UPDATE {EnergiaPorMinuto.__tablename__} SET id = id WHERE 0 = 1"))
+
+def bloquear_ingestao(partilhado=True):
+    """
+    Ordena as gravações de amostras brutas face a uma reconstrução: cada
+    lote ficou gravado antes de ela ler energy_data ou só depois do seu
+    commit. Os flushes tomam-no partilhado (não se bloqueiam entre si).
+    No SQLite o próprio INSERT já espera pelo lock de escrita.
+    """
+    if db.engine.dialect.name == "postgresql":
+        funcao = "pg_advisory_xact_lock_shared" if partilhado else "pg_advisory_xact_lock"
+        db.session.execute(text(f"SELECT {funcao}(:chave)"), {"chave": CHAVE_BLOQUEIO_INGESTAO})
+
+def linhas_por_agregar(itens):
+    """
+    Linhas do lote que faltam nos agregados (chamar com o lock dos
+    agregados tomado). Se houve uma reconstrução entre a gravação das
+    amostras e agora, ela já leu as que caem no seu intervalo: agregá-las
+    outra vez contava-as a dobrar nas somas e nas amostras.
+    """
+    reconstrucao = estado_vivo.obter(CHAVE_RECONSTRUCAO_AGREGADOS)
+    linhas = []
+    for amostras, extras in itens:
+        if reconstrucao is None or extras.get("reconstrucao") == reconstrucao:
+            linhas.extend(amostras)
+        else:
+            linhas.extend(linha for linha in amostras
+                          if not reconstrucao["inicio"] <= linha["timestamp"] < reconstrucao["fim"])
+    return linhas
+
+def ancoras_energia(pzem_ids):
+    """
+    Última leitura de energia já agregada de cada PZEM, lida dos agregados
+    por minuto na própria transação (chamar depois de bloquear_agregados)
+    """
+    ancoras = {}
+    for pzem_id in pzem_ids:
+        ultimo = (EnergiaPorMinuto.query
+                  .filter(EnergiaPorMinuto.pzem_id == pzem_id)
+                  .order_by(EnergiaPorMinuto.bucket_inicio.desc())
+                  .first())
+        if ultimo:
+            ancoras[pzem_id] = (ultimo.ultimo_em, ultimo.energy_ultimo)
+    return ancoras
+
+def atualizar_agregados(linhas, ancoras=None):
+    """
+    Funde as linhas de energy_data nos três níveis de agregados com upserts
+    incrementais (sem commit). Sem âncoras, lê-as da BD com o lock dos
+    agregados tomado até ao fim da transação. Devolve as novas âncoras
+    (para encadear lotes, como em reconstruir_agregados).
+    """
+    if not linhas:
+        return {}
+    if ancoras is None:
+        bloquear_agregados()
+        ancoras = ancoras_energia({linha["pzem_id"] for linha in linhas})
+
+    buckets, novas_ancoras = agregar_amostras(linhas, ancoras, app.config["PZEM_ENERGIA_MAX_KWH"])
+    dialeto = db.engine.dialect.name
+
+    for resolucao, valores in buckets.items():
+        tabela = MODELOS_AGREGADO[resolucao].__table__
+        for i in range(0, len(valores), AGREGADOS_LINHAS_POR_UPSERT):
+            db.session.execute(instrucao_upsert(tabela, dialeto, valores[i:i + AGREGADOS_LINHAS_POR_UPSERT]))
+
+    return novas_ancoras
+
+def modelo_agregado(intervalo, passo_max=None):
+    """Tabela de agregados mais grossa que serve o intervalo (None → dados brutos)"""
+    resolucao = escolher_resolucao(intervalo.inicio, intervalo.fim, passo_max)
+    return MODELOS_AGREGADO.get(resolucao)
+
+def consumo_por_bucket(intervalo, passo=None, pzem_id=None):
+    """
+    {(inicio do bucket, pzem_id): kWh consumidos} — o motor de consumo
+    usado por relatórios e saldo.
+
+    Se 'passo' coincide com um nível de agregados alinhado com o intervalo,
+    lê o energy_delta já calculado na ingestão; senão (ou passo=None → um
+    bucket para o intervalo inteiro) calcula com LAG() sobre energy_data.
+    As duas vias aplicam a mesma regra de reset/rollover do contador.
+    """
+    modelo = modelo_agregado(intervalo, passo) if passo is not None else None
+    passos = {r.nome: r.passo for r in RESOLUCOES}
+
+    if modelo is not None and passos[modelo.__tablename__.rsplit("_", 1)[-1]] == passo:
+        rows = db.session.query(
+            modelo.bucket_inicio, modelo.pzem_id, modelo.energy_delta
+        ).filter(filtro_intervalo(modelo.bucket_inicio, intervalo))
+        if pzem_id is not None:
+            rows = rows.filter(modelo.pzem_id == pzem_id)
+        return {(bucket, pzem): float(energia or 0) for bucket, pzem, energia in rows}
+
+    return consumo_das_leituras(db.session, EnergyData, intervalo, passo, pzem_id,
+                                app.config["PZEM_ENERGIA_MAX_KWH"])
+
+def consumo_por_dia(intervalo, pzem_id=None):
+    """{data: kWh consumidos}, por ordem de data"""
+    consumo = {}
+    for (bucket, _), energia in sorted(consumo_por_bucket(intervalo, timedelta(days=1), pzem_id).items()):
+        dia = bucket.date()
+        consumo[dia] = consumo.get(dia, 0.0) + energia
+    return consumo
+
+def picos_por_dia(intervalo, pzem_id=None):
+    """
+    {data: (potência máxima, instante)} a partir dos agregados, ou de
+    energy_data se o intervalo não estiver alinhado nem ao minuto
+    """
+    modelo = modelo_agregado(intervalo, timedelta(days=1))
+    if modelo is None:
+        rows = db.session.query(
+            EnergyData.timestamp, EnergyData.power, EnergyData.timestamp
+        ).filter(filtro_intervalo(EnergyData.timestamp, intervalo))
+        if pzem_id is not None:
+            rows = rows.filter(EnergyData.pzem_id == pzem_id)
+        rows = rows.order_by(EnergyData.timestamp).yield_per(10000)
+    else:
+        rows = db.session.query(
+            modelo.bucket_inicio, modelo.power_max, modelo.power_max_em
+        ).filter(filtro_intervalo(modelo.bucket_inicio, intervalo))
+        if pzem_id is not None:
+            rows = rows.filter(modelo.pzem_id == pzem_id)
+        rows = rows.order_by(modelo.bucket_inicio)
+
+    picos = {}
+    for bucket, pico, instante in rows:
+        dia = bucket.date()
+        if dia not in picos or pico > picos[dia][0]:
+            picos[dia] = (pico, instante)
+    return picos
+
+def resumo_por_dia(intervalo, pzem_id=None):
+    """
+    Uma linha por dia: (dia, soma potência, média tensão, soma corrente,
+    última energia), agrupada no SQL sobre o agregado diário. Intervalos
+    que não são dias inteiros são agrupados por dia aqui, a partir do
+    agregado mais grosso que os serve (ou de energy_data).
+    """
+    modelo = modelo_agregado(intervalo, timedelta(days=1))
+    if modelo is not EnergiaPorDia:
+        return resumo_por_dia_agrupado(intervalo, modelo, pzem_id)
+
+    filtros = [filtro_intervalo(modelo.bucket_inicio, intervalo)]
+    if pzem_id is not None:
+        filtros.append(modelo.pzem_id == pzem_id)
+
+    # Energia do PZEM com a leitura mais recente de cada dia
+    outro = db.aliased(modelo)
+    ultima_energia = (
+        db.select(outro.energy_ultimo)
+        .where(outro.bucket_inicio == modelo.bucket_inicio,
+               *([outro.pzem_id == pzem_id] if pzem_id is not None else []))
+        .order_by(outro.ultimo_em.desc())
+        .limit(1)
+        .correlate(modelo)
+        .scalar_subquery()
+    )
+
+    rows = db.session.execute(
+        db.select(
+            modelo.bucket_inicio,
+            func.sum(modelo.power_soma),
+            func.sum(modelo.voltage_soma) / func.nullif(func.sum(modelo.amostras), 0),
+            func.sum(modelo.current_soma),
+            ultima_energia,
+        )
+        .where(*filtros)
+        .group_by(modelo.bucket_inicio)
+        .order_by(modelo.bucket_inicio)
+    )
+
+    return [
+        (bucket.date(), float(potencia or 0), float(tensao or 0),
+         float(corrente or 0), float(energia or 0))
+        for bucket, potencia, tensao, corrente, energia in rows
+    ]
+
+def resumo_por_dia_agrupado(intervalo, modelo=None, pzem_id=None):
+    """resumo_por_dia a partir de buckets menores que um dia (modelo=None → energy_data)"""
+    if modelo is None:
+        um = db.literal(1)
+        colunas = (EnergyData.timestamp, EnergyData.power, EnergyData.voltage, um,
+                   EnergyData.current, EnergyData.timestamp, EnergyData.energy)
+        instante, pzem = EnergyData.timestamp, EnergyData.pzem_id
+    else:
+        colunas = (modelo.bucket_inicio, modelo.power_soma, modelo.voltage_soma, modelo.amostras,
+                   modelo.current_soma, modelo.ultimo_em, modelo.energy_ultimo)
+        instante, pzem = modelo.bucket_inicio, modelo.pzem_id
+
+    rows = db.session.query(*colunas).filter(filtro_intervalo(instante, intervalo))
+    if pzem_id is not None:
+        rows = rows.filter(pzem == pzem_id)
+
+    # dia → [potência, soma tensão, amostras, corrente, instante da última energia, energia]
+    dias = {}
+    for bucket, potencia, tensao, amostras, corrente, ultimo_em, energia in rows.yield_per(10000):
+        d = dias.setdefault(bucket.date(), [0.0, 0.0, 0, 0.0, None, 0.0])
+        d[0] += potencia or 0
+        d[1] += tensao or 0
+        d[2] += amostras or 0
+        d[3] += corrente or 0
+        if d[4] is None or ultimo_em > d[4]:
+            d[4], d[5] = ultimo_em, float(energia or 0)
+
+    return [
+        (dia, d[0], d[1] / d[2] if d[2] else 0.0, d[3], d[5])
+        for dia, d in sorted(dias.items())
+    ]
+
+def relatorio_por_dia(tipo, intervalo, pzem_id, calcular):
+    """
+    {data: valor} do relatório 'tipo', por ordem de data. Os dias fechados
+    vêm de relatorio_cache_dia (os que faltam são calculados numa única
+    chamada e gravados); o dia de hoje é sempre recalculado.
+
+    calcular(intervalo, pzem_id) → {data: valor}, só com os dias com dados.
+    """
+    chave_pzem = pzem_id if pzem_id is not None else TODOS_PZEMS
+    hoje = datetime.utcnow().date()
+    fechados = [dia for dia in dias_do_intervalo(intervalo) if dia_fechado(dia, hoje)]
+    resultado = {}
+
+    if fechados:
+        # Versões lidas antes de calcular: uma leitura atrasada que entre
+        # a meio deixa o dia gravado com a versão velha, e é recalculado
+        versoes = versoes_dias(fechados[0], fechados[-1])
+        guardados = {
+            dia: desserializar(dados)
+            for dia, dados in db.session.query(RelatorioDia.dia, RelatorioDia.dados).filter(
+                RelatorioDia.tipo == tipo,
+                RelatorioDia.pzem_id == chave_pzem,
+                RelatorioDia.dia >= fechados[0],
+                RelatorioDia.dia <= fechados[-1],
+            )
+        }
+
+        em_falta = [dia for dia in fechados
+                    if dia not in guardados or guardados[dia][0] != versoes.get(dia, 0)]
+        if em_falta:
+            calculado = calcular(intervalo_datas(em_falta[0], em_falta[-1]), pzem_id)
+            agora = datetime.utcnow()
+            novos = [
+                {"tipo": tipo, "pzem_id": chave_pzem, "dia": dia,
+                 "dados": serializar(calculado.get(dia), versoes.get(dia, 0)), "criado_em": agora}
+                for dia in em_falta
+            ]
+            dialeto = db.engine.dialect.name
+            for i in range(0, len(novos), 500):
+                db.session.execute(instrucao_guardar(RelatorioDia.__table__, dialeto, novos[i:i + 500]))
+            db.session.commit()
+            guardados.update((dia, (versoes.get(dia, 0), calculado.get(dia))) for dia in em_falta)
+
+        for dia in fechados:
+            valor = guardados[dia][1]
+            if valor is not None:
+                resultado[dia] = valor
+
+    if intervalo.data_inicio <= hoje <= intervalo.data_fim:
+        resultado.update(calcular(intervalo_dia(hoje), pzem_id))
+
+    return dict(sorted(resultado.items()))
+
+def versoes_dias(primeiro, ultimo):
+    """
+    {data: versão dos dados} dos dias [primeiro, ultimo]: total de amostras
+    de todos os PZEMs no agregado por dia (só sobe com leituras novas)
+    """
+    intervalo = intervalo_datas(primeiro, ultimo)
+    rows = db.session.query(
+        EnergiaPorDia.bucket_inicio, func.sum(EnergiaPorDia.amostras)
+    ).filter(filtro_intervalo(EnergiaPorDia.bucket_inicio, intervalo)).group_by(EnergiaPorDia.bucket_inicio)
+    return {bucket.date(): int(amostras or 0) for bucket, amostras in rows}
+
+def consumo_diario(intervalo, pzem_id=None):
+    """consumo_por_dia com cache dos dias fechados"""
+    return relatorio_por_dia("consumo", intervalo, pzem_id, consumo_por_dia)
+
+def picos_diarios(intervalo, pzem_id=None):
+    """picos_por_dia com cache dos dias fechados"""
+    return relatorio_por_dia("picos", intervalo, pzem_id, picos_por_dia)
+
+def serie_analitica(intervalo, pzem_id=None):
+    """
+    Série por bucket para analitica.py: agregado por minuto até
+    ANALITICA_MINUTOS_ATE_DIAS dias, por hora acima disso. Uma única
+    consulta; a média de potência de cada bucket é soma / amostras.
+    """
+    dias = (intervalo.fim - intervalo.inicio).days
+    passo = timedelta(minutes=1) if dias <= app.config["ANALITICA_MINUTOS_ATE_DIAS"] else timedelta(hours=1)
+    modelo = modelo_agregado(intervalo, passo) or EnergiaPorMinuto
+
+    rows = db.session.query(
+        modelo.bucket_inicio,
+        modelo.pzem_id,
+        modelo.power_soma / modelo.amostras,
+        modelo.power_max,
+        modelo.energy_delta,
+    ).filter(filtro_intervalo(modelo.bucket_inicio, intervalo), modelo.amostras > 0)
+    if pzem_id is not None:
+        rows = rows.filter(modelo.pzem_id == pzem_id)
+
+    passo_modelo = {r.nome: r.passo for r in RESOLUCOES}[modelo.__tablename__.rsplit("_", 1)[-1]]
+    return analitica.montar_serie(rows.yield_per(10000), int(passo_modelo.total_seconds()))
+
+def invalidar_relatorios_dias(dias):
+    """
+    Apaga da cache os dias fechados que receberam leituras (sem commit).
+    O que um relatório em curso ainda grave desses dias fica com a versão
+    antiga e é recalculado (ver relatorio_por_dia).
+    """
+    hoje = datetime.utcnow().date()
+    fechados = {dia for dia in dias if dia_fechado(dia, hoje)}
+    if fechados:
+        RelatorioDia.query.filter(RelatorioDia.dia.in_(fechados)).delete(synchronize_session=False)
+
+def reconstruir_agregados(desde=None, ate=None, lote=5000):
+    """Apaga e recalcula os agregados de [desde, ate] a partir de energy_data"""
+    # Com o sistema a correr: os flushes esperam pelo fim da reconstrução,
+    # e os lotes já gravados mas ainda por agregar saltam o que ela leu
+    bloquear_ingestao(partilhado=False)
+    bloquear_agregados()
+
+    if not desde:
+        primeiro = db.session.query(func.min(EnergyData.timestamp)).scalar()
+        if primeiro is None:
+            db.session.rollback()
+            print("ℹ️ energy_data vazia — nada a agregar")
+            return
+        desde = primeiro.date()
+    intervalo = intervalo_periodo("custom", desde, ate or datetime.utcnow().date())
+
+    anterior = estado_vivo.obter(CHAVE_RECONSTRUCAO_AGREGADOS)
+    reconstrucao = {"n": (anterior or {}).get("n", 0) + 1, "inicio": intervalo.inicio, "fim": intervalo.fim}
+    estado_vivo.definir(CHAVE_RECONSTRUCAO_AGREGADOS, reconstrucao)
     try:
-        with dados_lock:
-            print("🔄 Processando payload dos PZEMs...")
+        total = reagregar_intervalo(intervalo, lote)
+    except Exception:
+        db.session.rollback()
+        estado_vivo.comparar_e_trocar(CHAVE_RECONSTRUCAO_AGREGADOS, reconstrucao, anterior)
+        raise
+
+    print(f"✅ Agregados reconstruídos de {intervalo.data_inicio} a {intervalo.data_fim}: {total} leituras")
+
+def reagregar_intervalo(intervalo, lote):
+    """Corpo de reconstruir_agregados, com os locks já tomados (faz commit)"""
+    for modelo in MODELOS_AGREGADO.values():
+        modelo.query.filter(filtro_intervalo(modelo.bucket_inicio, intervalo)).delete(synchronize_session=False)
+    RelatorioDia.query.filter(
+        RelatorioDia.dia >= intervalo.data_inicio, RelatorioDia.dia <= intervalo.data_fim
+    ).delete(synchronize_session=False)
+
+    # Âncora de cada PZEM: a última leitura antes do intervalo
+    ancoras = {}
+    pzem_ids = [p for (p,) in db.session.query(EnergyData.pzem_id).distinct()]
+    for pzem_id in pzem_ids:
+        anterior = (db.session.query(EnergyData.timestamp, EnergyData.energy)
+                    .filter(EnergyData.pzem_id == pzem_id, EnergyData.timestamp < intervalo.inicio)
+                    .order_by(EnergyData.timestamp.desc())
+                    .first())
+        if anterior:
+            ancoras[pzem_id] = (anterior.timestamp, anterior.energy)
+
+    colunas = [EnergyData.pzem_id, EnergyData.timestamp, EnergyData.voltage, EnergyData.current,
+               EnergyData.power, EnergyData.energy, EnergyData.pf]
+    consulta = (db.select(*colunas)
+                .where(filtro_intervalo(EnergyData.timestamp, intervalo))
+                .order_by(EnergyData.pzem_id, EnergyData.timestamp)
+                .execution_options(yield_per=lote))
+
+    total = 0
+    for parte in db.session.execute(consulta).partitions():
+        linhas = [dict(linha._mapping) for linha in parte]
+        ancoras = atualizar_agregados(linhas, ancoras)
+        total += len(linhas)
+        print(f"   … {total} leituras agregadas")
 
-            # PASSO 1: Atualizar saldo baseado no consumo acumulado
-            atualizar_saldo_com_consumo()  # DESCOMENTE ESTA LINHA!
+    db.session.commit()
+    return total
 
-            # PASSO 2: Preparar registros EnergyData
-            energy_entries = preparar_energy_entries(data)
+@app.cli.command("reconstruir-agregados")
+@click.option("--desde", help="Primeiro dia (YYYY-MM-DD); padrão: primeira leitura")
+@click.option("--ate", help="Último dia (YYYY-MM-DD); padrão: hoje")
+def reconstruir_agregados_command(desde, ate):
+    """Recalcula os agregados minuto/hora/dia a partir de energy_data"""
+    with app.app_context():
+        reconstruir_agregados(desde, ate)
 
-            # PASSO 3: Salvar registros no banco
-            success = salvar_energy_entries(energy_entries)
-            
-            if not success:
-                print("❌ Falha ao salvar dados no banco")
-                return False
+# ==========================================================
+# PICOS DIÁRIOS / SEMANAIS / MENSAIS (mantidos na ingestão)
+# ==========================================================
+def atualizar_picos(linhas):
+    """Compara e atualiza daily/weekly/monthly_peaks com o lote (sem commit)"""
+    if not linhas:
+        return
+    dialeto = db.engine.dialect.name
+    for nivel, valores in candidatos_pico(linhas).items():
+        db.session.execute(instrucao_upsert_pico(MODELOS_PICO[nivel].__table__, nivel, dialeto, valores))
 
-            # PASSO 4: Atualizar estados dos relés (payload)
-            atualizar_reles_payload(data)
+def reconstruir_picos(desde=None, ate=None, lote=5000):
+    """
+    Recalcula os picos a partir de energy_data. Sem intervalo apaga e
+    refaz tudo; com intervalo só sobe picos (o upsert é idempotente).
+    """
+    consulta = db.select(EnergyData.pzem_id, EnergyData.timestamp, EnergyData.power)
+
+    if desde or ate:
+        intervalo = intervalo_periodo("custom", desde or "2000-01-01", ate or datetime.utcnow().date())
+        consulta = consulta.where(filtro_intervalo(EnergyData.timestamp, intervalo))
+    else:
+        for modelo in MODELOS_PICO.values():
+            modelo.query.delete(synchronize_session=False)
+
+    total = 0
+    for parte in db.session.execute(consulta.execution_options(yield_per=lote)).partitions():
+        linhas = [dict(linha._mapping) for linha in parte]
+        atualizar_picos(linhas)
+        total += len(linhas)
+        print(f"   … {total} leituras processadas")
+
+    db.session.commit()
+    print(f"✅ Picos reconstruídos a partir de {total} leituras")
 
-            # PASSO 5: Verificar e controlar relés em modo automático
-            verificar_e_controlar_reles()
+@app.cli.command("reconstruir-picos")
+@click.option("--desde", help="Primeiro dia (YYYY-MM-DD)")
+@click.option("--ate", help="Último dia (YYYY-MM-DD)")
+def reconstruir_picos_command(desde, ate):
+    """Recalcula daily/weekly/monthly_peaks a partir de energy_data"""
+    with app.app_context():
+        reconstruir_picos(desde, ate)
+
+def gravar_lote_ingestao(itens):
+    """
+    1º passo do flush (thread da fila): grava todas as amostras brutas com
+    um único INSERT, numa transação só delas. Se falhar nada foi gravado e
+    a fila pode tentar de novo.
+    """
+    with app.app_context():
+        linhas = [linha for amostras, _ in itens for linha in amostras]
+        if not linhas:
+            return
+        try:
+            bloquear_ingestao()
+            db.session.execute(db.insert(EnergyData), linhas)
+            # Lida depois de tomar o lock: diz ao 2º passo se uma
+            # reconstrução já incluiu estas amostras
+            reconstrucao = estado_vivo.obter(CHAVE_RECONSTRUCAO_AGREGADOS)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        for _, extras in itens:
+            extras["reconstrucao"] = reconstrucao
+        print(f"💾 Flush da fila: {len(linhas)} registros salvos ({len(itens)} pedidos)")
+
+def derivar_lote_ingestao(itens):
+    """
+    2º passo do flush, só depois de as amostras estarem gravadas: atualiza
+    agregados e picos, apaga a cache dos dias afetados e aplica o estado de
+    relés mais recente, tudo numa transação que pode ser repetida (se
+    falhar nada foi aplicado). Depois do commit nada pode voltar a correr
+    o passo: o que vem a seguir só regista falhas.
+    """
+    with app.app_context():
+        linhas = [linha for amostras, _ in itens for linha in amostras]
+        reles_payload = None
+        for _, extras in itens:
+            if extras.get("reles") is not None:
+                reles_payload = extras["reles"]
+
+        try:
+            if linhas:
+                bloquear_agregados()
+                atualizar_agregados(linhas_por_agregar(itens))
+                atualizar_picos(linhas)
+                invalidar_relatorios_dias({linha["timestamp"].date() for linha in linhas})
+            if reles_payload:
+                sincronizar_estados_reles_esp(reles_payload)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        try:
+            if linhas:
+                invalidar("picos")
+        except Exception as e:
+            print(f"⚠️ Derivados gravados, mas falhou a atualização do estado vivo: {e}")
+
+        # Saldo: um único decremento até à leitura mais recente do lote
+        if linhas:
+            atualizar_saldo_com_consumo(max(linha["timestamp"] for linha in linhas))
+
+fila_ingestao = FilaIngestao(
+    gravar_lote_ingestao,
+    derivar_lote_ingestao,
+    capacidade=app.config["INGESTAO_FILA_CAPACIDADE"],
+    lote_max=app.config["INGESTAO_FLUSH_LOTE"],
+    intervalo=app.config["INGESTAO_FLUSH_INTERVALO"],
+)
+atexit.register(fila_ingestao.esvaziar)
+
+def enfileirar_ingestao(linhas, reles_payload=None):
+    """Enfileira (ou grava já, se a ingestão assíncrona estiver desligada)"""
+    extras = {"reles": reles_payload}
+    if not app.config["INGESTAO_ASSINCRONA"]:
+        gravar_lote_ingestao([(linhas, extras)])
+        try:
+            derivar_lote_ingestao([(linhas, extras)])
+        except Exception as e:
+            print(f"❌ Derivados por atualizar (amostras gravadas): {e}")
+        return True
+    return fila_ingestao.enfileirar(linhas, extras)
+
+def fila_cheia_resposta():
+    """503 com Retry-After: o ESP deve manter as amostras no buffer e reenviar"""
+    resposta = jsonify({
+        "status": "busy",
+        "error": "Fila de ingestão cheia",
+        "profundidade": fila_ingestao.profundidade()
+    })
+    resposta.headers["Retry-After"] = str(max(1, int(app.config["INGESTAO_FLUSH_INTERVALO"])))
+    return resposta, 503
+
+@app.route('/api/ingestao/metricas', methods=['GET'])
+def metricas_ingestao():
+    """Profundidade da fila e contadores do flusher"""
+    api_key = request.args.get('api_key')
+    if not (api_key and api_key in API_KEYS) and not current_user.is_authenticated:
+        return jsonify({"success": False, "error": "Unauthorized"}), 401
+
+    return jsonify({
+        "success": True,
+        "assincrona": app.config["INGESTAO_ASSINCRONA"],
+        "metricas": fila_ingestao.metricas()
+    })
+
+# ==========================================================
+# INGESTÃO EM LOTE (várias amostras por pedido)
+# ==========================================================
+CAMPOS_LEITURA_PZEM = ("voltage", "current", "power", "energy", "frequency", "pf")
+
+def payload_em_lote(data):
+    """True se o payload traz várias amostras (formato de lote)"""
+    if isinstance(data.get("amostras"), list):
+        return True
+    return any(isinstance(data.get(f"pzem{i}"), list) for i in [1, 2])
+
+def interpretar_instante_amostra(amostra, agora, relogio_esp_ms=None):
+    """
+    Converte o instante de uma amostra para datetime UTC (sem tzinfo).
+
+    Aceita "ts" em epoch (segundos ou milissegundos) ou ISO 8601, ou
+    "ms" (millis() do ESP) relativo ao "agora_ms" enviado no lote.
+    Sem nenhum dos dois, assume o instante de receção.
+    """
+    ts = amostra.get("ts")
+    if ts is not None:
+        if isinstance(ts, (int, float)):
+            if ts > 1e12:  # epoch em milissegundos
+                ts = ts / 1000.0
+            return datetime.fromtimestamp(ts, timezone.utc).replace(tzinfo=None)
+
+        instante = datetime.fromisoformat(str(ts).replace("Z", "+00:00"))
+        if instante.tzinfo:
+            instante = instante.astimezone(timezone.utc).replace(tzinfo=None)
+        return instante
+
+    if amostra.get("ms") is not None and relogio_esp_ms is not None:
+        return agora - timedelta(milliseconds=float(relogio_esp_ms) - float(amostra["ms"]))
+
+    return agora
+
+def extrair_amostras_lote(data):
+    """
+    Normaliza os dois formatos de lote em linhas prontas para EnergyData:
+
+    - {"pzem1": [{"ts": ..., "voltage": ...}, ...], "pzem2": [...]}
+    - {"amostras": [{"ts": ..., "pzem1": {...}, "pzem2": {...}}, ...]}
+
+    Retorna (linhas, rejeitadas).
+    """
+    agora = datetime.utcnow()
+    relogio_esp_ms = data.get("agora_ms")
+    limite_futuro = agora + timedelta(minutes=5)
+
+    # (pzem_id, objeto com o instante, objeto com as leituras)
+    candidatos = []
+    if isinstance(data.get("amostras"), list):
+        for bloco in data["amostras"]:
+            if not isinstance(bloco, dict):
+                candidatos.append((None, None, None))
+                continue
+            for i in [1, 2]:
+                if f"pzem{i}" in bloco:
+                    candidatos.append((i, bloco, bloco[f"pzem{i}"]))
+
+    for i in [1, 2]:
+        if isinstance(data.get(f"pzem{i}"), list):
+            for leitura in data[f"pzem{i}"]:
+                candidatos.append((i, leitura, leitura))
+
+    linhas = []
+    rejeitadas = 0
+    for pzem_id, origem_instante, leitura in candidatos:
+        if not isinstance(origem_instante, dict) or not isinstance(leitura, dict):
+            rejeitadas += 1
+            continue
+        if leitura.get("conectado") is False:
+            rejeitadas += 1
+            continue
+        try:
+            instante = interpretar_instante_amostra(origem_instante, agora, relogio_esp_ms)
+            valores = {campo: float(leitura.get(campo, 0)) for campo in CAMPOS_LEITURA_PZEM}
+        except (TypeError, ValueError, OverflowError, OSError):
+            rejeitadas += 1
+            continue
+
+        if instante > limite_futuro or not all(math.isfinite(v) for v in valores.values()):
+            rejeitadas += 1
+            continue
+
+        valores["pzem_id"] = pzem_id
+        valores["timestamp"] = instante
+        linhas.append(valores)
+
+    return linhas, rejeitadas
+
+def processar_lote(data, start_time):
+    """Valida um lote, atualiza o estado em memória e enfileira as amostras"""
+    linhas, rejeitadas = extrair_amostras_lote(data)
+
+    limite = app.config["INGESTAO_LOTE_MAX_AMOSTRAS"]
+    if len(linhas) + rejeitadas > limite:
+        return jsonify({"error": f"Lote excede o máximo de {limite} amostras"}), 413
+
+    lote = ingerir_lote(linhas, rejeitadas, data.get('reles'))
+    if lote is None:
+        return fila_cheia_resposta()
+
+    response_time = (datetime.now() - start_time).total_seconds()
+    print(f"📦 Lote: {len(linhas)} amostras aceites, {rejeitadas} rejeitadas")
+
+    return jsonify({
+        "status": "success",
+        "message": "Lote recebido",
+        "records_queued": len(linhas),
+        "lote": lote,
+        "processing_time": f"{response_time:.2f}s"
+    }), 200
+
+def ingerir_lote(linhas, rejeitadas, reles_payload=None):
+    """
+    Enfileira as amostras já validadas de um lote e atualiza o estado em
+    memória. Devolve o resumo do lote, ou None se a fila estiver cheia.
+    """
+    linhas.sort(key=lambda l: l["timestamp"])
+
+    # Estado em memória vem apenas da amostra mais recente de cada PZEM
+    mais_recentes = {}
+    contagem = {}
+    for linha in linhas:
+        pzem_key = f"pzem{linha['pzem_id']}"
+        mais_recentes[pzem_key] = linha
+        contagem[pzem_key] = contagem.get(pzem_key, 0) + 1
+
+    if not enfileirar_ingestao(linhas, reles_payload):
+        return None
+
+    for pzem_key, linha in mais_recentes.items():
+        campos = {campo: linha[campo] for campo in CAMPOS_LEITURA_PZEM}
+        campos['conectado'] = True
+        campos['ultima_atualizacao'] = linha["timestamp"].replace(tzinfo=timezone.utc)
+        atualizar_dados_pzem(pzem_key, campos)
+
+    return {
+        "recebidas": len(linhas) + rejeitadas,
+        "aceites": len(linhas),
+        "rejeitadas": rejeitadas,
+        "inicio": linhas[0]["timestamp"].isoformat() if linhas else None,
+        "fim": linhas[-1]["timestamp"].isoformat() if linhas else None,
+        "por_pzem": {
+            pzem_key: {
+                "aceites": contagem[pzem_key],
+                "mais_recente": linha["timestamp"].isoformat()
+            }
+            for pzem_key, linha in mais_recentes.items()
+        }
+    }
+
+@app.route('/api/dados/lote', methods=['POST'])
+def receber_dados_lote():
+    """Recebe um lote de amostras acumuladas no buffer do ESP8266"""
+    start_time = datetime.now()
+    data = request.get_json(force=True, silent=True)
+
+    if not data or 'api_key' not in data or data['api_key'] not in API_KEYS:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    return processar_lote(data, start_time)
+
+def ingerir_leituras(data, reles_payload=None):
+    """
+    Uma leitura por PZEM (formato clássico de /api/dados): estado vivo +
+    fila de ingestão. Devolve o nº de registos enfileirados, ou None se a
+    fila estiver cheia.
+    """
+    # PASSO 1: Atualizar estado vivo (MUITO RÁPIDO)
+    for i in [1, 2]:
+        pzem_key = f'pzem{i}'
+        if pzem_key in data:
+            campos = {k: v for k, v in data[pzem_key].items() if k in PZEM_PADRAO}
+            campos['conectado'] = True
+            campos['ultima_atualizacao'] = datetime.now(timezone.utc)
+            atualizar_dados_pzem(pzem_key, campos)
 
-            # PASSO 6: Persistir mudanças dos relés
+    # PASSO 2: Preparar linhas para o histórico
+    agora = datetime.utcnow()
+    linhas = []
+    for i in [1, 2]:
+        pzem_key = f'pzem{i}'
+        if pzem_key in data:
             try:
-                db.session.commit()
-                print("✅ Estados dos relés atualizados no banco")
-            except Exception as e:
-                print(f"❌ Erro ao salvar estados dos relés: {e}")
-                db.session.rollback()
-                return False
+                linha = {campo: float(data[pzem_key].get(campo, 0)) for campo in CAMPOS_LEITURA_PZEM}
+            except (TypeError, ValueError) as e:
+                print(f"❌ Erro ao preparar leitura do {pzem_key}: {e}")
+                continue
+            linha["pzem_id"] = i
+            linha["timestamp"] = agora
+            linhas.append(linha)
 
-            print("✅ Payload processado com sucesso")
-            return True
+    # PASSO 3: Enfileirar — saldo, histórico e relés são gravados pelo flusher
+    if not enfileirar_ingestao(linhas, reles_payload):
+        return None
+    return len(linhas)
 
-    except Exception as e:
-        print(f"❌ Erro inesperado durante o processamento: {e}")
-        db.session.rollback()
-        return False
 # ==========================================================
 # ROTA REFACTORADA
 # ==========================================================
@@ -2348,85 +3677,28 @@ def receber_dados():
 
     print(f"📡 Dados recebidos do ESP8266 no Railway")
 
-    try:
-        # ✅✅✅ PROCESSAMENTO OTIMIZADO PARA RAILWAY
-        
-        # PASSO 1: Atualizar dados em memória (MUITO RÁPIDO)
-        for i in [1, 2]:
-            pzem_key = f'pzem{i}'
-            if pzem_key in data:
-                # Atualização direta sem prints para ser mais rápido
-                for k, v in data[pzem_key].items():
-                    if k in dados_pzem[pzem_key]:
-                        dados_pzem[pzem_key][k] = v
-                dados_pzem[pzem_key]['conectado'] = True
-                dados_pzem[pzem_key]['ultima_atualizacao'] = datetime.now(timezone.utc)
-
-        # PASSO 2: ✅ ATUALIZAR SALDO (CRÍTICO)
-        atualizar_saldo_com_consumo()
-
-        # PASSO 3: Salvar dados históricos de forma ASSÍNCRONA
-        energy_entries = []
-        for i in [1, 2]:
-            pzem_key = f'pzem{i}'
-            if pzem_key in data and dados_pzem[pzem_key]['conectado']:
-                try:
-                    energy_data = EnergyData(
-                        pzem_id=i,
-                        voltage=float(data[pzem_key].get('voltage', 0)),
-                        current=float(data[pzem_key].get('current', 0)),
-                        power=float(data[pzem_key].get('power', 0)),
-                        energy=float(data[pzem_key].get('energy', 0)),
-                        frequency=float(data[pzem_key].get('frequency', 0)),
-                        pf=float(data[pzem_key].get('pf', 0)),
-                        timestamp=datetime.now(timezone.utc)
-                    )
-                    energy_entries.append(energy_data)
-                except Exception as e:
-                    print(f"❌ Erro ao criar EnergyData para {pzem_key}: {e}")
-
-        # ✅ SALVAMENTO EM LOTE (mais eficiente)
-        if energy_entries:
-            try:
-                db.session.bulk_save_objects(energy_entries)
-                db.session.commit()
-                print(f"💾 {len(energy_entries)} registros salvos no Railway")
-            except Exception as e:
-                print(f"❌ Erro ao salvar no Railway: {e}")
-                db.session.rollback()
-
-        # PASSO 4: Atualizar estados dos relés (SE HOUVER DADOS)
-        if 'reles' in data:
-            for r in data['reles']:
-                rele = Rele.query.get(r['id'])
-                if rele and rele.estado != r.get('estado', rele.estado):
-                    rele.estado = r.get('estado', rele.estado)
-                    # ✅ Log apenas se mudou
-                    print(f"🔌 Relé '{rele.nome}': {'LIGADO' if rele.estado else 'DESLIGADO'}")
-
-            # ✅ Commit único para todos os relés
-            try:
-                db.session.commit()
-            except Exception as e:
-                print(f"❌ Erro ao salvar estados dos relés: {e}")
-                db.session.rollback()
+    # Firmware com buffer local envia várias amostras no mesmo pedido
+    if payload_em_lote(data):
+        return processar_lote(data, start_time)
 
- 
+    try:
+        registros = ingerir_leituras(data, data.get('reles'))
+        if registros is None:
+            return fila_cheia_resposta()
 
         # ✅ RESPOSTA IMEDIATA para o ESP (CRÍTICO)
         response_time = (datetime.now() - start_time).total_seconds()
-        
+
         return jsonify({
-            "status": "success", 
+            "status": "success",
             "message": "Dados recebidos no Railway",
-            "records_saved": len(energy_entries),
+            "records_queued": registros,
             "processing_time": f"{response_time:.2f}s",
             "environment": "railway"
         }), 200
 
     except Exception as e:
         print(f"❌ Erro no processamento Railway: {e}")
-        db.session.rollback()
         return jsonify({"error": "Internal server error"}), 500
 
 # ==========================================================
@@ -2451,114 +3723,270 @@ def debug_dados():
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-# Função separada para processamento pesado (pode ser chamada em background)
-def processar_dados_em_background(data):
-    
-    try:
-        with app.app_context():
-            # Atualizar saldo
-            atualizar_saldo_com_consumo()
-            
-            # Salvar no banco
-            energy_entries = preparar_energy_entries(data)
-            salvar_energy_entries(energy_entries)
-            
-            # Controlar relés
-            verificar_e_controlar_reles()
-            db.session.commit()
-            
-            print("✅ Processamento em background concluído")
-    except Exception as e:
-        print(f"❌ Erro em background: {e}")
 #======================================
     # ENVIO DE COMANDOS
 #======================================
 @app.route('/api/comandos', methods=['GET'])
 def obter_comandos():
+    """
+    Sem parâmetros: entrega no máximo um comando e responde logo (dado
+    logo por executado — firmwares antigos não confirmam).
+    ?espera=N (long-poll): fica à espera até N segundos que chegue um
+    comando e entrega TODOS os pendentes em "comandos", cada um com o seu
+    id; o ESP confirma-os no pedido seguinte com ?ack=id1,id2. Os que não
+    forem confirmados voltam a ser entregues.
+    """
     api_key = request.args.get('api_key')
     if not api_key or api_key not in API_KEYS:
         return jsonify({"error": "Unauthorized"}), 401
 
-    with dados_lock:
-        if comandos_pendentes:
-            return jsonify({"comando": comandos_pendentes.pop(0)})
+    confirmar_comandos(ler_identificadores(request.args.get("ack")))
+
+    espera = request.args.get("espera", type=float)
+    if espera is not None:
+        espera = max(0.0, min(espera, app.config["COMANDOS_ESPERA_MAX"]))
+        comandos = sinal_comandos.esperar(lambda: retirar_comandos(COMANDOS_POR_ENTREGA), espera)
+        if comandos:
+            print(f"➡️ ENTREGANDO {len(comandos)} COMANDO(S) AO ESP: {[c['comando'] for c in comandos]}")
+        return jsonify({"comando": comandos[0]["comando"] if comandos else "", "comandos": comandos})
+
+    comandos = retirar_comandos(1, confirmar=True)
+    if comandos:
+        return jsonify({"comando": comandos[0]["comando"]})
     return jsonify({"comando": ""})
 
+# ==========================================================
+# 🔹 /api/sync → uma só ida e volta por ciclo do ESP
+# ==========================================================
+def erro_secoes_telemetria(data):
+    """
+    Texto do erro se alguma secção de leituras do /api/sync não tiver o
+    tipo esperado (pzemN: objeto ou lista; amostras: lista), senão None
+    """
+    if "amostras" in data and not isinstance(data["amostras"], list):
+        return "'amostras' deve ser uma lista"
+    for i in [1, 2]:
+        pzem_key = f"pzem{i}"
+        if pzem_key in data and not isinstance(data[pzem_key], (dict, list)):
+            return f"'{pzem_key}' deve ser um objeto ou uma lista"
+    return None
+
+def ingerir_telemetria(data):
+    """
+    Leituras do /api/sync (formato clássico ou lote) → resumo para o ESP.
+
+    Os estados de relés que o ESP reporta não são gravados: chegariam à
+    base só no flush seguinte, depois de um comando entretanto pedido,
+    e desfaziam-no (e a versão "reles" subia com um estado velho). No
+    /api/sync quem manda é a base; o ESP acompanha pelos comandos e
+    confirma-os com ack.
+    """
+    if not any(chave in data for chave in ("pzem1", "pzem2", "amostras")):
+        return {"aceite": True, "registos": 0}
+
+    erro = erro_secoes_telemetria(data)
+    if erro:
+        return {"aceite": False, "erro": erro}
+
+    if payload_em_lote(data):
+        linhas, rejeitadas = extrair_amostras_lote(data)
+        limite = app.config["INGESTAO_LOTE_MAX_AMOSTRAS"]
+        if len(linhas) + rejeitadas > limite:
+            return {"aceite": False, "erro": f"Lote excede o máximo de {limite} amostras"}
+        lote = ingerir_lote(linhas, rejeitadas)
+        registos = None if lote is None else lote["aceites"]
+    else:
+        registos = ingerir_leituras(data)
+
+    if registos is None:
+        return {"aceite": False, "erro": "Fila de ingestão cheia"}
+    return {"aceite": True, "registos": registos}
+
+def intervalo_sincronizacao(telemetria, comandos, esperou_ms):
+    """ms até ao próximo /api/sync recomendados ao ESP"""
+    if comandos:
+        return 0  # confirmar já e ver se há mais
+    if not telemetria["aceite"] or fila_ingestao.profundidade() >= fila_ingestao.capacidade / 2:
+        return app.config["SYNC_INTERVALO_MAX_MS"]  # backpressure: a ingestão está atrasada
+    return max(0, app.config["SYNC_INTERVALO_MS"] - esperou_ms)
+
+@app.route('/api/sync', methods=['POST'])
+def sincronizar_esp():
+    """
+    Junta num só pedido (um só handshake TLS no ESP) o que antes eram
+    /api/dados, /api/ldr, /api/comandos e /api/reles. Corpo:
+      api_key, pzem1/pzem2 (ou lote), reles (ignorados, ver
+      ingerir_telemetria), ldr {valorLuz, R1},
+      ack "7.3,9.1", versao_reles (a da última lista recebida), espera (s)
+    Resposta: comandos por executar (long-poll até 'espera' segundos se
+    não houver nenhum), a lista de relés só se a versão mudou e
+    proximo_envio_ms.
+    """
+    inicio = time.monotonic()
+    data = request.get_json(force=True, silent=True)
+    if not data or data.get('api_key') not in API_KEYS:
+        return jsonify({"error": "Unauthorized"}), 401
+
+    # Leituras estragadas não podem impedir a entrega de comandos e acks
+    try:
+        telemetria = ingerir_telemetria(data)
+    except Exception as e:
+        print(f"❌ Erro ao ingerir leituras do /api/sync: {e}")
+        telemetria = {"aceite": False, "erro": "Leituras inválidas"}
+
+    if isinstance(data.get("ldr"), dict):
+        registar_ldr(data["ldr"])
+
+    confirmar_comandos(ler_identificadores(data.get("ack")))
+
+    try:
+        espera = max(0.0, min(float(data.get("espera") or 0), app.config["COMANDOS_ESPERA_MAX"]))
+    except (TypeError, ValueError):
+        espera = 0.0
+    comandos = sinal_comandos.esperar(lambda: retirar_comandos(COMANDOS_POR_ENTREGA), espera)
+    if comandos:
+        print(f"➡️ ENTREGANDO {len(comandos)} COMANDO(S) AO ESP: {[c['comando'] for c in comandos]}")
+
+    # Versão lida antes da lista: uma alteração entretanto obriga a nova leitura
+    valores = estado_vivo.obter_varios(["versao:epoca", "versao:reles"], 0)
+    reles = {"versao": f"{valores['versao:epoca']}.{valores['versao:reles']}"}
+    if data.get("versao_reles") != reles["versao"]:
+        reles["lista"] = [r.to_dict() for r in Rele.query.all()]
+
+    esperou_ms = round((time.monotonic() - inicio) * 1000)
+    return jsonify({
+        "status": "success",
+        "telemetria": telemetria,
+        "comandos": comandos,
+        "reles": reles,
+        "proximo_envio_ms": intervalo_sincronizacao(telemetria, comandos, esperou_ms),
+    })
+
 # -----------------------------
 # Rotas de dashboard e status
 # -----------------------------
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    with dados_lock:
-        consumo_total = dados_pzem['pzem1']['energy'] + dados_pzem['pzem2']['energy']
-        meta = 5000
-        economia = max(0, ((meta - consumo_total)/meta)*100)
-        pico_hoje = max(dados_pzem['pzem1']['power'], dados_pzem['pzem2']['power'])
-        hora_pico = datetime.now().strftime("%H:%M")
-        pzem_status = {
-            'pzem1': dados_pzem['pzem1']['conectado'],
-            'pzem2': dados_pzem['pzem2']['conectado']
-        }
-        last_update = dados_pzem['pzem1']['ultima_atualizacao'].strftime("%H:%M:%S") if dados_pzem['pzem1']['ultima_atualizacao'] else datetime.now().strftime("%H:%M:%S")
-        reles_db = Rele.query.all()
-        return render_template('dashboard.html',
-                               dados_pzem=dados_pzem,
-                               reles=[r.to_dict() for r in reles_db],
-                               economia=round(economia,1),
-                               pico_hoje=round(pico_hoje,1),
-                               hora_pico=hora_pico,
-                               now=datetime.now(),
-                               pzem_status=pzem_status,
-                               last_update=last_update)
+    dados_pzem = ler_dados_pzem()
+    consumo_total = dados_pzem['pzem1']['energy'] + dados_pzem['pzem2']['energy']
+    meta = 5000
+    economia = max(0, ((meta - consumo_total)/meta)*100)
+    pico_hoje = max(dados_pzem['pzem1']['power'], dados_pzem['pzem2']['power'])
+    hora_pico = datetime.now().strftime("%H:%M")
+    pzem_status = {
+        'pzem1': dados_pzem['pzem1']['conectado'],
+        'pzem2': dados_pzem['pzem2']['conectado']
+    }
+    last_update = dados_pzem['pzem1']['ultima_atualizacao'].strftime("%H:%M:%S") if dados_pzem['pzem1']['ultima_atualizacao'] else datetime.now().strftime("%H:%M:%S")
+    reles_db = Rele.query.all()
+    return render_template('dashboard.html',
+                           dados_pzem=dados_pzem,
+                           reles=[r.to_dict() for r in reles_db],
+                           economia=round(economia,1),
+                           pico_hoje=round(pico_hoje,1),
+                           hora_pico=hora_pico,
+                           now=datetime.now(),
+                           pzem_status=pzem_status,
+                           last_update=last_update)
+
+def calcular_dashboard():
+    """Todas as consultas do dashboard (ver dashboard_data para o cache)"""
+    dados_pzem = ler_dados_pzem()
+    reles_db = Rele.query.all()
+    
+    # Obter dados do banco/histórico
+    pico_hoje = obter_pico_do_dia()
+    pico_semanal = obter_pico_semanal()
+    pico_mensal = obter_pico_mensal()
+    picos_semana_atual = obter_picos_semana_atual()
+    energia_atual = obter_energia_atual()
+    
+    # Dados históricos (exemplo - você pode implementar a lógica real)
+    historical = {
+        "labels": [f"{i}:00" for i in range(24)],
+        "values": [dados_pzem['pzem1']['power'] + dados_pzem['pzem2']['power'] for i in range(24)]
+    }
+    
+    reles_chart = {
+        "labels": [r.nome for r in reles_db],
+        "values": [r.estado for r in reles_db]
+    }
+    
+    return {
+        "pzem1": dados_pzem['pzem1'],
+        "pzem2": dados_pzem['pzem2'],
+        "reles": [r.to_dict() for r in reles_db],
+        "historical": historical,
+        "peaks": picos_semana_atual,  # ✅ Agora vem do banco - picos de cada dia da semana
+        "reles_chart": reles_chart,
+        "peak_today": pico_hoje,  # ✅ Pico do dia do banco
+        "peak_weekly": pico_semanal,  # ✅ Novo: Pico semanal
+        "peak_monthly": pico_mensal,  # ✅ Novo: Pico mensal
+        "energia_atual": energia_atual,  # ✅ Energia atual (saldo)
+        
+    }
 
 @app.route('/api/dashboard-data')
 @login_required
 def dashboard_data():
-    with dados_lock:
-        reles_db = Rele.query.all()
-        
-        # Obter dados do banco/histórico
-        pico_hoje = obter_pico_do_dia()
-        pico_semanal = obter_pico_semanal()
-        pico_mensal = obter_pico_mensal()
-        picos_semana_atual = obter_picos_semana_atual()
-        energia_atual = obter_energia_atual()
-        
-        # Dados históricos (exemplo - você pode implementar a lógica real)
-        historical = {
-            "labels": [f"{i}:00" for i in range(24)],
-            "values": [dados_pzem['pzem1']['power'] + dados_pzem['pzem2']['power'] for i in range(24)]
-        }
-        
-        reles_chart = {
-            "labels": [r.nome for r in reles_db],
-            "values": [r.estado for r in reles_db]
-        }
-        
-        return jsonify({
-            "pzem1": dados_pzem['pzem1'],
-            "pzem2": dados_pzem['pzem2'],
-            "reles": [r.to_dict() for r in reles_db],
-            "historical": historical,
-            "peaks": picos_semana_atual,  # ✅ Agora vem do banco - picos de cada dia da semana
-            "reles_chart": reles_chart,
-            "peak_today": pico_hoje,  # ✅ Pico do dia do banco
-            "peak_weekly": pico_semanal,  # ✅ Novo: Pico semanal
-            "peak_monthly": pico_mensal,  # ✅ Novo: Pico mensal
-            "energia_atual": energia_atual,  # ✅ Energia atual (saldo)
-            
-        })
+    # Um único snapshot para todos os separadores abertos: só é recalculado
+    # quando chegam leituras, mudam relés/configuração ou expira o TTL.
+    escopos = ("pzem", "picos", "reles", "config")
+    ttl = app.config["DASHBOARD_CACHE_TTL"]
+    return resposta_condicional(
+        "dashboard", escopos,
+        lambda: snapshot_em_cache("dashboard", escopos, ttl, calcular_dashboard),
+        ttl=ttl
+    )
 
 @app.route('/api/status-pzem')
 @login_required
 def status_pzem():
-    with dados_lock:
-        agora = datetime.now(timezone.utc)
-        return jsonify({
-            "pzem1": dados_pzem['pzem1']['ultima_atualizacao'] and (agora - dados_pzem['pzem1']['ultima_atualizacao']).total_seconds() < 60,
-            "pzem2": dados_pzem['pzem2']['ultima_atualizacao'] and (agora - dados_pzem['pzem2']['ultima_atualizacao']).total_seconds() < 60
-        })
+    dados_pzem = ler_dados_pzem()
+    agora = datetime.now(timezone.utc)
+    return jsonify({
+        "pzem1": dados_pzem['pzem1']['ultima_atualizacao'] and (agora - dados_pzem['pzem1']['ultima_atualizacao']).total_seconds() < 60,
+        "pzem2": dados_pzem['pzem2']['ultima_atualizacao'] and (agora - dados_pzem['pzem2']['ultima_atualizacao']).total_seconds() < 60
+    })
+
+# ==========================================================
+# 🔹 /api/stream → Server-Sent Events para o dashboard
+# ==========================================================
+# Leituras ao vivo, LDR, relés e saldo empurrados assim que mudam (ver
+# eventos.py), em vez de cada separador fazer polling de 2 em 2 segundos.
+hub_eventos = HubEventos(
+    estado_vivo,
+    {
+        "pzem": ("pzem", ler_dados_pzem),
+        "ldr": ("ldr", ler_ldr),
+        "reles": ("reles", lambda: [r.to_dict() for r in Rele.query.all()]),
+        "config": ("saldo", obter_energia_atual),
+    },
+    serializar=app.json.dumps,
+    contexto=app.app_context,
+    intervalo=app.config["SSE_INTERVALO"],
+    heartbeat=app.config["SSE_HEARTBEAT"],
+    duracao_max=app.config["SSE_DURACAO_MAX"],
+    max_clientes=app.config["SSE_MAX_CLIENTES"],
+)
+
+@app.route('/api/stream')
+@login_required
+def stream_eventos():
+    # Cada ligação ocupa uma thread do worker: acima do limite o cliente
+    # volta ao polling (o dashboard.js trata do 503)
+    if not hub_eventos.entrar():
+        return jsonify({"success": False, "message": "Demasiadas ligações em tempo real"}), 503
+
+    ultimo_id = request.headers.get("Last-Event-ID") or request.args.get("ultimo_id")
+    resposta = Response(
+        hub_eventos.eventos(ultimo_id),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"},
+    )
+    resposta.call_on_close(hub_eventos.sair)
+    return resposta
 
                         # -----------------------------
                         # CRUD Relés
@@ -2576,8 +4004,8 @@ def enviar_comando():
     if not comando:
         return jsonify({"success": False, "error": "Comando inválido"}), 400
 
-    with dados_lock:
-        comandos_pendentes.append(comando)
+    enfileirar_comando(comando)
+    db.session.commit()
     return jsonify({"success": True, "message": "Comando enviado com sucesso"})
 @app.route('/api/comandos', methods=['GET'])
 def obter_comando_esp():
@@ -2586,11 +4014,11 @@ def obter_comando_esp():
     if api_key not in API_KEYS:
         return jsonify({"comando": ""})
 
-    with dados_lock:
-        if comandos_pendentes:
-            comando = comandos_pendentes.pop(0)
-            print(f"➡️ ENTREGANDO COMANDO AO ESP: {comando}")
-            return jsonify({"comando": comando})
+    comandos = retirar_comandos(1, confirmar=True)
+    if comandos:
+        comando = comandos[0]["comando"]
+        print(f"➡️ ENTREGANDO COMANDO AO ESP: {comando}")
+        return jsonify({"comando": comando})
 
     return jsonify({"comando": ""})
 
@@ -2604,12 +4032,14 @@ def debug_comandos():
     else:
         auth = "anónimo"
 
-    with dados_lock:
-        return jsonify({
-            "auth": auth,
-            "quantidade": len(comandos_pendentes),
-            "comandos": list(comandos_pendentes)
-        })
+    # Fila inteira (no máximo um por relé + avulsos), com as latências
+    # pedido → entrega → confirmação do ESP
+    comandos = ComandoESP.query.order_by(ComandoESP.prioridade, ComandoESP.criado_em).all()
+    return jsonify({
+        "auth": auth,
+        "quantidade": sum(1 for c in comandos if not c.confirmado_em),
+        "comandos": [c.to_dict() for c in comandos]
+    })
 
 # ==========================================================
 # 🔹 /api/reles (GET) → Listar relés (para ESP e web)
@@ -2617,14 +4047,12 @@ def debug_comandos():
 @app.route('/api/reles', methods=['GET'])
 def listar_reles():
     api_key = request.args.get('api_key')
-    if api_key and api_key in API_KEYS:
-        # Chamada do ESP8266
-        reles = [r.to_dict() for r in Rele.query.all()]
-        return jsonify({"success": True, "reles": reles})
-    elif current_user.is_authenticated:
-        # Chamada do painel web
-        reles = [r.to_dict() for r in Rele.query.all()]
-        return jsonify({"success": True, "reles": reles})
+    if (api_key and api_key in API_KEYS) or current_user.is_authenticated:
+        # Chamada do ESP8266 ou do painel web (o ESP também manda If-None-Match)
+        return resposta_condicional(
+            "reles", ("reles",),
+            lambda: {"success": True, "reles": [r.to_dict() for r in Rele.query.all()]}
+        )
     else:
         return jsonify({"success": False, "error": "Unauthorized"}), 401
 # ==========================================================
@@ -2954,6 +4382,9 @@ def obter_limites_globais():
 @login_required
 def status_reles_completo():
     """Retorna status completo dos relés para o dashboard"""
+    return resposta_condicional("reles-status", ("reles", "config"), calcular_status_reles)
+
+def calcular_status_reles():
     reles = Rele.query.order_by(Rele.prioridade).all()
     config = Configuracao.query.first()
     
@@ -2990,11 +4421,11 @@ def status_reles_completo():
             "pode_controlar_manual": not rele.modo_automatico
         })
     
-    return jsonify({
+    return {
         "success": True,
         "saldo_global": round(saldo_global, 2),
         "reles": reles_formatados
-    })
+    }
 
 # ==========================================================
 # 🔹 /api/reles/<id>/toggle-mode → Alternar entre Manual/Automático (CORRIGIDA)
@@ -3076,6 +4507,7 @@ def sistema_info():
     config = Configuracao.query.first()
     
     # Calcular consumo total
+    dados_pzem = ler_dados_pzem()
     consumo_total = dados_pzem['pzem1']['power'] + dados_pzem['pzem2']['power']
     
     # Calcular previsão
@@ -1,4 +1,5 @@
 import os
+import tempfile
 from datetime import timedelta
 
 basedir = os.path.abspath(os.path.dirname(__file__))
@@ -42,3 +43,106 @@ class Config:
     API_KEYS = {
         "SUA_CHAVE_API_SECRETA": "ESP8266"
     }
+
+    # =========================================================
+    # 📡 COMANDOS PARA O ESP (long-poll em /api/comandos?espera=N)
+    # =========================================================
+    # Máximo de segundos que um pedido pode ficar à espera e de quanto em
+    # quanto tempo se verifica um comando enfileirado noutro worker.
+    COMANDOS_ESPERA_MAX = float(os.environ.get("COMANDOS_ESPERA_MAX", 25))
+    COMANDOS_INTERVALO_SINAL = float(os.environ.get("COMANDOS_INTERVALO_SINAL", 0.25))
+    # Segundos sem ack do ESP até um comando entregue voltar a ser entregue
+    COMANDOS_REENTREGA = float(os.environ.get("COMANDOS_REENTREGA", 10))
+
+    # =========================================================
+    # 🔁 SINCRONIZAÇÃO DO ESP (/api/sync)
+    # =========================================================
+    # Intervalo recomendado ao ESP entre sincronizações (inclui o tempo
+    # que o pedido fica à espera de comandos) e o que se pede quando a
+    # fila de ingestão passa de meio cheia ou recusa as leituras.
+    SYNC_INTERVALO_MS = int(os.environ.get("SYNC_INTERVALO_MS", 5000))
+    SYNC_INTERVALO_MAX_MS = int(os.environ.get("SYNC_INTERVALO_MAX_MS", 30000))
+
+    # =========================================================
+    # ⚡ ESTADO VIVO (leituras PZEM, LDR, sinais)
+    # =========================================================
+    # "memoria" → um único processo (dev); "sqlite" → ficheiro WAL
+    # partilhado por todos os workers do gunicorn (produção)
+    ESTADO_VIVO_BACKEND = os.environ.get(
+        "ESTADO_VIVO_BACKEND",
+        "sqlite" if os.environ.get("DATABASE_URL") else "memoria"
+    )
+    ESTADO_VIVO_CAMINHO = os.environ.get(
+        "ESTADO_VIVO_CAMINHO",
+        os.path.join(tempfile.gettempdir(), "autoprego_estado_vivo.db")
+    )
+
+    # =========================================================
+    # 📊 DASHBOARD
+    # =========================================================
+    # Snapshot de /api/dashboard-data partilhado por todos os clientes;
+    # é invalidado pela ingestão e por alterações de relés/configuração,
+    # e no máximo recalculado a cada TTL segundos mesmo sem alterações.
+    DASHBOARD_CACHE_TTL = float(os.environ.get("DASHBOARD_CACHE_TTL", 30))
+
+    # /api/stream (Server-Sent Events): segundos entre verificações de
+    # alterações, entre heartbeats e até o browser religar; ligações
+    # simultâneas por worker (cada uma ocupa uma thread do gunicorn).
+    SSE_INTERVALO = float(os.environ.get("SSE_INTERVALO", 0.25))
+    SSE_HEARTBEAT = float(os.environ.get("SSE_HEARTBEAT", 15))
+    SSE_DURACAO_MAX = float(os.environ.get("SSE_DURACAO_MAX", 300))
+    SSE_MAX_CLIENTES = int(os.environ.get("SSE_MAX_CLIENTES", 12))
+
+    # =========================================================
+    # 📑 RELATÓRIOS EM SEGUNDO PLANO
+    # =========================================================
+    # Tarefas a correr ao mesmo tempo por worker, máximo por executar e
+    # segundos que o resultado de uma tarefa terminada fica disponível.
+    RELATORIO_TAREFAS_MAX = int(os.environ.get("RELATORIO_TAREFAS_MAX", 2))
+    RELATORIO_TAREFAS_PENDENTES = int(os.environ.get("RELATORIO_TAREFAS_PENDENTES", 20))
+    RELATORIO_TAREFAS_RETENCAO = int(os.environ.get("RELATORIO_TAREFAS_RETENCAO", 3600))
+
+    # Sub-consultas de um relatório executadas ao mesmo tempo (cada uma com
+    # a sua ligação do pool) e tempo máximo de cada uma, em segundos.
+    RELATORIO_CONSULTAS_PARALELAS = int(os.environ.get("RELATORIO_CONSULTAS_PARALELAS", 4))
+    RELATORIO_CONSULTA_TIMEOUT = float(os.environ.get("RELATORIO_CONSULTA_TIMEOUT", 30))
+
+    # Métricas de custo/eficiência (analitica.py): série por minuto até
+    # este número de dias, por hora acima disso.
+    ANALITICA_MINUTOS_ATE_DIAS = int(os.environ.get("ANALITICA_MINUTOS_ATE_DIAS", 31))
+
+    # =========================================================
+    # 🔢 CONTADOR DE ENERGIA DOS PZEM
+    # =========================================================
+    # Fim de escala do contador acumulado (PZEM-004T: 9999.99 kWh); um
+    # recuo perto deste valor é rollover, noutro ponto é reset.
+    PZEM_ENERGIA_MAX_KWH = float(os.environ.get("PZEM_ENERGIA_MAX_KWH", 10000))
+
+    # =========================================================
+    # 📈 GRÁFICOS
+    # =========================================================
+    # Pontos devolvidos por /api/grafico e /api/historico-consumo-mensal
+    # (reduzidos com LTTB ou min/max); o cliente pode pedir até o limite.
+    GRAFICO_MAX_PONTOS = int(os.environ.get("GRAFICO_MAX_PONTOS", 1500))
+    GRAFICO_MAX_PONTOS_LIMITE = int(os.environ.get("GRAFICO_MAX_PONTOS_LIMITE", 10000))
+
+    # =========================================================
+    # 🗜️ COMPRESSÃO DAS RESPOSTAS (br / gzip)
+    # =========================================================
+    # Respostas JSON/texto acima de MIN_BYTES são comprimidas com o que o
+    # cliente aceitar (br só se o pacote brotli estiver instalado).
+    COMPRESSAO_MIN_BYTES = int(os.environ.get("COMPRESSAO_MIN_BYTES", 1024))
+    COMPRESSAO_NIVEL_GZIP = int(os.environ.get("COMPRESSAO_NIVEL_GZIP", 6))  # 1-9
+    COMPRESSAO_NIVEL_BR = int(os.environ.get("COMPRESSAO_NIVEL_BR", 4))  # 0-11
+
+    # =========================================================
+    # 📦 INGESTÃO EM LOTE (ESP → /api/dados/lote)
+    # =========================================================
+    # Máximo de amostras aceites por pedido (somando todos os PZEMs)
+    INGESTAO_LOTE_MAX_AMOSTRAS = int(os.environ.get("INGESTAO_LOTE_MAX_AMOSTRAS", 720))
+
+    # Fila write-behind: o pedido só enfileira, uma thread grava em lotes
+    INGESTAO_ASSINCRONA = os.environ.get("INGESTAO_ASSINCRONA", "1") == "1"
+    INGESTAO_FILA_CAPACIDADE = int(os.environ.get("INGESTAO_FILA_CAPACIDADE", 10000))  # amostras
+    INGESTAO_FLUSH_LOTE = int(os.environ.get("INGESTAO_FLUSH_LOTE", 500))  # amostras por INSERT
+    INGESTAO_FLUSH_INTERVALO = float(os.environ.get("INGESTAO_FLUSH_INTERVALO", 2.0))  # segundos
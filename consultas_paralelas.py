@@ -0,0 +1,56 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FuturoExpirado
+
+from sqlalchemy import text
+
+
+# ==========================================================
+# CONSULTAS INDEPENDENTES EM PARALELO (relatórios)
+# ==========================================================
+# Cada consulta corre numa thread com o seu próprio app context, logo com
+# a sua sessão e a sua ligação do pool. A latência passa a ser a da
+# consulta mais lenta em vez da soma de todas. Os resultados são devolvidos
+# pela ordem em que as consultas foram declaradas, seja qual for a ordem
+# em que terminam.
+
+
+class ConsultaExpirada(TimeoutError):
+    """Uma consulta do relatório excedeu o tempo máximo"""
+
+
+class ExecutorConsultas:
+    def __init__(self, app, db, max_paralelas=4, timeout=30):
+        self.app = app
+        self.db = db
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_paralelas, thread_name_prefix="consulta")
+
+    def _correr(self, funcao, timeout):
+        with self.app.app_context():
+            if self.db.engine.dialect.name == "postgresql":
+                # O Postgres cancela a consulta em vez de a deixar a correr sozinha
+                self.db.session.execute(text(f"SET LOCAL statement_timeout = {int(timeout * 1000)}"))
+            return funcao()
+
+    def executar(self, consultas, timeout=None):
+        """
+        consultas: {nome: funcao sem argumentos} → {nome: resultado}, na
+        mesma ordem. Um erro ou timeout numa consulta é propagado (o da
+        primeira consulta declarada, se houver vários).
+        """
+        timeout = timeout or self.timeout
+        prazo = time.monotonic() + timeout
+        futuros = {nome: self._pool.submit(self._correr, funcao, timeout)
+                   for nome, funcao in consultas.items()}
+
+        resultados = {}
+        try:
+            for nome, futuro in futuros.items():
+                try:
+                    resultados[nome] = futuro.result(timeout=max(0, prazo - time.monotonic()))
+                except FuturoExpirado:
+                    raise ConsultaExpirada(f"A consulta '{nome}' excedeu {timeout:g}s")
+        finally:
+            for futuro in futuros.values():
+                futuro.cancel()
+        return resultados
@@ -0,0 +1,112 @@
+from sqlalchemy import Integer, case, cast, func, select
+
+
+# ==========================================================
+# CONSUMO A PARTIR DO CONTADOR ACUMULADO (energy, kWh)
+# ==========================================================
+# O PZEM devolve um contador de energia acumulado. O consumo entre duas
+# leituras é a diferença entre elas, exceto quando o contador recua:
+#   - perto do fim de escala → deu a volta (rollover): conta o que faltava
+#     até ao máximo mais o valor atual;
+#   - noutro ponto → foi reiniciado (reset): conta desde zero.
+# A mesma regra existe em Python (delta_energia, usada na ingestão) e em
+# SQL (expressao_delta, usada com LAG() nas consultas), para que agregados,
+# relatórios e saldo deem sempre o mesmo resultado.
+
+# Um recuo a partir de 90% do fim de escala é tratado como rollover
+LIMIAR_ROLLOVER = 0.9
+
+
+def delta_energia(anterior, atual, maximo=None):
+    """Consumo entre duas leituras do contador (kWh)"""
+    if atual >= anterior:
+        return atual - anterior
+    if maximo and anterior >= maximo * LIMIAR_ROLLOVER:
+        return maximo - anterior + atual
+    return atual
+
+
+def expressao_delta(anterior, atual, maximo=None):
+    """delta_energia em SQL (anterior NULL → 0)"""
+    ramos = [
+        (anterior.is_(None), 0.0),
+        (atual >= anterior, atual - anterior),
+    ]
+    if maximo:
+        ramos.append((anterior >= maximo * LIMIAR_ROLLOVER, maximo - anterior + atual))
+    return case(*ramos, else_=atual)
+
+
+def _indice_bucket(coluna, inicio, passo, dialeto):
+    """Número do bucket de tamanho 'passo' a contar de 'inicio' (0, 1, 2...)"""
+    segundos = passo.total_seconds()
+    if dialeto == "postgresql":
+        return cast(func.floor(func.extract("epoch", coluna - inicio) / segundos), Integer)
+    # julianday em dias; o CAST trunca, o que é floor para valores >= 0
+    return cast((func.julianday(coluna) - func.julianday(inicio)) * 86400.0 / segundos, Integer)
+
+
+def consulta_consumo(modelo, intervalo, passo=None, dialeto="sqlite", pzem_id=None, maximo=None):
+    """
+    SELECT (bucket, pzem_id, kWh) numa única passagem ordenada pelo índice
+    (pzem_id, timestamp): LAG(energy) por PZEM dá a leitura anterior; a
+    primeira leitura de cada PZEM usa a última antes do intervalo.
+
+    modelo: EnergyData (colunas pzem_id, timestamp, energy).
+    passo: tamanho dos buckets (timedelta) a partir de intervalo.inicio;
+    None → um único bucket (0) para o intervalo inteiro.
+    """
+    leituras = select(
+        modelo.pzem_id,
+        modelo.timestamp,
+        modelo.energy,
+        func.lag(modelo.energy).over(
+            partition_by=modelo.pzem_id, order_by=modelo.timestamp
+        ).label("anterior"),
+    ).where(modelo.timestamp >= intervalo.inicio, modelo.timestamp < intervalo.fim)
+    if pzem_id is not None:
+        leituras = leituras.where(modelo.pzem_id == pzem_id)
+    leituras = leituras.subquery()
+
+    antes = (
+        select(modelo.energy)
+        .where(modelo.pzem_id == leituras.c.pzem_id, modelo.timestamp < intervalo.inicio)
+        .order_by(modelo.timestamp.desc())
+        .limit(1)
+        .correlate(leituras)
+        .scalar_subquery()
+    )
+
+    if passo is None:
+        bucket = cast(0, Integer)
+    else:
+        bucket = _indice_bucket(leituras.c.timestamp, intervalo.inicio, passo, dialeto)
+
+    deltas = select(
+        bucket.label("bucket"),
+        leituras.c.pzem_id,
+        leituras.c.energy,
+        func.coalesce(leituras.c.anterior, antes).label("anterior"),
+    ).subquery()
+
+    return (
+        select(deltas.c.bucket, deltas.c.pzem_id,
+               func.sum(expressao_delta(deltas.c.anterior, deltas.c.energy, maximo)))
+        .group_by(deltas.c.bucket, deltas.c.pzem_id)
+        .order_by(deltas.c.bucket, deltas.c.pzem_id)
+    )
+
+
+def consumo_das_leituras(sessao, modelo, intervalo, passo=None, pzem_id=None, maximo=None):
+    """
+    {(inicio do bucket, pzem_id): kWh} para o intervalo, a partir das
+    leituras brutas (ver consulta_consumo).
+    """
+    dialeto = sessao.get_bind().dialect.name
+    consulta = consulta_consumo(modelo, intervalo, passo, dialeto, pzem_id, maximo)
+
+    consumo = {}
+    for indice, pzem, energia in sessao.execute(consulta):
+        inicio = intervalo.inicio + passo * indice if passo is not None else intervalo.inicio
+        consumo[(inicio, pzem)] = float(energia or 0)
+    return consumo
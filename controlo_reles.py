@@ -0,0 +1,74 @@
+import bisect
+import heapq
+
+
+# ==========================================================
+# ÍNDICE DE LIMIARES DO CONTROLO AUTOMÁTICO DE RELÉS
+# ==========================================================
+# Um relé automático deve estar ligado se saldo > limite_individual e
+# desligado se saldo <= limite_individual. Entre duas avaliações só podem
+# ter de mudar os relés cujo limite ficou entre o saldo anterior e o
+# atual, por isso os limites ficam ordenados em memória e o bisect dá
+# exatamente esses: O(log n + afetados) por ingestão, sem ler a tabela
+# reles. O índice é por processo e guarda a versão "reles" com que foi
+# construído; quando ela muda (limite, modo, relé novo...) reconstrói-se
+# e a avaliação seguinte passa por todos, como antes.
+#
+# Os relés tocados à mão ficam protegidos uns segundos; esses são
+# "adiados" e voltam a ser avaliados quando a proteção acaba, mesmo que o
+# saldo não cruze nenhum limite entretanto.
+#
+# Não é thread-safe: quem usa serializa as avaliações com um lock.
+
+
+class IndiceLimiares:
+    def __init__(self):
+        self._limites = []  # ordenados
+        self._ids = []  # id do relé na mesma posição de _limites
+        self._versao = None
+        self._saldo = None  # saldo da última avaliação (None = avaliar todos)
+        self._adiados = []  # heap [(fim da proteção, id)]
+
+    def desatualizado(self, versao):
+        return versao != self._versao
+
+    def reconstruir(self, versao, reles):
+        """reles: [(limite_individual, id)] dos relés em modo automático"""
+        pares = sorted(reles)
+        self._limites = [limite for limite, _ in pares]
+        self._ids = [rele_id for _, rele_id in pares]
+        self._versao = versao
+        self._saldo = None
+        self._adiados = []
+
+    def descartar(self):
+        """Força reconstrução (ex.: a avaliação falhou a meio)"""
+        self._versao = None
+
+    def confirmar_versao(self, versao):
+        """A versão subiu só por causa de um commit nosso (estados, não limites)"""
+        self._versao = versao
+
+    def adiar(self, rele_id, ate):
+        heapq.heappush(self._adiados, (ate, rele_id))
+
+    def afetados(self, saldo, agora):
+        """
+        ids dos relés a reavaliar com este saldo, e regista-o como avaliado:
+        os de limite em [min(anterior, saldo), max(anterior, saldo)), mais os
+        adiados cuja proteção já acabou. Logo após reconstruir: todos.
+        """
+        if self._saldo is None:
+            ids = set(self._ids)
+        else:
+            inicio = bisect.bisect_left(self._limites, min(self._saldo, saldo))
+            fim = bisect.bisect_left(self._limites, max(self._saldo, saldo))
+            ids = set(self._ids[inicio:fim])
+        self._saldo = saldo
+
+        while self._adiados and self._adiados[0][0] <= agora:
+            ids.add(heapq.heappop(self._adiados)[1])
+        return ids
+
+    def __len__(self):
+        return len(self._ids)
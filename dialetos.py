@@ -0,0 +1,12 @@
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+
+# ==========================================================
+# INSERT ... ON CONFLICT (Postgres em produção, SQLite local)
+# ==========================================================
+
+
+def insert_do_dialeto(dialeto):
+    """insert() com on_conflict_do_* do dialeto da base ('postgresql' ou outro → SQLite)"""
+    return pg_insert if dialeto == "postgresql" else sqlite_insert
@@ -37,17 +37,17 @@ String nomesReles[NUM_RELES] = {
 };
 
 // Intervalos de tempo
-const unsigned long intervaloEnvio = 5000;
-const unsigned long intervaloComandos = 2000;
-const unsigned long intervaloAtualizarNomes = 30000;
+unsigned long intervaloSync = 5000;  // o servidor ajusta-o em cada resposta (proximo_envio_ms)
+const int esperaComandos = 3;  // segundos que o servidor segura o pedido sem comandos
 const float LIMITE_POTENCIA_SEGURANCA = 2000.0;
 
 //Tempos e intervalos de resposta do sistema
 // ==================== VARIÁVEIS GLOBAIS ====================
-unsigned long ultimoEnvio = 0;
-unsigned long ultimaLeituraComandos = 0;
-unsigned long ultimaAtualizacaoNomes = 0;
+unsigned long ultimaSync = 0;
 unsigned long ultimaInfoSistema = 0;
+String etagReles = "";  // ETag da última lista de relés (304 = nada mudou)
+String versaoReles = "";  // versão da lista de relés recebida no /api/sync
+String acksComandos = "";  // ids dos comandos já executados, confirmados no pedido seguinte
 //InicializaçãoInicia o LCD;Inicia o WiFi; Inicializa relésTesta comunicação com os PZEMs; Busca nomes dos relés do servidor;Prepara o sistema para operar
 struct DadosPZEM {
   float voltage;
@@ -123,46 +123,9 @@ mostrarPZEMnoLCD(dadosPzem1);
   Serial.print("Luminosidade: ");
   Serial.println(valorLuz);
 
-  if (deveEnviarDados()) {
-    enviarDadosServidor();
-  }
-
-  // ====================== ENVIO DO LDR + R1 ======================
-  if (WiFi.status() == WL_CONNECTED) {
-      
-      WiFiClientSecure client;
-      client.setInsecure();  // ignora certificados SSL
-
-      HTTPClient http;
-
-      String url = String(serverURL) + "/api/ldr";
-      http.begin(client, url);
-      http.addHeader("Content-Type", "application/json");
-
-      int estadoR1 = digitalRead(R1);
-
-      String payload = "{";
-      payload += "\"api_key\":\"" + apiKey + "\",";
-      payload += "\"valorLuz\":" + String(valorLuz) + ",";
-      payload += "\"R1\":" + String(estadoR1);
-      payload += "}";
-
-      int httpCode = http.POST(payload);
-      String resposta = http.getString();
-
-      Serial.println("ENVIO LDR:");
-      Serial.println(payload);
-      Serial.println("Resposta: " + resposta);
-
-      http.end();
-  }
-
-  if (deveVerificarComandos()) {
-    verificarComandos();
-  }
-  
-  if (deveAtualizarNomes()) {
-    atualizarNomesReles();
+  // Dados, LDR, estados dos relés, comandos e nomes num só pedido
+  if (deveSincronizar()) {
+    sincronizar();
   }
   
   
@@ -301,10 +264,18 @@ HTTPClient http;
   
   http.begin(client, url);
   http.setTimeout(5000); // ⚠️ Timeout de 5 segundos
+  const char* cabecalhos[] = {"ETag"};
+  http.collectHeaders(cabecalhos, 1);
+  if (etagReles.length() > 0) {
+    http.addHeader("If-None-Match", etagReles);
+  }
   
   int httpCode = http.GET();
   
-  if (httpCode == HTTP_CODE_OK) {
+  if (httpCode == HTTP_CODE_NOT_MODIFIED) {
+    Serial.println("Relés sem alterações (304)");
+  } else if (httpCode == HTTP_CODE_OK) {
+    etagReles = http.header("ETag");
     String response = http.getString();
     DynamicJsonDocument doc(2048);
     
@@ -313,25 +284,7 @@ HTTPClient http;
       Serial.print("Erro JSON: ");
       Serial.println(error.c_str());
     } else if (doc["success"] == true) {
-      JsonArray relesArray = doc["reles"];
-      
-      int relesEncontrados = 0;
-      for (int i = 0; i < relesArray.size() && i < NUM_RELES; i++) {
-        JsonObject rele = relesArray[i];
-        nomesReles[i] = rele["nome"].as<String>();
-        estadosReles[i] = rele["estado"];
-        digitalWrite(pinosReles[i], estadosReles[i] ? HIGH : LOW);
-        relesEncontrados++;
-      }
-      
-      Serial.printf("%d relés atualizados do servidor!\n", relesEncontrados);
-      
-      // Mostrar configuração atual
-      Serial.println("CONFIGURAÇÃO DOS RELÉS:");
-      for (int i = 0; i < NUM_RELES; i++) {
-        Serial.printf("  %d. %s - %s\n", i+1, nomesReles[i].c_str(), 
-                      estadosReles[i] ? "LIGADO" : "DESLIGADO");
-      }
+      aplicarListaReles(doc["reles"], true);  // no arranque: estado inicial vem do servidor
     } else {
       Serial.println("Servidor retornou success=false");
     }
@@ -342,13 +295,42 @@ HTTPClient http;
   }
   
   http.end();
-  ultimaAtualizacaoNomes = millis();
 }
 
-// ==================== FUNÇÃO ATUALIZADA: ENVIAR DADOS ====================
-void enviarDadosServidor() {
+// aplicarEstados só no arranque: depois disso os pinos mudam apenas por
+// comandos (executarComando), que o servidor entrega e o ESP confirma.
+// Um estado na lista pode estar atrasado face a um comando já executado.
+void aplicarListaReles(JsonArray relesArray, bool aplicarEstados) {
+  int relesEncontrados = 0;
+  for (int i = 0; i < relesArray.size() && i < NUM_RELES; i++) {
+    JsonObject rele = relesArray[i];
+    nomesReles[i] = rele["nome"].as<String>();
+    if (aplicarEstados) {
+      estadosReles[i] = rele["estado"];
+      digitalWrite(pinosReles[i], estadosReles[i] ? HIGH : LOW);
+    }
+    relesEncontrados++;
+  }
+  
+  Serial.printf("%d relés atualizados do servidor!\n", relesEncontrados);
+  
+  // Mostrar configuração atual
+  Serial.println("CONFIGURAÇÃO DOS RELÉS:");
+  for (int i = 0; i < NUM_RELES; i++) {
+    Serial.printf("  %d. %s - %s\n", i+1, nomesReles[i].c_str(), 
+                  estadosReles[i] ? "LIGADO" : "DESLIGADO");
+  }
+}
+
+// ==================== SINCRONIZAÇÃO COM O SERVIDOR (/api/sync) ====================
+// Um só pedido HTTPS por ciclo: leva as leituras, o LDR, os estados dos
+// relés (informativos) e os acks dos comandos; traz os comandos novos (o servidor segura
+// o pedido até esperaComandos segundos à espera deles), a lista de relés
+// só quando mudou e quando voltar a sincronizar.
+void sincronizar() {
   if (WiFi.status() != WL_CONNECTED) {
-    Serial.println("WiFi desconectado - dados não enviados");
+    Serial.println("WiFi desconectado - sincronização adiada");
+    ultimaSync = millis();
     return;
   }
   
@@ -389,24 +371,65 @@ HTTPClient http;
     rele["estado"] = estadosReles[i];
     rele["pino"] = pinosReles[i];
   }
+
+  // LDR + R1
+  JsonObject ldr = doc.createNestedObject("ldr");
+  ldr["valorLuz"] = valorLuz;
+  ldr["R1"] = digitalRead(R1);
+
+  // Comandos: acks dos executados, e espera pelos novos
+  doc["ack"] = acksComandos;
+  doc["espera"] = esperaComandos;
+  doc["versao_reles"] = versaoReles;
   
   String jsonString;
   serializeJson(doc, jsonString);
   
-  String urlCompleta = String(serverURL) + "/api/dados";
+  String urlCompleta = String(serverURL) + "/api/sync";
   http.begin(client, urlCompleta);
   http.addHeader("Content-Type", "application/json");
-  http.setTimeout(15000);
-  
-  Serial.print("Enviando dados para: ");
-  Serial.println(urlCompleta);
+  http.setTimeout((esperaComandos + 12) * 1000);
   
   int httpCode = http.POST(jsonString);
+  intervaloSync = 5000;  // em caso de erro, tenta de novo com o intervalo normal
   
   if (httpCode == HTTP_CODE_OK) {
-    Serial.println("Dados enviados com sucesso para o servidor!");
+    acksComandos = "";  // o servidor já os registou
+    DynamicJsonDocument resposta(3072);
+    DeserializationError error = deserializeJson(resposta, http.getString());
+
+    if (error) {
+      Serial.print("Erro JSON no sync: ");
+      Serial.println(error.c_str());
+    } else {
+      if (resposta["telemetria"]["aceite"] == false) {
+        Serial.print("Leituras recusadas: ");
+        Serial.println(resposta["telemetria"]["erro"].as<String>());
+      }
+
+      // Lista de relés: só vem quando a versão mudou; só os nomes
+      JsonObject relesServidor = resposta["reles"];
+      if (relesServidor.containsKey("lista")) {
+        aplicarListaReles(relesServidor["lista"], false);
+      }
+      versaoReles = relesServidor["versao"].as<String>();
+
+      // DESLIGAR vêm primeiro; cada relé aparece no máximo uma vez
+      JsonArray comandos = resposta["comandos"];
+      for (JsonObject item : comandos) {
+        String comando = item["comando"].as<String>();
+        Serial.print("Comando recebido: ");
+        Serial.println(comando);
+        executarComando(comando);
+
+        if (acksComandos.length() > 0) acksComandos += ",";
+        acksComandos += item["id"].as<String>();
+      }
+
+      intervaloSync = resposta["proximo_envio_ms"] | 5000;
+    }
   } else if (httpCode > 0) {
-    Serial.print("Erro HTTP no envio: ");
+    Serial.print("Erro HTTP no sync: ");
     Serial.println(httpCode);
   } else {
     Serial.print("Falha de conexão: ");
@@ -414,7 +437,7 @@ HTTPClient http;
   }
   
   http.end();
-  ultimoEnvio = millis();
+  ultimaSync = millis();
 }
 
 // ==================== FUNÇÕES AUXILIARES ====================
@@ -459,40 +482,9 @@ void verificarConexaoWiFi() {
   }
 }
 
-bool deveEnviarDados() { return (millis() - ultimoEnvio >= intervaloEnvio); }
-bool deveVerificarComandos() { return (millis() - ultimaLeituraComandos >= intervaloComandos); }
-bool deveAtualizarNomes() { return (millis() - ultimaAtualizacaoNomes >= intervaloAtualizarNomes); }
+bool deveSincronizar() { return (millis() - ultimaSync >= intervaloSync); }
 bool deveMostrarInformacoes() { return (millis() - ultimaInfoSistema >= 300000); }
 
-void verificarComandos() {
-  if (WiFi.status() != WL_CONNECTED) return;
-  
-WiFiClientSecure client;
-client.setInsecure();
-HTTPClient http;
-
-  String url = String(serverURL) + "/api/comandos?api_key=" + apiKey;
-  http.begin(client, url);
-  http.setTimeout(3000);
-  
-  int httpCode = http.GET();
-  
-  if (httpCode == HTTP_CODE_OK) {
-    String response = http.getString();
-    DynamicJsonDocument doc(256);
-    deserializeJson(doc, response);
-    
-    if (doc.containsKey("comando") && doc["comando"] != "") {
-      Serial.print("Comando recebido: ");
-      Serial.println(doc["comando"].as<String>());
-      executarComando(doc["comando"].as<String>());
-    }
-  }
-  
-  http.end();
-  ultimaLeituraComandos = millis();
-}
-
 void executarComando(String comando) {
     comando.trim();
     comando.toUpperCase();
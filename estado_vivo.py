@@ -0,0 +1,241 @@
+import copy
+import os
+import sqlite3
+import threading
+
+from json_datas import de_json, para_json
+
+
+# ==========================================================
+# ESTADO VIVO PARTILHADO (leituras PZEM, LDR, comandos...)
+# ==========================================================
+# Todos os acessos são O(1) por chave. O backend "memoria" serve para
+# desenvolvimento com um único processo; o backend "sqlite" guarda o
+# estado num ficheiro SQLite em modo WAL partilhado por todos os workers
+# do gunicorn da mesma máquina.
+
+
+class EstadoVivoMemoria:
+    """Backend em memória do processo (apenas um worker)"""
+
+    def __init__(self):
+        self._dados = {}
+        self._filas = {}
+        self._lock = threading.RLock()
+
+    def obter(self, chave, padrao=None):
+        with self._lock:
+            if chave not in self._dados:
+                return copy.deepcopy(padrao)
+            return copy.deepcopy(self._dados[chave])
+
+    def obter_varios(self, chaves, padrao=None):
+        with self._lock:
+            return {c: copy.deepcopy(self._dados.get(c, padrao)) for c in chaves}
+
+    def definir(self, chave, valor):
+        with self._lock:
+            self._dados[chave] = copy.deepcopy(valor)
+
+    def remover(self, chave):
+        with self._lock:
+            self._dados.pop(chave, None)
+
+    def atualizar(self, chave, campos, padrao=None):
+        """Funde 'campos' no dicionário guardado em 'chave' (atómico)"""
+        with self._lock:
+            atual = self._dados.get(chave)
+            if atual is None:
+                atual = copy.deepcopy(padrao) or {}
+            atual.update(copy.deepcopy(campos))
+            self._dados[chave] = atual
+            return copy.deepcopy(atual)
+
+    def trocar(self, chave, valor):
+        """Grava 'valor' e devolve o valor anterior (atómico)"""
+        with self._lock:
+            anterior = self._dados.get(chave)
+            self._dados[chave] = copy.deepcopy(valor)
+            return anterior
+
+    def comparar_e_trocar(self, chave, esperado, valor):
+        """Grava 'valor' só se o atual for 'esperado'; True se gravou (atómico)"""
+        with self._lock:
+            if self._dados.get(chave) != esperado:
+                return False
+            self._dados[chave] = copy.deepcopy(valor)
+            return True
+
+    def incrementar(self, chave, n=1):
+        with self._lock:
+            novo = int(self._dados.get(chave) or 0) + n
+            self._dados[chave] = novo
+            return novo
+
+    def fila_adicionar(self, fila, valor):
+        with self._lock:
+            self._filas.setdefault(fila, []).append(copy.deepcopy(valor))
+
+    def fila_retirar(self, fila, n=1):
+        with self._lock:
+            itens = self._filas.get(fila, [])
+            retirados, self._filas[fila] = itens[:n], itens[n:]
+            return retirados
+
+    def fila_listar(self, fila):
+        with self._lock:
+            return copy.deepcopy(self._filas.get(fila, []))
+
+    def fila_tamanho(self, fila):
+        with self._lock:
+            return len(self._filas.get(fila, []))
+
+
+class EstadoVivoSQLite:
+    """
+    Backend partilhado entre processos: ficheiro SQLite em modo WAL.
+
+    Leituras e escritas são por chave primária; as operações de
+    leitura-modificação-escrita usam BEGIN IMMEDIATE para serem atómicas
+    entre workers.
+    """
+
+    def __init__(self, caminho):
+        self.caminho = caminho
+        self._local = threading.local()
+        pasta = os.path.dirname(os.path.abspath(caminho))
+        os.makedirs(pasta, exist_ok=True)
+
+        con = self._conexao()
+        con.execute("CREATE TABLE IF NOT EXISTS estado (chave TEXT PRIMARY KEY, valor TEXT NOT NULL)")
+        con.execute(
+            "CREATE TABLE IF NOT EXISTS filas ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " fila TEXT NOT NULL,"
+            " valor TEXT NOT NULL)"
+        )
+        con.execute("CREATE INDEX IF NOT EXISTS ix_filas_fila_id ON filas (fila, id)")
+
+    def _conexao(self):
+        # Uma ligação por thread e por processo (o fork do gunicorn não
+        # pode herdar a ligação do processo pai).
+        con = getattr(self._local, "con", None)
+        if con is None or self._local.pid != os.getpid():
+            con = sqlite3.connect(self.caminho, timeout=5.0, isolation_level=None,
+                                  check_same_thread=False)
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            self._local.con = con
+            self._local.pid = os.getpid()
+        return con
+
+    def _transacao(self, funcao):
+        con = self._conexao()
+        con.execute("BEGIN IMMEDIATE")
+        try:
+            resultado = funcao(con)
+        except Exception:
+            con.execute("ROLLBACK")
+            raise
+        con.execute("COMMIT")
+        return resultado
+
+    def _ler(self, con, chave):
+        linha = con.execute("SELECT valor FROM estado WHERE chave = ?", (chave,)).fetchone()
+        return de_json(linha[0]) if linha else None
+
+    def _gravar(self, con, chave, valor):
+        con.execute(
+            "INSERT INTO estado (chave, valor) VALUES (?, ?) "
+            "ON CONFLICT(chave) DO UPDATE SET valor = excluded.valor",
+            (chave, para_json(valor)),
+        )
+
+    def obter(self, chave, padrao=None):
+        valor = self._ler(self._conexao(), chave)
+        return copy.deepcopy(padrao) if valor is None else valor
+
+    def obter_varios(self, chaves, padrao=None):
+        chaves = list(chaves)
+        marcadores = ",".join("?" * len(chaves))
+        linhas = self._conexao().execute(
+            f"SELECT chave, valor FROM estado WHERE chave IN ({marcadores})", chaves
+        ).fetchall()
+        encontrados = {c: de_json(v) for c, v in linhas}
+        return {c: encontrados.get(c, copy.deepcopy(padrao)) for c in chaves}
+
+    def definir(self, chave, valor):
+        self._gravar(self._conexao(), chave, valor)
+
+    def remover(self, chave):
+        self._conexao().execute("DELETE FROM estado WHERE chave = ?", (chave,))
+
+    def atualizar(self, chave, campos, padrao=None):
+        def _op(con):
+            atual = self._ler(con, chave)
+            if atual is None:
+                atual = copy.deepcopy(padrao) or {}
+            atual.update(campos)
+            self._gravar(con, chave, atual)
+            return atual
+        return self._transacao(_op)
+
+    def trocar(self, chave, valor):
+        def _op(con):
+            anterior = self._ler(con, chave)
+            self._gravar(con, chave, valor)
+            return anterior
+        return self._transacao(_op)
+
+    def comparar_e_trocar(self, chave, esperado, valor):
+        def _op(con):
+            if self._ler(con, chave) != esperado:
+                return False
+            self._gravar(con, chave, valor)
+            return True
+        return self._transacao(_op)
+
+    def incrementar(self, chave, n=1):
+        def _op(con):
+            novo = int(self._ler(con, chave) or 0) + n
+            self._gravar(con, chave, novo)
+            return novo
+        return self._transacao(_op)
+
+    def fila_adicionar(self, fila, valor):
+        self._conexao().execute(
+            "INSERT INTO filas (fila, valor) VALUES (?, ?)", (fila, para_json(valor))
+        )
+
+    def fila_retirar(self, fila, n=1):
+        def _op(con):
+            linhas = con.execute(
+                "SELECT id, valor FROM filas WHERE fila = ? ORDER BY id LIMIT ?", (fila, n)
+            ).fetchall()
+            if linhas:
+                con.execute(
+                    f"DELETE FROM filas WHERE id IN ({','.join('?' * len(linhas))})",
+                    [i for i, _ in linhas],
+                )
+            return [de_json(v) for _, v in linhas]
+        return self._transacao(_op)
+
+    def fila_listar(self, fila):
+        linhas = self._conexao().execute(
+            "SELECT valor FROM filas WHERE fila = ? ORDER BY id", (fila,)
+        ).fetchall()
+        return [de_json(v) for (v,) in linhas]
+
+    def fila_tamanho(self, fila):
+        return self._conexao().execute(
+            "SELECT COUNT(*) FROM filas WHERE fila = ?", (fila,)
+        ).fetchone()[0]
+
+
+def criar_estado_vivo(backend, caminho=None):
+    """Fábrica do backend configurado em ESTADO_VIVO_BACKEND"""
+    if backend == "memoria":
+        return EstadoVivoMemoria()
+    if backend == "sqlite":
+        return EstadoVivoSQLite(caminho)
+    raise ValueError(f"Backend de estado vivo desconhecido: {backend}")
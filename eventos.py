@@ -0,0 +1,149 @@
+import json
+import threading
+import time
+from contextlib import nullcontext
+
+
+# ==========================================================
+# SERVER-SENT EVENTS (/api/stream)
+# ==========================================================
+# Um hub por processo. Uma única thread observa os contadores de versão
+# do estado vivo (os mesmos dos snapshots e dos ETags, partilhados por
+# todos os workers); quando um escopo muda, lê o estado desse escopo UMA
+# vez e acorda todos os subscritores do processo. Cada evento leva o
+# estado atual completo do escopo, por isso alterações seguidas são
+# naturalmente fundidas e um cliente atrasado só recebe a última.
+#
+# O id de cada evento é "época:versão1.versão2..." (pela ordem dos
+# escopos). Ao religar, o EventSource manda-o em Last-Event-ID e só são
+# reenviados os escopos que mudaram entretanto.
+
+
+class HubEventos:
+    def __init__(self, estado, escopos, serializar=json.dumps, contexto=nullcontext,
+                 intervalo=0.25, heartbeat=15, duracao_max=300, max_clientes=12):
+        """
+        escopos: {escopo: (nome do evento, funcao sem argumentos → dados)}.
+        As funções correm na thread do hub, dentro de contexto() (p.ex.
+        app.app_context); serializar(dados) → texto JSON numa só linha.
+        """
+        self.estado = estado
+        self.escopos = escopos
+        self.serializar = serializar
+        self.contexto = contexto
+        self.intervalo = intervalo
+        self.heartbeat = heartbeat
+        self.duracao_max = duracao_max
+        self.max_clientes = max_clientes
+
+        self._condicao = threading.Condition()
+        self._versoes = None  # {escopo: versão} da última leitura
+        self._dados = {}  # {escopo: dados já serializados}
+        self._epoca = None
+        self._clientes = 0
+        self._thread = None
+
+    # ------------------------------------------------------
+    # Thread de observação (só corre enquanto houver clientes)
+    # ------------------------------------------------------
+    def _ler_versoes(self):
+        chaves = ["versao:epoca"] + [f"versao:{e}" for e in self.escopos]
+        valores = self.estado.obter_varios(chaves, 0)
+        return str(valores["versao:epoca"]), {e: valores[f"versao:{e}"] for e in self.escopos}
+
+    def _observar(self):
+        while True:
+            with self._condicao:
+                if not self._clientes:
+                    self._thread = None
+                    self._versoes = None  # quem entrar depois espera por uma leitura nova
+                    return
+
+            try:
+                epoca, versoes = self._ler_versoes()
+                alterados = [e for e in self.escopos
+                             if self._versoes is None or versoes[e] != self._versoes[e]]
+                with self.contexto():
+                    novos = {e: self.serializar(self.escopos[e][1]()) for e in alterados}
+            except Exception as e:
+                print(f"⚠️ Hub de eventos: {e}")
+                time.sleep(self.intervalo * 4)
+                continue
+
+            if alterados or epoca != self._epoca:
+                with self._condicao:
+                    self._dados.update(novos)
+                    self._versoes = versoes
+                    self._epoca = epoca
+                    self._condicao.notify_all()
+
+            time.sleep(self.intervalo)
+
+    def _garantir_thread(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._observar, name="hub-eventos", daemon=True)
+            self._thread.start()
+
+    # ------------------------------------------------------
+    # Subscritores
+    # ------------------------------------------------------
+    def entrar(self):
+        """Reserva um lugar; False se o processo já tem max_clientes"""
+        with self._condicao:
+            if self._clientes >= self.max_clientes:
+                return False
+            self._clientes += 1
+            self._garantir_thread()
+            return True
+
+    def sair(self):
+        with self._condicao:
+            self._clientes -= 1
+
+    def _id(self, versoes):
+        return f"{self._epoca}:" + ".".join(str(versoes[e]) for e in self.escopos)
+
+    def _ler_id(self, ultimo_id):
+        """Last-Event-ID → {escopo: versão} já vistas pelo cliente ({} = nenhuma)"""
+        try:
+            epoca, numeros = ultimo_id.split(":", 1)
+            versoes = [int(v) for v in numeros.split(".")]
+        except (AttributeError, ValueError):
+            return {}
+        if epoca != self._epoca or len(versoes) != len(self.escopos):
+            return {}
+        return dict(zip(self.escopos, versoes))
+
+    def eventos(self, ultimo_id=None):
+        """
+        Gerador do corpo text/event-stream para um cliente que já fez
+        entrar(); termina ao fim de duracao_max (o browser religa sozinho
+        com Last-Event-ID). sair() fica a cargo de quem fecha a resposta,
+        porque um gerador que nunca chegou a arrancar não corre o finally.
+        """
+        fim = time.monotonic() + self.duracao_max
+        with self._condicao:
+            while self._versoes is None and time.monotonic() < fim:
+                self._condicao.wait(1)
+            vistas = self._ler_id(ultimo_id)
+
+        yield "retry: 3000\n\n"
+        while time.monotonic() < fim:
+            with self._condicao:
+                pendentes = [e for e in self.escopos if vistas.get(e) != self._versoes[e]]
+                if not pendentes:
+                    self._condicao.wait(min(self.heartbeat, max(0, fim - time.monotonic())))
+                    pendentes = [e for e in self.escopos if vistas.get(e) != self._versoes[e]]
+                versoes = dict(self._versoes)
+                dados = {e: self._dados[e] for e in pendentes}
+
+            if not pendentes:
+                yield ": ping\n\n"
+                continue
+
+            vistas = versoes
+            evento_id = self._id(versoes)
+            yield "".join(
+                f"id: {evento_id}\nevent: {self.escopos[e][0]}\ndata: {dados[e]}\n\n"
+                for e in pendentes
+            )
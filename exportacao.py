@@ -0,0 +1,189 @@
+import csv
+import io
+import zipfile
+import zlib
+from datetime import date, datetime
+from xml.sax.saxutils import escape
+
+from streaming import TAMANHO_BLOCO, agrupar, gerar_json, gerar_ndjson
+
+
+# ==========================================================
+# EXPORTAÇÃO EM STREAMING (CSV, XLSX, NDJSON, JSON)
+# ==========================================================
+# Todas as funções recebem os nomes das colunas e um iterável de tuplos
+# (normalmente um cursor com yield_per) e devolvem um gerador de bytes.
+# Nada é acumulado: o XLSX é escrito num zip sobre um buffer que é
+# esvaziado a cada bloco, por isso a memória não depende do número de linhas.
+
+FORMATOS = {
+    "csv": ("text/csv; charset=utf-8", "csv"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+    "json": ("application/json", "json"),
+}
+
+# Nomes alternativos aceites em ?format=
+ALIASES = {"excel": "xlsx", "xls": "xlsx"}
+
+
+def _texto(valor):
+    if isinstance(valor, datetime):
+        return valor.strftime("%Y-%m-%d %H:%M:%S")
+    if isinstance(valor, date):
+        return valor.isoformat()
+    return valor
+
+
+def gerar_csv(colunas, linhas):
+    """CSV (separador ';' e BOM, como o Excel em PT espera) em blocos"""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=";")
+
+    buffer.write("\ufeff")
+    escritor.writerow(colunas)
+    for linha in linhas:
+        escritor.writerow([_texto(v) for v in linha])
+        if buffer.tell() >= TAMANHO_BLOCO:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+
+# ----------------------------------------------------------
+# XLSX mínimo (uma folha, células inlineStr / numéricas)
+# ----------------------------------------------------------
+_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/worksheets/sheet1.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    '</Types>'
+)
+_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/>'
+    '</Relationships>'
+)
+_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets><sheet name="{nome}" sheetId="1" r:id="rId1"/></sheets>'
+    '</workbook>'
+)
+_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+    'Target="worksheets/sheet1.xml"/>'
+    '</Relationships>'
+)
+_FOLHA_INICIO = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+_FOLHA_FIM = '</sheetData></worksheet>'
+
+
+def _celula(valor):
+    if valor is None:
+        return "<c/>"
+    if isinstance(valor, bool):
+        return f'<c t="b"><v>{int(valor)}</v></c>'
+    if isinstance(valor, (int, float)):
+        return f"<c><v>{valor!r}</v></c>"
+    return f'<c t="inlineStr"><is><t>{escape(str(_texto(valor)))}</t></is></c>'
+
+
+def _linha_xml(valores):
+    return "<row>" + "".join(_celula(v) for v in valores) + "</row>"
+
+
+class _BufferZip(io.RawIOBase):
+    """Destino não-seekable do ZipFile; o gerador vai retirando os bytes"""
+
+    def __init__(self):
+        self.partes = []
+        self.posicao = 0
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self.partes.append(bytes(dados))
+        self.posicao += len(dados)
+        return len(dados)
+
+    def tell(self):
+        return self.posicao
+
+    def retirar(self):
+        dados = b"".join(self.partes)
+        self.partes = []
+        return dados
+
+
+def gerar_xlsx(colunas, linhas, nome_folha="Dados"):
+    """XLSX em streaming: o zip usa descritores de dados, sem voltar atrás"""
+    destino = _BufferZip()
+    with zipfile.ZipFile(destino, "w", compression=zipfile.ZIP_DEFLATED) as arquivo:
+        arquivo.writestr("[Content_Types].xml", _CONTENT_TYPES)
+        arquivo.writestr("_rels/.rels", _RELS)
+        arquivo.writestr("xl/workbook.xml", _WORKBOOK.format(nome=escape(nome_folha[:31])))
+        arquivo.writestr("xl/_rels/workbook.xml.rels", _WORKBOOK_RELS)
+
+        with arquivo.open("xl/worksheets/sheet1.xml", "w", force_zip64=True) as folha:
+            partes = [_FOLHA_INICIO, _linha_xml(colunas)]
+            tamanho = 0
+            for linha in linhas:
+                xml = _linha_xml(linha)
+                partes.append(xml)
+                tamanho += len(xml)
+                if tamanho >= TAMANHO_BLOCO:
+                    folha.write("".join(partes).encode("utf-8"))
+                    partes, tamanho = [], 0
+                    dados = destino.retirar()
+                    if dados:
+                        yield dados
+            partes.append(_FOLHA_FIM)
+            folha.write("".join(partes).encode("utf-8"))
+
+    yield destino.retirar()
+
+
+def gerar_exportacao(formato, colunas, linhas, nome="Dados"):
+    """Gerador de bytes no formato pedido (ver FORMATOS)"""
+    if formato == "csv":
+        return gerar_csv(colunas, linhas)
+    if formato == "xlsx":
+        return gerar_xlsx(colunas, linhas, nome)
+
+    dicionarios = ({c: _texto(v) for c, v in zip(colunas, linha)} for linha in linhas)
+    if formato == "ndjson":
+        texto = gerar_ndjson(dicionarios)
+    else:
+        texto = gerar_json(dicionarios, "dados", {"success": True, "colunas": list(colunas)},
+                           lambda total: {"total_registros": total})
+    return (bloco.encode("utf-8") for bloco in agrupar(texto))
+
+
+def comprimir_gzip(partes, nivel=6):
+    """Comprime um gerador de bytes em gzip à medida que é consumido"""
+    compressor = zlib.compressobj(nivel, zlib.DEFLATED, 31)
+    for parte in partes:
+        dados = compressor.compress(parte)
+        if dados:
+            yield dados
+    yield compressor.flush()
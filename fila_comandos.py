@@ -0,0 +1,82 @@
+import re
+
+from dialetos import insert_do_dialeto
+
+
+# ==========================================================
+# FILA DE COMANDOS PARA O ESP (comandos_esp)
+# ==========================================================
+# Uma linha por relé (chave "rele:N"): um comando novo para o mesmo relé
+# substitui o que ainda lá estiver — vale o último estado pedido — e sobe
+# a versão da linha. Comandos sem relé reconhecível (texto livre vindo do
+# dashboard) ficam cada um na sua linha, com chave NULL, e são apagados
+# quando confirmados. A fila nunca passa de um comando por relé mais os
+# avulsos, por muito que o controlo automático oscile.
+#
+# Os DESLIGAR saem primeiro: perante saldo ou potência no limite, cortar
+# carga é sempre o lado seguro. Cada entrega leva o id "linha.versão" e o
+# ESP devolve-o em ?ack= depois de executar; um ack de uma versão que
+# entretanto foi substituída não confirma a nova. O que ficar entregue sem
+# ack volta a ser entregue (ligar/desligar um relé é idempotente).
+
+PRIORIDADE_DESLIGAR = 0
+PRIORIDADE_NORMAL = 1
+
+# Mesma leitura que o firmware (executarComando): tira " =:-", o número do
+# relé são TODOS os dígitos a seguir a "RELE", a ação vem depois dos "_"
+_RELE = re.compile(r"RELE(\d+)(?!\d)_*(ON|OFF|1|0)")
+
+
+def analisar_comando(comando):
+    """
+    Texto do comando → (chave, prioridade).
+    'RELE2_OFF' → ("rele:2", PRIORIDADE_DESLIGAR); "1"/"0" mandam no relé 1;
+    qualquer outro texto → (None, PRIORIDADE_NORMAL), sem fusão.
+    """
+    texto = comando.strip().upper()
+    for caractere in " =:-":
+        texto = texto.replace(caractere, "")
+
+    if texto in ("1", "0"):
+        numero, ligar = 1, texto == "1"
+    else:
+        correspondencia = _RELE.fullmatch(texto)
+        if not correspondencia:
+            return None, PRIORIDADE_NORMAL
+        numero, ligar = int(correspondencia.group(1)), correspondencia.group(2) in ("ON", "1")
+
+    return f"rele:{numero}", PRIORIDADE_NORMAL if ligar else PRIORIDADE_DESLIGAR
+
+
+def instrucao_enfileirar(tabela, dialeto, valores):
+    """
+    INSERT ... ON CONFLICT (chave) DO UPDATE: o comando novo toma o lugar
+    do anterior do mesmo relé, como se acabasse de ser pedido (versão + 1,
+    por entregar). Linhas com chave NULL nunca entram em conflito.
+    """
+    stmt = insert_do_dialeto(dialeto)(tabela).values(valores)
+    t, novo = tabela.c, stmt.excluded
+
+    return stmt.on_conflict_do_update(index_elements=["chave"], set_={
+        "comando": novo.comando,
+        "prioridade": novo.prioridade,
+        "criado_em": novo.criado_em,
+        "versao": t.versao + 1,
+        "tentativas": 0,
+        "entregue_em": None,
+        "confirmado_em": None,
+    })
+
+
+def identificador(linha_id, versao):
+    return f"{linha_id}.{versao}"
+
+
+def ler_identificadores(texto):
+    """'7.3,9.1' (parâmetro ?ack=) → [(7, 3), (9, 1)]; ignora o que não se perceber"""
+    ids = []
+    for parte in (texto or "").split(","):
+        linha, _, versao = parte.strip().partition(".")
+        if linha.isdigit() and versao.isdigit():
+            ids.append((int(linha), int(versao)))
+    return ids
@@ -0,0 +1,218 @@
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+
+
+class FilaIngestao:
+    """
+    Fila limitada em memória com gravação diferida (write-behind).
+
+    O pedido HTTP só valida e enfileira; uma thread de fundo esvazia a fila
+    em lotes limitados por tamanho (lote_max) ou por tempo (intervalo) e
+    entrega cada lote à função gravar_lote(itens).
+
+    A gravação tem dois passos com tentativas independentes:
+    gravar_lote(itens) grava só as amostras brutas (um commit próprio) e,
+    depois de ter tido sucesso, derivar_lote(itens) atualiza o que se
+    calcula a partir delas (agregados, picos...). Uma falha no segundo
+    passo nunca repete o primeiro — não há amostras duplicadas — nem
+    apaga as amostras já gravadas; os derivados podem ser reconstruídos.
+    """
+
+    def __init__(self, gravar_lote, derivar_lote=None, capacidade=10000, lote_max=500,
+                 intervalo=2.0, tentativas_max=5):
+        self.gravar_lote = gravar_lote
+        self.derivar_lote = derivar_lote
+        self.capacidade = capacidade
+        self.lote_max = lote_max
+        self.intervalo = intervalo
+        self.tentativas_max = tentativas_max
+
+        self._itens = deque()
+        self._amostras_na_fila = 0
+        self._cond = threading.Condition()
+        self._thread = None
+        self._a_gravar = False
+
+        self._metricas = {
+            "amostras_enfileiradas": 0,
+            "amostras_gravadas": 0,
+            "amostras_descartadas": 0,
+            "pedidos_recusados_fila_cheia": 0,
+            "lotes_gravados": 0,
+            "falhas_gravacao": 0,
+            "falhas_derivados": 0,
+            "lotes_sem_derivados": 0,
+            "profundidade_max": 0,
+            "ultimo_lote_amostras": 0,
+            "ultimo_lote_ms": 0.0,
+            "ultimo_flush_em": None,
+            "ultimo_erro": None,
+        }
+
+    # ------------------------------------------------------
+    # Produtor (pedido HTTP)
+    # ------------------------------------------------------
+    def enfileirar(self, amostras, extras=None):
+        """
+        Coloca um pedido (lista de amostras + dados extras) na fila.
+
+        Devolve False quando a fila está cheia (backpressure): o chamador
+        deve responder 503 para o ESP manter as amostras no seu buffer.
+        """
+        n = len(amostras)
+        with self._cond:
+            if self._amostras_na_fila + n > self.capacidade:
+                self._metricas["pedidos_recusados_fila_cheia"] += 1
+                return False
+
+            self._itens.append((amostras, extras or {}))
+            self._amostras_na_fila += n
+            self._metricas["amostras_enfileiradas"] += n
+            self._metricas["profundidade_max"] = max(
+                self._metricas["profundidade_max"], self._amostras_na_fila
+            )
+
+            if self._amostras_na_fila >= self.lote_max:
+                self._cond.notify()
+
+        self._garantir_thread()
+        return True
+
+    def profundidade(self):
+        with self._cond:
+            return self._amostras_na_fila
+
+    def metricas(self):
+        with self._cond:
+            dados = dict(self._metricas)
+            dados["profundidade"] = self._amostras_na_fila
+            dados["pedidos_na_fila"] = len(self._itens)
+            dados["capacidade"] = self.capacidade
+            dados["ocupacao_percent"] = round(self._amostras_na_fila / self.capacidade * 100, 1)
+            dados["lote_max"] = self.lote_max
+            dados["intervalo_flush_s"] = self.intervalo
+            dados["thread_ativa"] = bool(self._thread and self._thread.is_alive())
+        return dados
+
+    # ------------------------------------------------------
+    # Consumidor (thread de fundo)
+    # ------------------------------------------------------
+    def _garantir_thread(self):
+        # Arranque preguiçoso: cada worker do gunicorn cria a sua thread
+        # depois do fork, no primeiro pedido que enfileira.
+        if self._thread and self._thread.is_alive():
+            return
+        with self._cond:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._ciclo, name="fila-ingestao", daemon=True
+            )
+            self._thread.start()
+
+    def _retirar_lote(self):
+        """Retira pedidos até perfazer lote_max amostras (chamar com lock)"""
+        itens = []
+        total = 0
+        while self._itens and (not itens or total + len(self._itens[0][0]) <= self.lote_max):
+            amostras, extras = self._itens.popleft()
+            itens.append((amostras, extras))
+            total += len(amostras)
+        self._amostras_na_fila -= total
+        return itens, total
+
+    def _ciclo(self):
+        while True:
+            with self._cond:
+                prazo = time.monotonic() + self.intervalo
+                while self._amostras_na_fila < self.lote_max:
+                    restante = prazo - time.monotonic()
+                    if restante <= 0:
+                        break
+                    self._cond.wait(restante)
+
+                if not self._itens:
+                    continue
+                itens, total = self._retirar_lote()
+                self._a_gravar = True
+
+            try:
+                self._gravar_com_tentativas(itens, total)
+            finally:
+                with self._cond:
+                    self._a_gravar = False
+                    self._cond.notify_all()
+
+    def _gravar_com_tentativas(self, itens, total):
+        for tentativa in range(1, self.tentativas_max + 1):
+            inicio = time.perf_counter()
+            try:
+                self.gravar_lote(itens)
+            except Exception as e:
+                with self._cond:
+                    self._metricas["falhas_gravacao"] += 1
+                    self._metricas["ultimo_erro"] = str(e)
+                print(f"❌ Falha ao gravar lote da fila ({tentativa}/{self.tentativas_max}): {e}")
+                time.sleep(min(2 ** tentativa, 30))
+                continue
+
+            with self._cond:
+                self._metricas["amostras_gravadas"] += total
+                self._metricas["lotes_gravados"] += 1
+                self._metricas["ultimo_lote_amostras"] = total
+                self._metricas["ultimo_lote_ms"] = round((time.perf_counter() - inicio) * 1000, 1)
+                self._metricas["ultimo_flush_em"] = datetime.now(timezone.utc).isoformat()
+
+            # As amostras já estão gravadas: daqui em diante só se repete o derivar
+            self._derivar_com_tentativas(itens, total)
+            return
+
+        with self._cond:
+            self._metricas["amostras_descartadas"] += total
+        print(f"🗑️ Lote de {total} amostras descartado após {self.tentativas_max} tentativas")
+
+    def _derivar_com_tentativas(self, itens, total):
+        if self.derivar_lote is None:
+            return
+        for tentativa in range(1, self.tentativas_max + 1):
+            try:
+                self.derivar_lote(itens)
+                return
+            except Exception as e:
+                with self._cond:
+                    self._metricas["falhas_derivados"] += 1
+                    self._metricas["ultimo_erro"] = str(e)
+                print(f"❌ Falha ao atualizar derivados do lote ({tentativa}/{self.tentativas_max}): {e}")
+                time.sleep(min(2 ** tentativa, 30))
+
+        with self._cond:
+            self._metricas["lotes_sem_derivados"] += 1
+        print(f"⚠️ Derivados de {total} amostras por atualizar — amostras brutas mantidas "
+              f"(flask reconstruir-agregados / reconstruir-picos)")
+
+    def esvaziar(self, timeout=10.0):
+        """Grava tudo o que estiver na fila (usado no encerramento do processo)"""
+        limite = time.monotonic() + timeout
+        while time.monotonic() < limite:
+            with self._cond:
+                if self._a_gravar:
+                    self._cond.wait(0.1)
+                    continue
+                if not self._itens:
+                    return
+                itens, total = self._retirar_lote()
+            try:
+                self.gravar_lote(itens)
+                with self._cond:
+                    self._metricas["amostras_gravadas"] += total
+                    self._metricas["lotes_gravados"] += 1
+            except Exception as e:
+                print(f"❌ Erro ao esvaziar fila de ingestão: {e}")
+                return
+            if self.derivar_lote is not None:
+                try:
+                    self.derivar_lote(itens)
+                except Exception as e:
+                    print(f"❌ Erro ao atualizar derivados ao esvaziar a fila: {e}")
@@ -0,0 +1,97 @@
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta
+
+from sqlalchemy import and_
+
+
+# ==========================================================
+# INTERVALOS DE TEMPO MEIO-ABERTOS [inicio, fim)
+# ==========================================================
+# Os filtros são sempre "coluna >= inicio AND coluna < fim" sobre a coluna
+# crua, para que o índice (pzem_id, timestamp) possa ser usado. Nunca
+# envolver a coluna em func.date(...) no WHERE.
+
+Intervalo = namedtuple("Intervalo", ["inicio", "fim", "data_inicio", "data_fim"])
+Intervalo.__doc__ = """
+inicio/fim: datetimes UTC do intervalo meio-aberto [inicio, fim).
+data_inicio/data_fim: datas inclusivas, para rótulos e respostas.
+"""
+
+
+class IntervaloInvalido(ValueError):
+    """Período ou datas inválidos (a rota deve responder 400)"""
+
+
+def intervalo_datas(data_inicio, data_fim):
+    """Dias inteiros de data_inicio a data_fim (inclusive)"""
+    if data_fim < data_inicio:
+        raise IntervaloInvalido("A data final é anterior à data inicial")
+    return Intervalo(
+        datetime.combine(data_inicio, time.min),
+        datetime.combine(data_fim + timedelta(days=1), time.min),
+        data_inicio,
+        data_fim,
+    )
+
+
+def intervalo_dia(dia):
+    return intervalo_datas(dia, dia)
+
+
+def intervalo_semana_atual(hoje=None):
+    """Segunda-feira desta semana até hoje"""
+    hoje = hoje or datetime.utcnow().date()
+    return intervalo_datas(hoje - timedelta(days=hoje.weekday()), hoje)
+
+
+def intervalo_mes_atual(hoje=None):
+    hoje = hoje or datetime.utcnow().date()
+    return intervalo_datas(hoje.replace(day=1), hoje)
+
+
+def intervalo_ultimos_dias(dias, hoje=None):
+    """Os últimos N dias, incluindo hoje"""
+    hoje = hoje or datetime.utcnow().date()
+    return intervalo_datas(hoje - timedelta(days=dias - 1), hoje)
+
+
+def _ler_data(valor, nome):
+    if isinstance(valor, date):
+        return valor
+    try:
+        return datetime.strptime(valor, "%Y-%m-%d").date()
+    except (TypeError, ValueError):
+        raise IntervaloInvalido(f"Formato de data inválido em {nome}: {valor!r} (use YYYY-MM-DD)")
+
+
+def intervalo_periodo(periodo, start=None, end=None, hoje=None, max_dias=None):
+    """
+    Converte period/start/end (como enviados pelo front-end) num Intervalo.
+
+    period: day|today, yesterday, week, month ou custom (requer start e end).
+    max_dias: limite opcional de dias para intervalos custom.
+    """
+    hoje = hoje or datetime.utcnow().date()
+
+    if periodo in ("day", "today"):
+        return intervalo_dia(hoje)
+    if periodo == "yesterday":
+        return intervalo_dia(hoje - timedelta(days=1))
+    if periodo == "week":
+        return intervalo_semana_atual(hoje)
+    if periodo == "month":
+        return intervalo_mes_atual(hoje)
+    if periodo == "custom":
+        if not start or not end:
+            raise IntervaloInvalido("Datas customizadas requerem início e fim")
+        intervalo = intervalo_datas(_ler_data(start, "start"), _ler_data(end, "end"))
+        if max_dias is not None and (intervalo.data_fim - intervalo.data_inicio).days > max_dias:
+            raise IntervaloInvalido(f"Intervalo máximo é de {max_dias} dias")
+        return intervalo
+
+    raise IntervaloInvalido("Período inválido")
+
+
+def filtro_intervalo(coluna, intervalo):
+    """Predicado indexável: coluna >= inicio AND coluna < fim"""
+    return and_(coluna >= intervalo.inicio, coluna < intervalo.fim)
@@ -0,0 +1,25 @@
+import json
+from datetime import datetime
+
+
+# ==========================================================
+# JSON COM DATAS (estado vivo e cache de relatórios)
+# ==========================================================
+# Um datetime é gravado como {"$dt": "2024-01-31T12:00:00"} e volta a
+# datetime na leitura; o resto é JSON normal, numa só linha.
+
+
+def para_json(valor):
+    def _padrao(obj):
+        if isinstance(obj, datetime):
+            return {"$dt": obj.isoformat()}
+        raise TypeError(f"Tipo não serializável em JSON: {type(obj).__name__}")
+    return json.dumps(valor, default=_padrao, separators=(",", ":"))
+
+
+def de_json(texto):
+    def _hook(obj):
+        if len(obj) == 1 and "$dt" in obj:
+            return datetime.fromisoformat(obj["$dt"])
+        return obj
+    return json.loads(texto, object_hook=_hook)
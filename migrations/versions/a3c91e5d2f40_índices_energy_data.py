@@ -0,0 +1,42 @@
+"""Índices de tempo em energy_data
+
+Revision ID: a3c91e5d2f40
+Revises: 79fcae7bdac5
+Create Date: 2026-10-18 10:12:41.204113
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3c91e5d2f40'
+down_revision = '79fcae7bdac5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    bind = op.get_bind()
+
+    if bind.dialect.name == 'postgresql':
+        # CONCURRENTLY não bloqueia as escritas do ESP, mas não pode correr
+        # dentro de uma transação
+        with op.get_context().autocommit_block():
+            op.create_index('ix_energy_data_pzem_id_timestamp', 'energy_data',
+                            ['pzem_id', 'timestamp'], unique=False,
+                            postgresql_concurrently=True, if_not_exists=True)
+            # BRIN: minúsculo e ideal para uma coluna que só cresce
+            op.create_index('ix_energy_data_timestamp', 'energy_data',
+                            ['timestamp'], unique=False,
+                            postgresql_using='brin',
+                            postgresql_concurrently=True, if_not_exists=True)
+    else:
+        op.create_index('ix_energy_data_pzem_id_timestamp', 'energy_data',
+                        ['pzem_id', 'timestamp'], unique=False, if_not_exists=True)
+        op.create_index('ix_energy_data_timestamp', 'energy_data',
+                        ['timestamp'], unique=False, if_not_exists=True)
+
+
+def downgrade():
+    op.drop_index('ix_energy_data_timestamp', table_name='energy_data', if_exists=True)
+    op.drop_index('ix_energy_data_pzem_id_timestamp', table_name='energy_data', if_exists=True)
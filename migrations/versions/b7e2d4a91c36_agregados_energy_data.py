@@ -0,0 +1,65 @@
+"""Agregados de energy_data (minuto, hora, dia)
+
+Revision ID: b7e2d4a91c36
+Revises: a3c91e5d2f40
+Create Date: 2026-10-18 11:03:27.518402
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b7e2d4a91c36'
+down_revision = 'a3c91e5d2f40'
+branch_labels = None
+depends_on = None
+
+TABELAS = ('energy_agregado_minuto', 'energy_agregado_hora', 'energy_agregado_dia')
+
+
+def upgrade():
+    # O app também faz db.create_all() no primeiro pedido
+    existentes = sa.inspect(op.get_bind()).get_table_names()
+
+    for tabela in TABELAS:
+        if tabela in existentes:
+            continue
+        op.create_table(tabela,
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('pzem_id', sa.Integer(), nullable=False),
+        sa.Column('bucket_inicio', sa.DateTime(), nullable=False),
+        sa.Column('amostras', sa.Integer(), nullable=False),
+        sa.Column('voltage_min', sa.Float(), nullable=False),
+        sa.Column('voltage_max', sa.Float(), nullable=False),
+        sa.Column('voltage_soma', sa.Float(), nullable=False),
+        sa.Column('voltage_ultimo', sa.Float(), nullable=False),
+        sa.Column('current_min', sa.Float(), nullable=False),
+        sa.Column('current_max', sa.Float(), nullable=False),
+        sa.Column('current_soma', sa.Float(), nullable=False),
+        sa.Column('current_ultimo', sa.Float(), nullable=False),
+        sa.Column('power_min', sa.Float(), nullable=False),
+        sa.Column('power_max', sa.Float(), nullable=False),
+        sa.Column('power_soma', sa.Float(), nullable=False),
+        sa.Column('power_ultimo', sa.Float(), nullable=False),
+        sa.Column('power_max_em', sa.DateTime(), nullable=False),
+        sa.Column('pf_min', sa.Float(), nullable=False),
+        sa.Column('pf_max', sa.Float(), nullable=False),
+        sa.Column('pf_soma', sa.Float(), nullable=False),
+        sa.Column('pf_ultimo', sa.Float(), nullable=False),
+        sa.Column('energy_min', sa.Float(), nullable=False),
+        sa.Column('energy_max', sa.Float(), nullable=False),
+        sa.Column('energy_soma', sa.Float(), nullable=False),
+        sa.Column('energy_ultimo', sa.Float(), nullable=False),
+        sa.Column('energy_delta', sa.Float(), nullable=False),
+        sa.Column('ultimo_em', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('pzem_id', 'bucket_inicio', name=f'uq_{tabela}_pzem_bucket')
+        )
+
+    # Depois do upgrade: flask reconstruir-agregados  (preenche o histórico)
+
+
+def downgrade():
+    for tabela in reversed(TABELAS):
+        op.drop_table(tabela)
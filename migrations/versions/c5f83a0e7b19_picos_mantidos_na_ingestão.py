@@ -0,0 +1,64 @@
+"""Picos mantidos na ingestão (chave única + ocorrido_em)
+
+Revision ID: c5f83a0e7b19
+Revises: b7e2d4a91c36
+Create Date: 2026-10-18 12:26:54.870311
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5f83a0e7b19'
+down_revision = 'b7e2d4a91c36'
+branch_labels = None
+depends_on = None
+
+# tabela → (colunas do período, nome da restrição única)
+PICOS = {
+    'daily_peaks': (('date',), 'uq_daily_peaks_date_pzem'),
+    'weekly_peaks': (('week_start',), 'uq_weekly_peaks_week_pzem'),
+    'monthly_peaks': (('year', 'month'), 'uq_monthly_peaks_year_month_pzem'),
+}
+
+COLUNAS_PERIODO = {
+    'date': sa.Date,
+    'week_start': sa.Date,
+    'year': sa.Integer,
+    'month': sa.Integer,
+}
+
+
+def upgrade():
+    # As tabelas de picos podem já existir (criadas pelo db.create_all() do app)
+    existentes = sa.inspect(op.get_bind()).get_table_names()
+
+    for tabela, (periodo, restricao) in PICOS.items():
+        if tabela in existentes:
+            with op.batch_alter_table(tabela, schema=None) as batch_op:
+                batch_op.add_column(sa.Column('ocorrido_em', sa.DateTime(), nullable=True))
+                batch_op.create_unique_constraint(restricao, [*periodo, 'pzem_id'])
+            continue
+
+        op.create_table(tabela,
+        sa.Column('id', sa.Integer(), nullable=False),
+        *[sa.Column(coluna, COLUNAS_PERIODO[coluna](), nullable=True) for coluna in periodo],
+        sa.Column('pzem_id', sa.Integer(), nullable=False),
+        sa.Column('value', sa.Float(), nullable=False),
+        sa.Column('time', sa.Time(), nullable=False),
+        sa.Column('ocorrido_em', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint(*periodo, 'pzem_id', name=restricao)
+        )
+        for coluna in periodo:
+            op.create_index(f'ix_{tabela}_{coluna}', tabela, [coluna], unique=False)
+
+    # Depois do upgrade: flask reconstruir-picos  (preenche o histórico)
+
+
+def downgrade():
+    for tabela, (periodo, restricao) in PICOS.items():
+        with op.batch_alter_table(tabela, schema=None) as batch_op:
+            batch_op.drop_constraint(restricao, type_='unique')
+            batch_op.drop_column('ocorrido_em')
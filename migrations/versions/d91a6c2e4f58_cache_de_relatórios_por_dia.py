@@ -0,0 +1,39 @@
+"""Cache de relatórios por dia fechado
+
+Revision ID: d91a6c2e4f58
+Revises: c5f83a0e7b19
+Create Date: 2026-10-18 14:02:11.304957
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd91a6c2e4f58'
+down_revision = 'c5f83a0e7b19'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # O app também faz db.create_all() no primeiro pedido
+    if 'relatorio_cache_dia' in sa.inspect(op.get_bind()).get_table_names():
+        return
+
+    op.create_table('relatorio_cache_dia',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('tipo', sa.String(length=20), nullable=False),
+    sa.Column('pzem_id', sa.Integer(), nullable=False),
+    sa.Column('dia', sa.Date(), nullable=False),
+    sa.Column('dados', sa.Text(), nullable=True),
+    sa.Column('criado_em', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('tipo', 'pzem_id', 'dia', name='uq_relatorio_cache_dia_tipo_pzem_dia')
+    )
+    op.create_index('ix_relatorio_cache_dia_dia', 'relatorio_cache_dia', ['dia'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_relatorio_cache_dia_dia', table_name='relatorio_cache_dia')
+    op.drop_table('relatorio_cache_dia')
@@ -0,0 +1,40 @@
+"""Fila de comandos do ESP
+
+Revision ID: e4b7a1c9d3f2
+Revises: d91a6c2e4f58
+Create Date: 2026-10-18 16:40:27.518203
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b7a1c9d3f2'
+down_revision = 'd91a6c2e4f58'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # O app também faz db.create_all() no primeiro pedido
+    if 'comandos_esp' in sa.inspect(op.get_bind()).get_table_names():
+        return
+
+    op.create_table('comandos_esp',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('chave', sa.String(length=20), nullable=True),
+    sa.Column('comando', sa.String(length=100), nullable=False),
+    sa.Column('prioridade', sa.Integer(), nullable=False),
+    sa.Column('versao', sa.Integer(), nullable=False),
+    sa.Column('tentativas', sa.Integer(), nullable=False),
+    sa.Column('criado_em', sa.DateTime(), nullable=False),
+    sa.Column('entregue_em', sa.DateTime(), nullable=True),
+    sa.Column('confirmado_em', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('chave')
+    )
+
+
+def downgrade():
+    op.drop_table('comandos_esp')
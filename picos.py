@@ -0,0 +1,73 @@
+from datetime import timedelta
+
+from dialetos import insert_do_dialeto
+
+
+# ==========================================================
+# PICOS DIÁRIOS / SEMANAIS / MENSAIS (daily_peaks, weekly_peaks...)
+# ==========================================================
+# Cada lote de amostras é reduzido ao máximo de potência por período e
+# PZEM; depois um único upsert "compara e atualiza" por tabela só grava
+# quando o novo valor é maior que o pico guardado.
+
+# Colunas que identificam o período em cada tabela (além de pzem_id)
+CHAVES_PERIODO = {
+    "dia": ("date",),
+    "semana": ("week_start",),
+    "mes": ("year", "month"),
+}
+
+
+def inicio_semana(dia):
+    """Segunda-feira da semana de 'dia'"""
+    return dia - timedelta(days=dia.weekday())
+
+
+def _periodo(nivel, dia):
+    if nivel == "dia":
+        return (dia,)
+    if nivel == "semana":
+        return (inicio_semana(dia),)
+    return (dia.year, dia.month)
+
+
+def candidatos_pico(linhas):
+    """
+    Máximo de potência de cada (período, pzem_id) presente nas linhas.
+
+    Devolve {"dia": [valores], "semana": [...], "mes": [...]}, prontos
+    para instrucao_upsert_pico. Em empate fica a primeira ocorrência.
+    """
+    melhores = {nivel: {} for nivel in CHAVES_PERIODO}
+
+    for linha in linhas:
+        instante = linha["timestamp"]
+        valor = float(linha["power"])
+        dia = instante.date()
+
+        for nivel in CHAVES_PERIODO:
+            chave = _periodo(nivel, dia) + (linha["pzem_id"],)
+            atual = melhores[nivel].get(chave)
+            if atual is None or valor > atual[0] or (valor == atual[0] and instante < atual[1]):
+                melhores[nivel][chave] = (valor, instante)
+
+    candidatos = {}
+    for nivel, colunas in CHAVES_PERIODO.items():
+        candidatos[nivel] = [
+            {**dict(zip(colunas, chave[:-1])), "pzem_id": chave[-1],
+             "value": valor, "time": instante.time(), "ocorrido_em": instante}
+            for chave, (valor, instante) in melhores[nivel].items()
+        ]
+    return candidatos
+
+
+def instrucao_upsert_pico(tabela, nivel, dialeto, valores):
+    """INSERT ... ON CONFLICT DO UPDATE ... WHERE novo valor > valor guardado"""
+    stmt = insert_do_dialeto(dialeto)(tabela).values(valores)
+    novo = stmt.excluded
+
+    return stmt.on_conflict_do_update(
+        index_elements=[*CHAVES_PERIODO[nivel], "pzem_id"],
+        set_={"value": novo.value, "time": novo.time, "ocorrido_em": novo.ocorrido_em},
+        where=novo.value > tabela.c.value,
+    )
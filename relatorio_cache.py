@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta
+
+from dialetos import insert_do_dialeto
+from json_datas import de_json, para_json
+
+
+# ==========================================================
+# CACHE DE RELATÓRIOS POR DIA FECHADO (relatorio_cache_dia)
+# ==========================================================
+# Um dia anterior a hoje (UTC) já não recebe leituras novas, por isso o
+# seu resultado em cada relatório (consumo, picos...) é guardado uma vez
+# por (tipo, pzem_id, dia) e reaproveitado. Só o dia de hoje é sempre
+# recalculado. Leituras atrasadas ou reconstruções apagam os dias afetados.
+#
+# Um relatório que leu o dia antes de uma leitura atrasada e grava depois
+# de ela o apagar deixaria na cache um valor velho. Por isso cada dia é
+# gravado com a versão dos dados lida ANTES do cálculo (nº de amostras do
+# dia nos agregados, que só sobe) e só é reaproveitado enquanto a versão
+# atual for a mesma; senão é recalculado e substituído.
+
+# pzem_id gravado quando o relatório cobre todos os PZEMs
+TODOS_PZEMS = 0
+
+
+def dias_do_intervalo(intervalo):
+    """Todas as datas de data_inicio a data_fim (inclusive)"""
+    dia = intervalo.data_inicio
+    while dia <= intervalo.data_fim:
+        yield dia
+        dia += timedelta(days=1)
+
+
+def dia_fechado(dia, hoje=None):
+    return dia < (hoje or datetime.utcnow().date())
+
+
+def serializar(valor, versao):
+    """(valor do dia, versão dos dados) → texto JSON (valor None = dia sem leituras)"""
+    return para_json({"v": versao, "d": valor})
+
+
+def desserializar(texto):
+    """Texto JSON → (versão, valor); linhas sem versão nunca coincidem"""
+    if texto is None:
+        return None, None
+    guardado = de_json(texto)
+    if not isinstance(guardado, dict) or "v" not in guardado:
+        return None, None
+    return guardado["v"], guardado["d"]
+
+
+def instrucao_guardar(tabela, dialeto, valores):
+    """
+    INSERT ... ON CONFLICT DO UPDATE: o dia pode já lá estar com uma
+    versão antiga (ou ter sido gravado agora por outro worker — o último
+    ganha, e se for o mais velho a próxima leitura volta a calcular)
+    """
+    stmt = insert_do_dialeto(dialeto)(tabela).values(valores)
+    return stmt.on_conflict_do_update(
+        index_elements=["tipo", "pzem_id", "dia"],
+        set_={"dados": stmt.excluded.dados, "criado_em": stmt.excluded.criado_em},
+    )
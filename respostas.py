@@ -0,0 +1,134 @@
+import gzip
+
+from flask import request
+from flask.json.provider import DefaultJSONProvider
+
+from exportacao import comprimir_gzip
+
+try:
+    import orjson
+except ImportError:  # opcional: sem ele fica o json da biblioteca padrão
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # opcional: sem ele só se negocia gzip
+    brotli = None
+
+
+# ==========================================================
+# JSON RÁPIDO (orjson, se estiver instalado)
+# ==========================================================
+# Mesmo formato que o provider por omissão do Flask: datas em RFC 822
+# (o orjson passa-as ao 'default' do Flask), chaves ordenadas e chaves
+# não-texto convertidas. Em cima disso serializa arrays NumPy e escreve
+# bytes diretamente na resposta, sem passar por str.
+
+class JSONRapido(DefaultJSONProvider):
+    def _opcoes(self, indentar=False):
+        opcoes = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+        if self.sort_keys:
+            opcoes |= orjson.OPT_SORT_KEYS
+        if indentar:
+            opcoes |= orjson.OPT_INDENT_2
+        return opcoes
+
+    def _bytes(self, obj, indentar=False):
+        return orjson.dumps(obj, default=self.default, option=self._opcoes(indentar))
+
+    def dumps(self, obj, **kwargs):
+        # Argumentos específicos do json (cls, indent=4...) → biblioteca padrão
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        try:
+            return self._bytes(obj).decode("utf-8")
+        except orjson.JSONEncodeError:
+            return super().dumps(obj)
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+
+        obj = self._prepare_response_obj(args, kwargs)
+        indentar = (self.compact is None and self._app.debug) or self.compact is False
+        try:
+            corpo = self._bytes(obj, indentar) + b"\n"
+        except orjson.JSONEncodeError:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(corpo, mimetype=self.mimetype)
+
+
+# ==========================================================
+# COMPRESSÃO DAS RESPOSTAS (br / gzip negociados)
+# ==========================================================
+# after_request: comprime respostas acima de um tamanho mínimo quando o
+# cliente aceita. Os relatórios JSON em streaming são comprimidos em gzip
+# à medida que são gerados (o tamanho não se conhece de antemão); ficam de
+# fora os outros streams, os ficheiros estáticos (direct passthrough), as
+# respostas já codificadas (ex.: /api/export) e os tipos que não comprimem.
+
+TIPOS_COMPRIMIVEIS = (
+    "application/json",
+    "application/x-ndjson",
+    "application/javascript",
+    "text/",
+    "image/svg+xml",
+    "application/octet-stream",  # séries ?format=f32 (os deltas de tempo comprimem muito)
+)
+
+
+def escolher_codificacao(pedido):
+    """'br', 'gzip' ou None, pela preferência (q) do Accept-Encoding"""
+    aceites = pedido.accept_encodings
+    opcoes = [("br", aceites["br"]), ("gzip", aceites["gzip"])] if brotli else [("gzip", aceites["gzip"])]
+    melhor, qualidade = max(opcoes, key=lambda opcao: opcao[1])
+    return melhor if qualidade > 0 else None
+
+
+def comprimir(dados, codificacao, nivel_gzip=6, nivel_br=4):
+    if codificacao == "br":
+        return brotli.compress(dados, quality=nivel_br)
+    return gzip.compress(dados, compresslevel=nivel_gzip, mtime=0)
+
+
+def ativar_compressao(app):
+    """Regista o after_request; níveis e limiar vêm de app.config (COMPRESSAO_*)"""
+
+    @app.after_request
+    def comprimir_resposta(resposta):
+        if (resposta.status_code != 200
+                or resposta.direct_passthrough
+                or "Content-Encoding" in resposta.headers
+                or not (resposta.mimetype or "").startswith(TIPOS_COMPRIMIVEIS)):
+            return resposta
+
+        if resposta.is_streamed:
+            if resposta.mimetype != "application/json":
+                return resposta
+            resposta.vary.add("Accept-Encoding")
+            if request.accept_encodings["gzip"] > 0:
+                resposta.response = comprimir_gzip(resposta.iter_encoded(), app.config["COMPRESSAO_NIVEL_GZIP"])
+                resposta.headers["Content-Encoding"] = "gzip"
+            return resposta
+
+        resposta.vary.add("Accept-Encoding")
+        dados = resposta.get_data()
+        if len(dados) < app.config["COMPRESSAO_MIN_BYTES"]:
+            return resposta
+
+        codificacao = escolher_codificacao(request)
+        if codificacao is None:
+            return resposta
+
+        resposta.set_data(comprimir(dados, codificacao,
+                                    app.config["COMPRESSAO_NIVEL_GZIP"],
+                                    app.config["COMPRESSAO_NIVEL_BR"]))
+        resposta.headers["Content-Encoding"] = codificacao
+        return resposta
+
+    return comprimir_resposta
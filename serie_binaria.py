@@ -0,0 +1,65 @@
+import json
+import struct
+from datetime import datetime
+
+import numpy as np
+from flask import Response, request
+
+
+# ==========================================================
+# SÉRIES EM BINÁRIO COLUNAR (?format=f32)
+# ==========================================================
+# Alternativa compacta ao JSON dos gráficos: o front-end embrulha cada
+# coluna num Float32Array sem fazer parse (ver static/js/serie_binaria.js).
+# Tudo em little-endian, com cada bloco alinhado a 4 bytes:
+#
+#   0   4s  "SRF1"
+#   4   H   versão do formato (1)
+#   6   H   número de colunas
+#   8   I   número de pontos (n)
+#   12  I   bytes do cabeçalho JSON (múltiplo de 4, com espaços no fim)
+#   16  d   t0: segundos desde 1970 do primeiro ponto (UTC)
+#   24  ..  cabeçalho JSON: {"colunas": [...], ...metadados}
+#   ..  n × int32    segundos desde o ponto anterior (o primeiro é 0)
+#   ..  n × float32  por cada coluna, pela ordem de "colunas"
+
+MAGIC = b"SRF1"
+VERSAO = 1
+MIMETYPE = "application/octet-stream"
+_CABECALHO = struct.Struct("<4sHHIId")
+
+_EPOCA = datetime(1970, 1, 1)
+
+
+def pedido_binario():
+    """True se o cliente pediu ?format=f32 ou Accept: application/octet-stream"""
+    if request.args.get("format") == "f32":
+        return True
+    return MIMETYPE in request.headers.get("Accept", "")
+
+
+def codificar_serie(instantes, colunas, meta=None):
+    """
+    instantes: datetimes (naive = UTC) por ordem crescente;
+    colunas: {nome: valores}, cada uma com len(instantes) valores (None → 0).
+    """
+    segundos = np.fromiter(((i - _EPOCA).total_seconds() for i in instantes),
+                           dtype=np.float64, count=len(instantes))
+    t0 = float(segundos[0]) if len(segundos) else 0.0
+    deltas = np.diff(np.floor(segundos).astype(np.int64), prepend=int(t0))
+
+    texto = json.dumps({"colunas": list(colunas), **(meta or {})}, ensure_ascii=False).encode("utf-8")
+    texto += b" " * (-len(texto) % 4)
+
+    partes = [
+        _CABECALHO.pack(MAGIC, VERSAO, len(colunas), len(instantes), len(texto), t0),
+        texto,
+        deltas.astype("<i4").tobytes(),
+    ]
+    for valores in colunas.values():
+        partes.append(np.array([v or 0.0 for v in valores], dtype="<f4").tobytes())
+    return b"".join(partes)
+
+
+def resposta_serie_binaria(instantes, colunas, meta=None):
+    return Response(codificar_serie(instantes, colunas, meta), mimetype=MIMETYPE)
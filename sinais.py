@@ -0,0 +1,49 @@
+import threading
+import time
+
+
+# ==========================================================
+# SINAIS ENTRE THREADS E WORKERS (long-poll)
+# ==========================================================
+# Um Sinal junta uma threading.Condition (acorda na hora as threads do
+# mesmo processo) com um contador no estado vivo (visto pelos outros
+# workers do gunicorn). Quem espera dorme na Condition e só lê o contador
+# a cada 'intervalo' segundos — uma leitura por chave, nunca a operação
+# cara (ex.: retirar da fila, que é uma transação de escrita).
+
+
+class Sinal:
+    def __init__(self, estado, nome, intervalo=0.25):
+        self.estado = estado
+        self.chave = f"sinal:{nome}"
+        self.intervalo = intervalo
+        self._condicao = threading.Condition()
+
+    def versao(self):
+        return self.estado.obter(self.chave, 0)
+
+    def avisar(self):
+        """Chamar depois de produzir (ex.: depois de enfileirar)"""
+        self.estado.incrementar(self.chave)
+        with self._condicao:
+            self._condicao.notify_all()
+
+    def esperar(self, obter, timeout):
+        """
+        Chama obter() e, enquanto devolver algo vazio, espera por um aviso
+        (deste ou de outro worker) até 'timeout' segundos. Devolve o último
+        resultado de obter().
+        """
+        prazo = time.monotonic() + timeout
+        while True:
+            # Versão lida ANTES de obter(): um aviso entre os dois não se perde
+            vista = self.versao()
+            resultado = obter()
+            if resultado or time.monotonic() >= prazo:
+                return resultado
+
+            while time.monotonic() < prazo:
+                with self._condicao:
+                    self._condicao.wait(min(self.intervalo, max(0, prazo - time.monotonic())))
+                if self.versao() != vista:
+                    break
@@ -7,6 +7,8 @@ const state = {
         relesChart: null,
         gaugeChart: null
     },
+    // 'semana' → série que vem em /api/dashboard-data; número → /api/pico/serie?dias=N
+    picosDias: 'semana',
     reles: {
         currentPage: 1,
         perPage: 5,
@@ -83,7 +85,16 @@ function inicializarGraficos() {
                 maintainAspectRatio: false,
                 plugins: {
                     legend: { position: 'top', labels: { font: { size: 14, weight: '600' } } },
-                    title: { display: true, text: 'Picos de Consumo', font: { size: 16, weight: '700' } }
+                    title: { display: true, text: 'Picos de Consumo', font: { size: 16, weight: '700' } },
+                    tooltip: {
+                        callbacks: {
+                            // Hora do pico de cada dia
+                            afterLabel: (ctx) => {
+                                const hora = ctx.chart.$picosHoras?.[ctx.dataIndex];
+                                return hora ? `às ${hora}` : '';
+                            }
+                        }
+                    }
                 },
                 scales: {
                     y: { beginAtZero: true, title: { display: true, text: 'Watts', font: { size: 14, weight: '600' } }, grid: { color: 'rgba(0, 0, 0, 0.1)' } },
@@ -222,6 +233,32 @@ async function atualizarKPIs(data) {
   
 }
 
+// Gráfico de picos diários (semana atual ou últimos N dias)
+function desenharPicos(serie, titulo) {
+    const chart = state.charts.peakChart;
+    if (!chart || !serie?.labels) return;
+
+    chart.data.labels = serie.labels;
+    chart.data.datasets[0].data = serie.values;
+    chart.$picosHoras = serie.times || [];
+    chart.options.plugins.title.text = titulo;
+    chart.update();
+}
+
+async function atualizarPicosUltimosDias() {
+    const dias = state.picosDias;
+    try {
+        const response = await fetch(`/api/pico/serie?dias=${dias}`);
+        if (!response.ok) throw new Error('Erro na resposta da API');
+        const serie = await response.json();
+        if (dias === state.picosDias) {
+            desenharPicos(serie, `Picos de Consumo - Últimos ${dias} dias`);
+        }
+    } catch (error) {
+        console.error('Erro ao carregar série de picos:', error);
+    }
+}
+
 // Atualizar gráficos
 function atualizarGraficos(data) {
     if (!data.historical?.labels || !data.historical?.values || !data.peaks?.labels || !data.peaks?.values || !data.reles_chart?.labels || !data.reles_chart?.values) {
@@ -233,13 +270,12 @@ function atualizarGraficos(data) {
 
 
     if (state.charts.peakChart) {
-        // ✅ AGORA: Gráfico mostra picos de cada dia da semana atual
-        state.charts.peakChart.data.labels = data.peaks.labels;
-        state.charts.peakChart.data.datasets[0].data = data.peaks.values;
-        state.charts.peakChart.update();
-        
-        // ✅ Atualizar título do gráfico
-        state.charts.peakChart.options.plugins.title.text = 'Picos de Consumo - Esta Semana';
+        if (state.picosDias === 'semana') {
+            // ✅ AGORA: Gráfico mostra picos de cada dia da semana atual
+            desenharPicos(data.peaks, 'Picos de Consumo - Esta Semana');
+        } else {
+            atualizarPicosUltimosDias();
+        }
     }
 
     if (state.charts.relesChart) {
@@ -368,7 +404,14 @@ async function atualizarLDR() {
         const data = await resp.json();
 
         if (!data.success) return;
+        mostrarLDR(data);
+    } catch (e) {
+        console.log("Erro ao buscar LDR:", e);
+    }
+}
 
+function mostrarLDR(data) {
+    try {
         // Atualizar luminosidade
         document.getElementById("r1-luz").innerText = data.valorLuz;
 
@@ -389,7 +432,7 @@ async function atualizarLDR() {
         }
 
     } catch (e) {
-        console.log("Erro ao buscar LDR:", e);
+        console.log("Erro ao mostrar LDR:", e);
     }
 }
  
@@ -460,13 +503,12 @@ function atualizarGraficos(data) {
     }
 
     if (state.charts.peakChart) {
-        // ✅ AGORA: Gráfico mostra picos de cada dia da semana atual
-        state.charts.peakChart.data.labels = data.peaks.labels;
-        state.charts.peakChart.data.datasets[0].data = data.peaks.values;
-        state.charts.peakChart.update();
-        
-        // ✅ Atualizar título do gráfico
-        state.charts.peakChart.options.plugins.title.text = 'Picos de Consumo - Esta Semana';
+        if (state.picosDias === 'semana') {
+            // ✅ AGORA: Gráfico mostra picos de cada dia da semana atual
+            desenharPicos(data.peaks, 'Picos de Consumo - Esta Semana');
+        } else {
+            atualizarPicosUltimosDias();
+        }
     }
 
     if (state.charts.relesChart) {
@@ -2063,8 +2105,7 @@ document.addEventListener('DOMContentLoaded', function() {
     atualizarLDR();
     carregarConfigTaxas();
     carregarConfigPreco();
-   setInterval(atualizarLDR, 2000);
-    setInterval(atualizarDashboard, 5000);
+    iniciarTempoReal();
 
   // iniciarDashboard();
     const elements = {
@@ -2074,9 +2115,21 @@ document.addEventListener('DOMContentLoaded', function() {
         editReleForm: getElement('edit-rele-form'),
         taxConfigForm: getElement('price-tax-config-form'),
         searchReles: getElement('search-reles'),
-        filterPzem: getElement('filter-pzem')
+        filterPzem: getElement('filter-pzem'),
+        peakDias: document.getElementById('peak-dias')
     };
 
+    if (elements.peakDias) {
+        elements.peakDias.addEventListener('change', function() {
+            state.picosDias = this.value === 'semana' ? 'semana' : parseInt(this.value, 10);
+            if (state.picosDias === 'semana') {
+                atualizarDashboard();
+            } else {
+                atualizarPicosUltimosDias();
+            }
+        });
+    }
+
 
     if (elements.reportPeriod) {
         elements.reportPeriod.addEventListener('change', function() {
@@ -2133,6 +2186,85 @@ document.addEventListener('DOMContentLoaded', function() {
 });
 
 
+// =========================
+// ⚡ TEMPO REAL (Server-Sent Events em /api/stream)
+// =========================
+// Com o stream ligado, leituras, LDR, relés e saldo chegam assim que mudam
+// e o polling fica só como reserva lenta (gráficos e picos). Sem
+// EventSource, ou se o servidor recusar a ligação, volta o polling normal.
+const tempoReal = { ativo: false, intervalos: [] };
+
+function iniciarPolling(rapido) {
+    tempoReal.intervalos.forEach(clearInterval);
+    tempoReal.intervalos = rapido
+        ? [setInterval(atualizarLDR, 2000), setInterval(atualizarDashboard, 5000)]
+        : [setInterval(atualizarDashboard, 30000)];
+}
+
+// Gráficos, KPIs e picos: no máximo uma vez a cada 'espera' ms
+function limitarFrequencia(func, espera) {
+    let ultima = 0;
+    let agendada = null;
+    return function () {
+        if (agendada) return;
+        const falta = Math.max(0, ultima + espera - Date.now());
+        agendada = setTimeout(() => {
+            agendada = null;
+            ultima = Date.now();
+            func();
+        }, falta);
+    };
+}
+
+const atualizarDashboardLimitado = limitarFrequencia(atualizarDashboard, 5000);
+
+function iniciarTempoReal() {
+    if (!window.EventSource) {
+        iniciarPolling(true);
+        return;
+    }
+
+    const fonte = new EventSource('/api/stream');
+
+    fonte.onopen = () => {
+        if (!tempoReal.ativo) {
+            tempoReal.ativo = true;
+            iniciarPolling(false);
+        }
+    };
+
+    fonte.onerror = () => {
+        // CLOSED = o servidor recusou (ex.: 503); senão o browser religa sozinho
+        if (fonte.readyState === EventSource.CLOSED) {
+            tempoReal.ativo = false;
+            iniciarPolling(true);
+            setTimeout(iniciarTempoReal, 60000);
+        }
+    };
+
+    fonte.addEventListener('pzem', (e) => {
+        atualizarDadosPZEM(JSON.parse(e.data));
+        const lastUpdate = getElement('last-update-time');
+        if (lastUpdate) lastUpdate.textContent = new Date().toLocaleTimeString();
+        atualizarDashboardLimitado();
+    });
+
+    fonte.addEventListener('ldr', (e) => mostrarLDR(JSON.parse(e.data)));
+
+    fonte.addEventListener('reles', (e) => {
+        atualizarTabelaReles(JSON.parse(e.data));
+        atualizarDashboardLimitado();
+    });
+
+    fonte.addEventListener('saldo', () => {
+        atualizarDashboardLimitado();
+        const configuracoesTab = getElement('configuracoes');
+        if (configuracoesTab && configuracoesTab.classList.contains('active')) {
+            atualizarInfoSaldoConfig();
+        }
+    });
+}
+
 // =========================
 // 🔄 FUNÇÃO DE RESET DOS KPIs
 // =========================
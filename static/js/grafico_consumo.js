@@ -73,16 +73,25 @@ Chart.register({
     }
 });
 
-// Buscar dados
+// Buscar dados (em binário colunar: bem menos bytes que o JSON em redes lentas)
 async function buscarDadosPzem1() {
     try {
-        const resposta = await fetch('/api/historico-consumo-mensal?_=' + Date.now());
-        
-        if (!resposta.ok) {
-            throw new Error(`Erro HTTP: ${resposta.status}`);
+        const serie = await buscarSerieBinaria('/api/historico-consumo-mensal?_=' + Date.now());
+        if (!serie.binario) {
+            return serie;
         }
-        
-        return await resposta.json();
+
+        const { potencia, tensao, corrente, energia } = serie.colunas;
+        const registos = serie.datas.map((dataHora, i) => ({
+            data_hora: dataHora,
+            timestamp: dataHora,
+            potencia: potencia[i],
+            tensao: tensao[i],
+            corrente: corrente[i],
+            energia: energia[i],
+            device_id: 1
+        }));
+        return { ...serie.meta, registos, total: registos.length };
     } catch (erro) {
         console.error('Erro ao buscar dados:', erro);
         return null;
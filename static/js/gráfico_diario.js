@@ -316,7 +316,7 @@ _setupTooltipCleanup: function() {
             hoje.toISOString().split('T')[0]);
         
         if (start && end) {
-            this.carregarDados(`custom?start=${start}&end=${end}`);
+            this.carregarDados(`custom&start=${start}&end=${end}`);
         }
     },
     
@@ -216,6 +216,43 @@ function applyStyles(element, styleString) {
     Object.assign(element.style, styleObj);
 }
 
+/**
+ * Submete o relatório como tarefa em segundo plano e faz polling do estado
+ * até terminar. Devolve o mesmo JSON que /api/relatorio devolveria.
+ */
+async function executarRelatorioEmTarefa(data, aoProgredir) {
+    const response = await fetch('/api/relatorio/tarefas', {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(data)
+    });
+    const submetido = await response.json();
+    if (!submetido.success) {
+        return submetido;
+    }
+
+    let espera = 500;
+    while (true) {
+        await new Promise(resolve => setTimeout(resolve, espera));
+        espera = Math.min(espera * 1.5, 3000);
+
+        const estado = await (await fetch(submetido.estado_url)).json();
+        if (!estado.success) {
+            return estado;
+        }
+
+        const tarefa = estado.tarefa;
+        if (aoProgredir) {
+            aoProgredir(tarefa.progresso, tarefa.estado);
+        }
+        if (tarefa.estado === 'concluida' || tarefa.estado === 'erro') {
+            return (await fetch(submetido.resultado_url)).json();
+        }
+    }
+}
+
 /**
  * Envia solicitação para gerar relatório
  */
@@ -251,19 +288,16 @@ async function gerarRelatorio() {
                     <span class="visually-hidden">Carregando...</span>
                 </div>
                 <p style="margin-top: 15px; font-size: 1.1rem;">Gerando relatório...</p>
+                <p id="report-progress" style="font-size: 0.9rem;"></p>
             </div>
         `;
         
-        const response = await fetch('/api/relatorio', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify(data)
+        // O relatório corre em segundo plano no servidor; aqui só se consulta o progresso
+        const result = await executarRelatorioEmTarefa(data, (progresso) => {
+            const progressoEl = document.getElementById('report-progress');
+            if (progressoEl) progressoEl.textContent = `${progresso}%`;
         });
         
-        const result = await response.json();
-        
         if (result.success) {
             // Armazenar dados para exportação
             window.currentReportData = result;
@@ -1591,6 +1625,39 @@ function exportData(format) {
     }
 }
 
+/**
+ * Exporta todos os dados do período (leituras agregadas, recargas...) a
+ * partir do servidor. /api/export responde em streaming e o browser grava
+ * o ficheiro diretamente, sem o carregar na memória da página.
+ */
+function exportarDadosServidor(format) {
+    const tipo = document.getElementById('report-type').value;
+    const periodo = document.getElementById('report-period').value;
+    const pzem = document.getElementById('report-pzem').value;
+    const startDate = document.getElementById('start-date').value;
+    const endDate = document.getElementById('end-date').value;
+
+    if (periodo === 'custom' && (!startDate || !endDate)) {
+        showToast('❌ Para período personalizado, informe as datas.', 'warning');
+        return;
+    }
+
+    const params = new URLSearchParams({ format, type: tipo, period: periodo, pzem });
+    if (periodo === 'custom') {
+        params.set('startDate', startDate);
+        params.set('endDate', endDate);
+    }
+
+    const link = document.createElement('a');
+    link.href = `/api/export?${params.toString()}`;
+    link.download = '';
+    document.body.appendChild(link);
+    link.click();
+    document.body.removeChild(link);
+
+    showToast(`📤 Exportação ${format.toUpperCase()} iniciada`, 'info');
+}
+
 /**
  * Exporta para CSV
  */
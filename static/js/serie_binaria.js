@@ -0,0 +1,57 @@
+// ===============================
+// SÉRIES EM BINÁRIO COLUNAR (?format=f32) - ver serie_binaria.py
+// ===============================
+
+const SERIE_BINARIA_MAGIC = 'SRF1';
+
+// ArrayBuffer → { meta, instantes (ms), datas ("YYYY-MM-DD HH:MM:SS", UTC), colunas: {nome: Float32Array} }
+function decodificarSerieBinaria(buffer) {
+    const vista = new DataView(buffer);
+    const magic = String.fromCharCode(...new Uint8Array(buffer, 0, 4));
+    if (magic !== SERIE_BINARIA_MAGIC) {
+        throw new Error('Formato binário desconhecido: ' + magic);
+    }
+
+    const numColunas = vista.getUint16(6, true);
+    const pontos = vista.getUint32(8, true);
+    const bytesMeta = vista.getUint32(12, true);
+    const t0 = vista.getFloat64(16, true);
+
+    const meta = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 24, bytesMeta)));
+    let offset = 24 + bytesMeta;
+
+    const deltas = new Int32Array(buffer, offset, pontos);
+    offset += pontos * 4;
+
+    const instantes = new Float64Array(pontos);
+    const datas = new Array(pontos);
+    let segundos = t0;
+    for (let i = 0; i < pontos; i++) {
+        segundos += deltas[i];
+        instantes[i] = segundos * 1000;
+        datas[i] = new Date(instantes[i]).toISOString().slice(0, 19).replace('T', ' ');
+    }
+
+    const colunas = {};
+    for (let c = 0; c < numColunas; c++) {
+        colunas[meta.colunas[c]] = new Float32Array(buffer, offset, pontos);
+        offset += pontos * 4;
+    }
+
+    return { meta, instantes, datas, colunas };
+}
+
+// fetch de uma série em binário; se o servidor responder JSON (erro ou
+// sem dados) devolve esse JSON tal como veio, com binario = false
+async function buscarSerieBinaria(url) {
+    const separador = url.includes('?') ? '&' : '?';
+    const resposta = await fetch(url + separador + 'format=f32', {
+        headers: { 'Accept': 'application/octet-stream' }
+    });
+
+    const tipo = resposta.headers.get('Content-Type') || '';
+    if (!tipo.startsWith('application/octet-stream')) {
+        return { binario: false, ...(await resposta.json()) };
+    }
+    return { binario: true, ...decodificarSerieBinaria(await resposta.arrayBuffer()) };
+}
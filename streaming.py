@@ -0,0 +1,106 @@
+import json
+
+from flask import Response, has_request_context, request, stream_with_context
+
+
+# ==========================================================
+# RESPOSTAS JSON / NDJSON EM STREAMING
+# ==========================================================
+# Os itens são produzidos por um gerador (normalmente um cursor com
+# yield_per) e escritos à medida que chegam, em blocos de ~64 KB, com
+# Transfer-Encoding: chunked. A memória do pedido fica constante, seja
+# qual for o número de linhas.
+
+FORMATOS = ("ndjson", "json")
+TAMANHO_BLOCO = 64 * 1024
+
+
+def _json(valor):
+    return json.dumps(valor, ensure_ascii=False, separators=(",", ":"))
+
+
+def formato_pedido(valor=None):
+    """
+    Formato de streaming pedido pelo cliente: ?stream=ndjson|json (ou
+    'valor', p.ex. vindo do corpo JSON) ou Accept: application/x-ndjson.
+    None → resposta normal.
+    """
+    if not has_request_context():
+        return valor if valor in FORMATOS else None
+    valor = valor or request.args.get("stream")
+    if valor in FORMATOS:
+        return valor
+    if valor in ("1", "true"):
+        return "json"
+    if "application/x-ndjson" in request.headers.get("Accept", ""):
+        return "ndjson"
+    return None
+
+
+def agrupar(partes):
+    """Junta as partes de texto em blocos de ~TAMANHO_BLOCO"""
+    bloco = []
+    tamanho = 0
+    for parte in partes:
+        bloco.append(parte)
+        tamanho += len(parte)
+        if tamanho >= TAMANHO_BLOCO:
+            yield "".join(bloco)
+            bloco, tamanho = [], 0
+    if bloco:
+        yield "".join(bloco)
+
+
+def gerar_ndjson(itens):
+    """Um objeto JSON por linha; um erro a meio fica como última linha"""
+    try:
+        for item in itens:
+            yield _json(item) + "\n"
+    except Exception as e:
+        print(f"❌ Erro durante streaming NDJSON: {e}")
+        yield _json({"error": str(e)}) + "\n"
+
+
+def gerar_json(itens, chave, cabecalho=None, rodape=None):
+    """
+    {**cabecalho, chave: [itens...], **rodape(total)} escrito aos poucos.
+    rodape é chamado no fim com o número de itens escritos.
+    """
+    yield "{"
+    for nome, valor in (cabecalho or {}).items():
+        yield f"{_json(nome)}:{_json(valor)},"
+    yield f"{_json(chave)}:["
+
+    total = 0
+    erro = None
+    try:
+        for item in itens:
+            yield ("," if total else "") + _json(item)
+            total += 1
+    except Exception as e:
+        print(f"❌ Erro durante streaming JSON: {e}")
+        erro = str(e)
+
+    yield "]"
+    extra = rodape(total) if rodape else {}
+    if erro:
+        extra = {**extra, "success": False, "error": erro}
+    for nome, valor in extra.items():
+        yield f",{_json(nome)}:{_json(valor)}"
+    yield "}"
+
+
+def resposta_stream(formato, itens, chave="registos", cabecalho=None, rodape=None):
+    """Response chunked em NDJSON ou num objeto JSON com a lista em 'chave'"""
+    if formato == "ndjson":
+        corpo = gerar_ndjson(itens)
+        mimetype = "application/x-ndjson"
+    else:
+        corpo = gerar_json(itens, chave, cabecalho, rodape)
+        mimetype = "application/json"
+
+    return Response(
+        stream_with_context(agrupar(corpo)),
+        mimetype=mimetype,
+        headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"},
+    )
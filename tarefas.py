@@ -0,0 +1,133 @@
+import threading
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+
+# ==========================================================
+# TAREFAS EM SEGUNDO PLANO (relatórios longos)
+# ==========================================================
+# O pedido HTTP só submete a tarefa e devolve o id; o trabalho corre num
+# ThreadPoolExecutor com um número máximo de tarefas simultâneas. Estado,
+# progresso e resultado ficam no estado vivo, por isso qualquer worker do
+# gunicorn responde ao polling, não só o que executa a tarefa.
+#
+# Estados: pendente → a_executar → concluida | erro
+
+ESTADOS_FINAIS = ("concluida", "erro")
+
+# Tarefa não terminada há mais do que isto = worker morreu a meio
+ABANDONO = timedelta(hours=24)
+
+
+class FilaTarefasCheia(Exception):
+    """Demasiadas tarefas por executar neste processo (responder 503)"""
+
+
+class GestorTarefas:
+    def __init__(self, estado, max_simultaneas=2, max_pendentes=20, retencao=3600, prefixo="tarefa"):
+        self.estado = estado
+        self.max_pendentes = max_pendentes
+        self.retencao = retencao
+        self.prefixo = prefixo
+        self._executor = ThreadPoolExecutor(max_workers=max_simultaneas, thread_name_prefix=prefixo)
+        self._lock = threading.Lock()
+        self._ativas = 0
+
+    def _chave(self, tarefa_id):
+        return f"{self.prefixo}:{tarefa_id}"
+
+    def submeter(self, funcao, dono=None, descricao=None):
+        """
+        Agenda funcao(progresso) e devolve o estado inicial da tarefa.
+        progresso(percentagem) atualiza o estado; o valor devolvido pela
+        função (serializável em JSON) é o resultado.
+        """
+        with self._lock:
+            if self._ativas >= self.max_pendentes:
+                raise FilaTarefasCheia(f"Já existem {self._ativas} tarefas em curso")
+            self._ativas += 1
+
+        try:
+            self._limpar_antigas()
+
+            tarefa_id = uuid.uuid4().hex
+            info = {
+                "id": tarefa_id,
+                "estado": "pendente",
+                "progresso": 0,
+                "descricao": descricao,
+                "dono": dono,
+                "criada_em": datetime.utcnow(),
+                "iniciada_em": None,
+                "concluida_em": None,
+                "erro": None,
+            }
+            self.estado.definir(self._chave(tarefa_id), info)
+            self.estado.fila_adicionar(f"{self.prefixo}s", tarefa_id)
+
+            self._executor.submit(self._executar, tarefa_id, funcao)
+        except Exception:
+            with self._lock:
+                self._ativas -= 1
+            raise
+        return info
+
+    def _executar(self, tarefa_id, funcao):
+        chave = self._chave(tarefa_id)
+
+        def progresso(percentagem):
+            self.estado.atualizar(chave, {"progresso": max(0, min(int(percentagem), 99))})
+
+        try:
+            self.estado.atualizar(chave, {"estado": "a_executar", "iniciada_em": datetime.utcnow()})
+            resultado = funcao(progresso)
+            self.estado.definir(f"{chave}:resultado", resultado)
+            self.estado.atualizar(chave, {"estado": "concluida", "progresso": 100,
+                                          "concluida_em": datetime.utcnow()})
+        except Exception as e:
+            print(f"❌ Tarefa {tarefa_id} falhou: {e}")
+            traceback.print_exc()
+            self.estado.atualizar(chave, {"estado": "erro", "erro": str(e),
+                                          "concluida_em": datetime.utcnow()})
+        finally:
+            with self._lock:
+                self._ativas -= 1
+
+    def obter(self, tarefa_id):
+        return self.estado.obter(self._chave(tarefa_id))
+
+    def resultado(self, tarefa_id):
+        return self.estado.obter(f"{self._chave(tarefa_id)}:resultado")
+
+    def _limpar_antigas(self):
+        """Remove as tarefas terminadas há mais de 'retencao' segundos (as mais antigas primeiro)"""
+        agora = datetime.utcnow()
+
+        def expirada(tarefa_id):
+            info = self.obter(tarefa_id)
+            if info is None:
+                return True
+            if info["estado"] in ESTADOS_FINAIS:
+                return (agora - info["concluida_em"]).total_seconds() >= self.retencao
+            return agora - info["criada_em"] >= ABANDONO
+
+        expiradas = 0
+        for tarefa_id in self.estado.fila_listar(f"{self.prefixo}s"):
+            if not expirada(tarefa_id):
+                break
+            expiradas += 1
+        if not expiradas:
+            return
+
+        for tarefa_id in self.estado.fila_retirar(f"{self.prefixo}s", expiradas):
+            # Outro worker pode ter limpo ao mesmo tempo: devolver as que ainda valem
+            if not expirada(tarefa_id):
+                self.estado.fila_adicionar(f"{self.prefixo}s", tarefa_id)
+                continue
+            self.estado.remover(self._chave(tarefa_id))
+            self.estado.remover(f"{self._chave(tarefa_id)}:resultado")
+
+    def encerrar(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
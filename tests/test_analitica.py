@@ -0,0 +1,58 @@
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+import analitica
+
+
+# Quatro horas, dois PZEMs, buckets de uma hora:
+#   PZEM 1: 100, 200, 800, 900 W   (limiar 500 W)
+#   PZEM 2:   0, (sem leitura), 0, 1000 W   (limiar 2000 W)
+INICIO = datetime(2026, 1, 1)
+POTENCIAS = {1: [100, 200, 800, 900], 2: [0, None, 0, 1000]}
+LIMIARES = {1: 500.0, 2: 2000.0}
+
+
+def _serie():
+    linhas = [
+        (INICIO + timedelta(hours=h), pzem, w, w, (w or 0) / 1000)
+        for pzem, valores in POTENCIAS.items()
+        for h, w in enumerate(valores)
+        if w is not None
+    ]
+    return analitica.montar_serie(reversed(linhas), 3600)
+
+
+def test_montar_serie_ordena_e_preenche_buckets_em_falta():
+    serie = _serie()
+    assert list(serie.pzems) == [1, 2]
+    assert serie.potencia.tolist() == [[100, 0], [200, 0], [800, 0], [900, 1000]]
+
+
+def test_horas_acima():
+    serie = _serie()
+    assert analitica.horas_acima(serie, LIMIARES) == 2.0
+    # Basta um PZEM acima para a hora contar, e sem limiar nunca está acima
+    assert analitica.horas_acima(serie, {2: 500.0}) == 1.0
+    assert analitica.horas_acima(serie, {}) == 0.0
+    assert analitica.horas_acima(analitica.montar_serie([], 3600), LIMIARES) == 0.0
+
+
+def test_fator_carga():
+    total = _serie().potencia.sum(axis=1)  # 100, 200, 800, 1900
+    assert analitica.fator_carga(total) == pytest.approx(750 / 1900)
+    assert analitica.fator_carga(np.full(5, 300.0)) == 1.0
+    assert analitica.fator_carga(np.zeros(3)) == 0.0
+    assert analitica.fator_carga(np.array([])) == 0.0
+
+
+def test_percentis_potencia():
+    total = _serie().potencia.sum(axis=1)
+    percentis = analitica.percentis_potencia(total)
+    assert list(percentis) == list(analitica.PERCENTIS)
+    # Interpolação linear entre buckets ordenados: 100, 200, 800, 1900
+    assert percentis[50] == pytest.approx(500)
+    assert percentis[90] == pytest.approx(800 + 0.7 * 1100)
+    assert percentis[99] == pytest.approx(800 + 0.97 * 1100)
+    assert analitica.percentis_potencia(np.array([]), (50, 95)) == {50: 0.0, 95: 0.0}